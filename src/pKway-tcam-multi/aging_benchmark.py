@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Hit ratio of the counter aging policies on a synthetic workload.
+
+Every combination of --aging and --aging-period is simulated with
+parallel_simulator.simulate on the same key stream, and the results are
+printed as JSON from the best hit ratio to the worst. The default workload is
+a hotspot whose hot window moves, the case aging is meant for.
+
+The deamortization only ages the r_counter entries below
+generate_file.aged_counters() (2 ** (key_size / 2) of them), so by default the
+workload draws keys of key_size / 2 bits, where the policies make a difference.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+import time
+
+from parallel_simulator import simulate
+from simulator import AGINGS
+from workload import generate_keys, parse_spec
+
+DEFAULT_WORKLOAD = 'hotspot:hot_fraction=0.05,period=20000'
+
+
+def benchmark(keys, geometry, agings, periods, decrement=1, deamortization='unrolled', deamortization_width=1,
+              processes=None):
+    """ Returns one result dict per (aging, period), best hit ratio first. """
+    max_entries_size, main_cache_size, front_cache_size, key_size, front_type, main_type = geometry
+    results = []
+    for aging in agings:
+        for period in periods:
+            start = time.time()
+            cache_bits, front_bits = simulate(keys, max_entries_size, main_cache_size, front_cache_size, key_size,
+                                              front_type, main_type, deamortization, deamortization_width, aging,
+                                              period, decrement, processes=processes)
+            main_hits = int(cache_bits.sum())
+            front_hits = int((front_bits & (cache_bits ^ 1)).sum())
+            results.append({
+                'aging': aging,
+                'aging_period': period,
+                'main_hits': main_hits,
+                'front_hits': front_hits,
+                'hit_ratio': float(main_hits + front_hits) / len(keys) if len(keys) else 0.0,
+                'seconds': time.time() - start,
+            })
+    results.sort(key=lambda result: -result['hit_ratio'])
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Compare counter aging policies on a workload')
+    parser.add_argument('--workload', help='workload.py spec', type=str, required=False, default=DEFAULT_WORKLOAD)
+    parser.add_argument('--workload-key-size', help='Key bits of the workload, key_size / 2 by default',
+                        type=int, required=False, default=None)
+    parser.add_argument('-n', '--requests', type=int, required=False, default=200000)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    parser.add_argument('--max-entries-size', type=int, required=False, default=2)
+    parser.add_argument('--main-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--front-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--front-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--main-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--deamortization', choices=['unrolled', 'compact'], required=False, default='unrolled')
+    parser.add_argument('--deamortization-width', type=int, required=False, default=1)
+    parser.add_argument('--aging', help='Comma separated policies', type=str, required=False,
+                        default=','.join(AGINGS))
+    parser.add_argument('--aging-period', help='Comma separated periods, 0 for the default one',
+                        type=str, required=False, default='0')
+    parser.add_argument('--aging-decrement', type=int, required=False, default=1)
+    parser.add_argument('-j', '--processes', type=int, required=False, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    workload_key_size = args.workload_key_size or args.key_size // 2
+    keys = generate_keys(parse_spec(args.workload, workload_key_size), args.requests, args.seed)
+    geometry = (args.max_entries_size, args.main_cache_size, args.front_cache_size, args.key_size,
+                args.front_type, args.main_type)
+    results = benchmark(keys, geometry, args.aging.split(','), [int(p) for p in args.aging_period.split(',')],
+                        args.aging_decrement, args.deamortization, args.deamortization_width, args.processes)
+    json.dump({'workload': args.workload, 'workload_key_size': workload_key_size, 'requests': args.requests,
+               'results': results}, sys.stdout, indent=2)
+    print()
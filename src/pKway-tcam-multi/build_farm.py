@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Compiles P4kway programs with p4c-bm2-ss through a content-addressed cache.
+
+An artifact is identified by the sha256 of the compiler version, its flags and
+the program source, so regenerating an unchanged program or switching back to
+a geometry that was built before costs a cache lookup instead of a compile.
+Cache misses are compiled in a process pool. The bmv2 JSON and p4info of every
+program are copied next to it (as the exercise Makefile names them: <name>.json
+and <name>.p4.p4info.txt) and a build_report.json lists the compile time and
+artifact sizes of every variant.
+
+    python generate_file.py --max-entries 2:16:2 --build-dir variants
+    python build_farm.py variants -j 8
+
+Takes a build directory with the manifest.json of generate_file.py, or .p4 files.
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+P4C = 'p4c-bm2-ss'
+DEFAULT_FLAGS = ('--p4v', '16')
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'p4kway-build')
+ARTIFACTS = ('program.json', 'program.p4info.txt')
+REPORT = 'build_report.json'
+
+
+def compiler_version(p4c):
+    try:
+        return subprocess.check_output([p4c, '--version'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError) as error:
+        raise RuntimeError("cannot run %s: %s" % (p4c, error))
+
+
+def artifact_key(source, flags, version):
+    digest = hashlib.sha256()
+    for part in (version.encode(), b'\0'.join(flag.encode() for flag in flags), source):
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def compile_into(p4c, flags, program, directory):
+    """ Runs the compiler on program, writing ARTIFACTS into directory. Returns (seconds, log). """
+    json_path, p4info_path = [os.path.join(directory, name) for name in ARTIFACTS]
+    command = [p4c] + list(flags) + ['--p4runtime-files', p4info_path, '-o', json_path, program]
+    start = time.time()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log = process.communicate()[0].decode(errors='replace')
+    seconds = time.time() - start
+    if process.returncode != 0:
+        raise RuntimeError("%s failed on %s:\n%s" % (p4c, program, log))
+    return seconds, log
+
+
+def build_one(job):
+    """ Pool worker: returns the report entry of one program, compiling it on a cache miss. """
+    name, program, output_dir, p4c, flags, version, cache_dir = job
+    with open(program, 'rb') as f:
+        source = f.read()
+    key = artifact_key(source, flags, version)
+    cached = cache_path(cache_dir, key)
+    entry = {'name': name, 'program': program, 'key': key, 'cached': True, 'compile_seconds': 0.0}
+    try:
+        if not os.path.isdir(cached):
+            entry['cached'] = False
+            parent = os.path.dirname(cached)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            staging = tempfile.mkdtemp(prefix='.' + key[:8], dir=parent)
+            try:
+                seconds, _ = compile_into(p4c, flags, program, staging)
+                with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                    json.dump({'flags': list(flags), 'version': version, 'compile_seconds': seconds}, f)
+                # Another build may have finished the same artifact meanwhile, either one is fine
+                try:
+                    os.rename(staging, cached)
+                except OSError:
+                    shutil.rmtree(staging)
+            except Exception:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            entry['compile_seconds'] = seconds
+
+        base = os.path.join(output_dir, name)
+        for artifact, target in zip(ARTIFACTS, (base + '.json', base + '.p4.p4info.txt')):
+            shutil.copyfile(os.path.join(cached, artifact), target)
+            entry[artifact.replace('program.', '').replace('.', '_') + '_bytes'] = os.path.getsize(target)
+    except Exception as error:
+        entry['error'] = str(error)
+    return entry
+
+
+def programs_of(paths):
+    """ (name, .p4 path, output directory) of the programs given as .p4 files or build directories. """
+    programs = []
+    for path in paths:
+        manifest = os.path.join(path, 'manifest.json')
+        if os.path.isdir(path) and os.path.exists(manifest):
+            with open(manifest) as f:
+                variants = json.load(f)['variants']
+            programs.extend((variant['name'], os.path.join(path, variant['path']), path) for variant in variants)
+        elif os.path.isdir(path):
+            programs.extend((name[:-len('.p4')], os.path.join(path, name), path)
+                            for name in sorted(os.listdir(path)) if name.endswith('.p4'))
+        else:
+            programs.append((os.path.splitext(os.path.basename(path))[0], path, os.path.dirname(path) or '.'))
+    return programs
+
+
+def build(paths, processes=None, p4c=P4C, flags=DEFAULT_FLAGS, cache_dir=DEFAULT_CACHE_DIR):
+    """ Builds every program and returns the report entries in the order the programs were given. """
+    version = compiler_version(p4c)
+    jobs = [(name, program, output_dir, p4c, tuple(flags), version, cache_dir)
+            for name, program, output_dir in programs_of(paths)]
+    if processes == 1 or len(jobs) <= 1:
+        return [build_one(job) for job in jobs]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(build_one, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_reports(entries):
+    """ One build_report.json per output directory. """
+    by_directory = {}
+    for entry in entries:
+        by_directory.setdefault(os.path.dirname(entry['program']) or '.', []).append(entry)
+    for directory, directory_entries in by_directory.items():
+        with open(os.path.join(directory, REPORT), 'w') as f:
+            json.dump(directory_entries, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+def summarize(entries, seconds):
+    print('{:<32} {:>6} {:>10} {:>12} {:>12}'.format('variant', 'cached', 'compile s', 'json bytes',
+                                                     'p4info bytes'), file=sys.stderr)
+    for entry in entries:
+        if 'error' in entry:
+            print('{:<32} FAILED {}'.format(entry['name'], entry['error'].splitlines()[0]), file=sys.stderr)
+            continue
+        print('{:<32} {:>6} {:>10.2f} {:>12} {:>12}'.format(entry['name'], 'yes' if entry['cached'] else 'no',
+                                                           entry['compile_seconds'], entry['json_bytes'],
+                                                           entry['p4info_txt_bytes']), file=sys.stderr)
+    compiled = sum(1 for entry in entries if not entry['cached'])
+    print('{} programs, {} compiled, {:.2f}s'.format(len(entries), compiled, seconds), file=sys.stderr)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Cached parallel p4c builds of P4kway programs')
+    parser.add_argument('paths', help='Build directories of generate_file.py or .p4 files', nargs='+')
+    parser.add_argument('-j', '--processes', help='Parallel compiles, all cores by default',
+                        type=int, required=False, default=None)
+    parser.add_argument('--p4c', type=str, required=False, default=P4C)
+    parser.add_argument('--flags', help="Compiler flags, e.g. --flags='--p4v 16 --emit-externs'",
+                        type=str, required=False, default=' '.join(DEFAULT_FLAGS))
+    parser.add_argument('--cache-dir', type=str, required=False, default=DEFAULT_CACHE_DIR)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    start = time.time()
+    entries = build(args.paths, args.processes, args.p4c, shlex.split(args.flags), args.cache_dir)
+    write_reports(entries)
+    summarize(entries, time.time() - start)
+    if any('error' in entry for entry in entries):
+        sys.exit(1)
@@ -1,5 +1,34 @@
+#!/usr/bin/env python
+"""
+Generates the P4kway program for a cache geometry.
+
+With no arguments cahceway.p4 is written next to this file for the default
+geometry. Every parameter may also be given as a list ('2,4,8') or an
+inclusive range ('2:16:2'), on the command line or in a JSON / YAML config
+file; every combination is then emitted as its own program into a build
+directory, together with a manifest.json of the parameters and the sha256 of
+every program:
+
+    python generate_file.py --max-entries 2:8:2 --main-cache-size 2,4 --build-dir variants
+    python generate_file.py --config sweep.yaml
+
+Every program is accompanied by a <name>.cost.json with the register reads,
+writes and bits of each request path, the TCAM entries and the register
+memory (see program_cost.py).
+"""
+from __future__ import print_function
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+
 from jinja2 import Template
 
+import program_cost
+
 P4_TEMPLATE = Template('''
 #include <core.p4>
 #include <v1model.p4>
@@ -7,10 +36,13 @@ P4_TEMPLATE = Template('''
 #define MAX_ENTRIES {{max_entries_size}}
 #define MAIN_CACHE_SIZE {{main_cache_size}}
 #define FRONT_CACHE_SIZE {{front_cache_size}}
-#define ELEMENT_SIZE 48
+#define VALUE_SIZE {{value_size}}
+#define ELEMENT_SIZE {{element_size}}   // valid bit ++ value ++ key ++ counter
 #define KEY_SIZE {{key_size}}
 #define COUNTER_SIZE 32
-
+{% if backend_port %}#define BACKEND_PORT {{backend_port}}
+{% endif %}{% if keys_per_packet > 1 %}#define KEYS_PER_PACKET {{keys_per_packet}}
+{% endif %}
 header ethernet_t {
     bit<48> dstAddr;
     bit<48> srcAddr;
@@ -20,9 +52,14 @@ header ethernet_t {
 const bit<16> P4KWAY_ETYPE = 0x1234;
 const bit<8>  P4KWAY_P     = 0x50;   // 'P'
 const bit<8>  P4KWAY_4     = 0x34;   // '4'
-const bit<8>  P4KWAY_VER   = 0x01;   // v0.1
+const bit<8>  P4KWAY_VER   = 0x05;   // v0.5: 32-bit key field
+const bit<8>  P4KWAY_OP_GET  = 0x00;
+const bit<8>  P4KWAY_OP_PUT  = 0x01;
+const bit<8>  P4KWAY_OP_FETCH  = 0x02;   // A miss forwarded to the backend
+const bit<8>  P4KWAY_OP_FILL  = 0x03;    // The backend's answer to a fetch
 const bit<8>  P4GET_VAL_LFU  = 0x46;   // 'F'
 const bit<8>  P4GET_VAL_FIFO  = 0x52;   // 'R'
+const bit<8>  P4GET_VAL_CLOCK  = 0x43;   // 'C'
 
 header p4kway_t {
    bit<8>  p;
@@ -30,20 +67,58 @@ header p4kway_t {
    bit<8>  ver;
    bit<8>  front_type;
    bit<8>  main_type;
-   bit<16> k;
-   bit<16> v;
+{% if key_size < 32 %}   bit<{{32 - key_size}}> k_pad;   // The key field is 32 bits wide, k its low KEY_SIZE bits
+{% endif %}   bit<KEY_SIZE> k;
+   bit<VALUE_SIZE> v;
    bit<8> cache;
    bit<8> front;
+   bit<32> seq;    // Request sequence number, echoed back untouched
+   bit<8> op;      // P4KWAY_OP_GET or P4KWAY_OP_PUT, P4KWAY_OP_FETCH / P4KWAY_OP_FILL with the backend
+   bit<8> served;  // Set to 1 when v is the value of k
+   bit<16> port;   // Ingress port of a fetch, where its fill is returned
+}
+{% if keys_per_packet > 1 %}
+// Multi-key packets: up to KEYS_PER_PACKET records behind one p4kway_multi_t,
+// processed one per pass as hdr.p4kway and recirculated until all are done
+const bit<16> P4KWAY_MULTI_ETYPE = 0x1235;
+
+header p4kway_multi_t {
+   bit<8>  p;
+   bit<8>  four;
+   bit<8>  ver;
+   bit<8>  front_type;
+   bit<8>  main_type;
+   bit<8>  count;  // Records in the packet
+   bit<8>  index;  // Record of the next pass
+   bit<16> port;   // Ingress port of the packet, where it is returned
+   bit<32> seq;    // Request sequence number, echoed back untouched
 }
 
+header p4kway_record_t {
+{% if key_size < 32 %}   bit<{{32 - key_size}}> k_pad;
+{% endif %}   bit<KEY_SIZE> k;
+   bit<VALUE_SIZE> v;
+   bit<8> cache;
+   bit<8> front;
+   bit<8> op;
+   bit<8> served;
+}
+{% endif %}
 struct headers {
     ethernet_t   ethernet;
     p4kway_t     p4kway;
-}
+{% if keys_per_packet > 1 %}    p4kway_multi_t  p4kway_multi;
+    p4kway_record_t[KEYS_PER_PACKET] p4kway_records;
+{% endif %}}
 
 struct metadata {
-    /* In our case it is empty */
-}
+    // The element (and its key) evicted by the last insertion of this packet,
+    // handed from way to way and from the front cache to the main cache
+    bit<ELEMENT_SIZE> victim_element;
+    bit<KEY_SIZE> victim_key;
+{% if keys_per_packet > 1 %}    // Set when a multi-key packet has records left for another pass
+    bit<1> recirculate;
+{% endif %}}
 
 parser MyParser(packet_in packet,
                 out headers hdr,
@@ -53,7 +128,8 @@ parser MyParser(packet_in packet,
         packet.extract(hdr.ethernet);
         transition select(hdr.ethernet.etherType) {
             P4KWAY_ETYPE : check_p4kway;
-            default      : accept;
+{% if keys_per_packet > 1 %}            P4KWAY_MULTI_ETYPE : check_p4kway_multi;
+{% endif %}            default      : accept;
         }
     }
     
@@ -70,7 +146,33 @@ parser MyParser(packet_in packet,
         packet.extract(hdr.p4kway);
         transition accept;
     }
-}
+{% if keys_per_packet > 1 %}
+    state check_p4kway_multi {
+        transition select(packet.lookahead<p4kway_multi_t>().p,
+        packet.lookahead<p4kway_multi_t>().four,
+        packet.lookahead<p4kway_multi_t>().ver) {
+            (P4KWAY_P, P4KWAY_4, P4KWAY_VER) : parse_p4kway_multi;
+            default                          : accept;
+        }
+    }
+
+    state parse_p4kway_multi {
+        packet.extract(hdr.p4kway_multi);
+        transition select(hdr.p4kway_multi.count) {
+            0       : accept;
+            default : parse_p4kway_record0;
+        }
+    }
+{% for i in range(keys_per_packet) %}
+    state parse_p4kway_record{{i}} {
+        packet.extract(hdr.p4kway_records[{{i}}]);
+{% if i + 1 < keys_per_packet %}        transition select(hdr.p4kway_multi.count) {
+            {{i + 1}}       : accept;
+            default : parse_p4kway_record{{i + 1}};
+        }
+{% else %}        transition accept;
+{% endif %}    }
+{% endfor %}{% endif %}}
 
 control MyVerifyChecksum(inout headers hdr,
                          inout metadata meta) {
@@ -81,22 +183,22 @@ control MyIngress(inout headers hdr,
                   inout metadata meta,
                   inout standard_metadata_t standard_metadata) {
 
-    register<bit<(COUNTER_SIZE)>>({{2 ** key_size - 1}}) r_counter;
+    register<bit<(COUNTER_SIZE)>>({{counter_entries}}) r_counter;
     register<bit<32>>(1) r_timestamp;
 
     // Elements cache
-    register<bit<(ELEMENT_SIZE * MAIN_CACHE_SIZE)>>(MAX_ENTRIES) r_main_cache;  // MAX_ENTRIES Elements. Each element is 32 bit.
-    register<bit<(ELEMENT_SIZE * FRONT_CACHE_SIZE)>>(MAX_ENTRIES) r_front_cache;
-
-    // Victim element. Common for the two caches.
-    register<bit<ELEMENT_SIZE>>(MAX_ENTRIES) r_victim_element;
+    register<bit<({{cached_element}} * MAIN_CACHE_SIZE)>>(MAX_ENTRIES) r_main_cache;  // MAX_ENTRIES sets of MAIN_CACHE_SIZE elements
+    register<bit<({{cached_element}} * FRONT_CACHE_SIZE)>>(MAX_ENTRIES) r_front_cache;
 
     // Keys cache
     register<bit<(KEY_SIZE * MAIN_CACHE_SIZE)>>(MAX_ENTRIES) r_main_keys;
     register<bit<(KEY_SIZE * FRONT_CACHE_SIZE)>>(MAX_ENTRIES) r_front_keys;
-    
-    // Victim Key. Common for thw two cached
-    register<bit<KEY_SIZE>>(MAX_ENTRIES) r_victim_key; 
+
+    // FIFO / CLOCK: the way the next insertion of the set starts from, and a reference bit per way
+    register<bit<8>>(MAX_ENTRIES) r_main_hand;
+    register<bit<8>>(MAX_ENTRIES) r_front_hand;
+    register<bit<MAIN_CACHE_SIZE>>(MAX_ENTRIES) r_main_referenced;
+    register<bit<FRONT_CACHE_SIZE>>(MAX_ENTRIES) r_front_referenced;
     
     // Masks to check whether or not the requested key is in the cache
     bit<(KEY_SIZE * MAIN_CACHE_SIZE)> main_keys_mask;
@@ -106,6 +208,12 @@ control MyIngress(inout headers hdr,
     bit<(KEY_SIZE * FRONT_CACHE_SIZE)> front_keys_bit;
     bit<(KEY_SIZE * MAIN_CACHE_SIZE)> main_keys_bit;
 
+    // Way of the key in the set, from the check_*_cache entry that matched
+    bit<32> main_hit_way;
+    bit<32> front_hit_way;
+
+    // The element a miss inserts: the key with a count of 1, and the value of a PUT
+    bit<ELEMENT_SIZE> requested_element;
     
     action send_back() {
        bit<48> tmp;
@@ -119,7 +227,56 @@ control MyIngress(inout headers hdr,
         standard_metadata.egress_spec = standard_metadata.ingress_port;
     }
 
-    action insert_key_to_front_keys_register(in bit<32> h, in bit<32> index, in bit<KEY_SIZE> key_to_insert, out bit<KEY_SIZE> new_victim_key) {
+{% if keys_per_packet > 1 %}    // Multi-key packets: the record of this pass becomes hdr.p4kway
+    action load_record() {
+        if (hdr.p4kway_multi.index == 0) {
+            hdr.p4kway_multi.port = (bit<16>)standard_metadata.ingress_port;
+        }
+        hdr.p4kway.setValid();
+        hdr.p4kway.p = P4KWAY_P;
+        hdr.p4kway.four = P4KWAY_4;
+        hdr.p4kway.ver = P4KWAY_VER;
+        hdr.p4kway.front_type = hdr.p4kway_multi.front_type;
+        hdr.p4kway.main_type = hdr.p4kway_multi.main_type;
+        hdr.p4kway.seq = hdr.p4kway_multi.seq;
+        hdr.p4kway.port = 0;
+{% for i in range(keys_per_packet) %}        if (hdr.p4kway_multi.index == {{i}}) {
+            hdr.p4kway.k = hdr.p4kway_records[{{i}}].k;
+            hdr.p4kway.v = hdr.p4kway_records[{{i}}].v;
+            hdr.p4kway.op = hdr.p4kway_records[{{i}}].op;
+        }
+{% endfor %}        // Fetches and fills only pass between the switch and its backend: any other record is a GET
+        if (hdr.p4kway.op != P4KWAY_OP_PUT) {
+            hdr.p4kway.op = P4KWAY_OP_GET;
+        }
+        // recirculate() carries the metadata of the previous pass over, start from that of a new packet
+        meta.victim_element = 0;
+        meta.victim_key = 0;
+        meta.recirculate = 0;
+    }
+
+    // Writes the answer back to the record and recirculates the packet for the next one,
+    // or returns it to its ingress port once all are answered
+    action store_record() {
+{% for i in range(keys_per_packet) %}        if (hdr.p4kway_multi.index == {{i}}) {
+            hdr.p4kway_records[{{i}}].v = hdr.p4kway.v;
+            hdr.p4kway_records[{{i}}].cache = hdr.p4kway.cache;
+            hdr.p4kway_records[{{i}}].front = hdr.p4kway.front;
+            hdr.p4kway_records[{{i}}].served = hdr.p4kway.served;
+        }
+{% endfor %}        hdr.p4kway.setInvalid();
+        hdr.p4kway_multi.index = hdr.p4kway_multi.index + 1;
+        standard_metadata.egress_spec = (bit<9>)hdr.p4kway_multi.port;
+        if (hdr.p4kway_multi.index == hdr.p4kway_multi.count) {
+            bit<48> tmp = hdr.ethernet.dstAddr;
+            hdr.ethernet.dstAddr = hdr.ethernet.srcAddr;
+            hdr.ethernet.srcAddr = tmp;
+        } else {
+            meta.recirculate = 1;
+        }
+    }
+
+{% endif %}    action insert_key_to_front_keys_register(in bit<32> h, in bit<32> index, in bit<KEY_SIZE> key_to_insert, out bit<KEY_SIZE> new_victim_key) {
         bit<(KEY_SIZE * FRONT_CACHE_SIZE)> keys;
         r_front_keys.read(keys, h);
         {{insert_key_to_front}}
@@ -133,103 +290,134 @@ control MyIngress(inout headers hdr,
         r_main_keys.write(h, keys);
     }
 
+    // Increments the low 16 bits of the counter of way index, the way the TCAM matched,
+    // stores the value of a PUT{% if backend_port %} (or of a fill, unless a PUT stored one first){% endif %} and answers with the value of the way
     action get_element_from_main_cache_with_lfu(in bit<32> h, in bit<32> index) {
-        bit<KEY_SIZE> requested_key = hdr.p4kway.k;
-        bit<(ELEMENT_SIZE * MAIN_CACHE_SIZE)> main_element;
-
+        bit<({{cached_element}} * MAIN_CACHE_SIZE)> main_element;
         r_main_cache.read(main_element, h);
-        {{get_element_from_main_cache}}
 
-        main_element = {{build_main_element}};
+        bit<32> shift = index * {{cached_element}};
+        bit<{{cached_element}}> element = (bit<{{cached_element}}>)(main_element >> shift);
+        {% if layout == 'keyed' %}if (element{{key_slice}} == hdr.p4kway.k) {% endif %}{
+            {{count_hit}}
+            if ({{store_condition}}) {
+                element[{{value_valid}}:{{value_low}}] = 1w1 ++ hdr.p4kway.v;
+            }
+            hdr.p4kway.v = element[{{value_high}}:{{value_low}}];
+            hdr.p4kway.served = (bit<8>)element[{{value_valid}}:{{value_valid}}];
+            main_element = (main_element & ~(((bit<({{cached_element}} * MAIN_CACHE_SIZE)>)(~(bit<{{cached_element}}>)0)) << shift))
+                | (((bit<({{cached_element}} * MAIN_CACHE_SIZE)>)element) << shift);
+        }
         r_main_cache.write(h, main_element);
     }
 
+    // Increments the low 16 bits of the counter of way index, the way the TCAM matched,
+    // stores the value of a PUT{% if backend_port %} (or of a fill, unless a PUT stored one first){% endif %} and answers with the value of the way
     action get_element_from_front_cache_with_lfu(in bit<32> h, in bit<32> index) {
-        bit<KEY_SIZE> requested_key = hdr.p4kway.k;
-        bit<(ELEMENT_SIZE * FRONT_CACHE_SIZE)> front_element;
-
+        bit<({{cached_element}} * FRONT_CACHE_SIZE)> front_element;
         r_front_cache.read(front_element, h);
-        {{get_element_from_front_cache}}
 
-        front_element = {{build_front_element}};
+        bit<32> shift = index * {{cached_element}};
+        bit<{{cached_element}}> element = (bit<{{cached_element}}>)(front_element >> shift);
+        {% if layout == 'keyed' %}if (element{{key_slice}} == hdr.p4kway.k) {% endif %}{
+            {{count_hit}}
+            if ({{store_condition}}) {
+                element[{{value_valid}}:{{value_low}}] = 1w1 ++ hdr.p4kway.v;
+            }
+            hdr.p4kway.v = element[{{value_high}}:{{value_low}}];
+            hdr.p4kway.served = (bit<8>)element[{{value_valid}}:{{value_valid}}];
+            front_element = (front_element & ~(((bit<({{cached_element}} * FRONT_CACHE_SIZE)>)(~(bit<{{cached_element}}>)0)) << shift))
+                | (((bit<({{cached_element}} * FRONT_CACHE_SIZE)>)element) << shift);
+        }
         r_front_cache.write(h, front_element);
     }
 
-    action insert_to_lfu_inner(in bit<32> index, in bit<KEY_SIZE> k, in bit<32> c, inout bit<ELEMENT_SIZE> element) {
-        bit<ELEMENT_SIZE> victim_element = 0;
-        victim_element[47:32] = element[47:32]; //k
-        victim_element[31:0] = element[31:0];   //c
+    // CLOCK: a hit sets the reference bit of way index
+    action reference_main_way(in bit<32> h, in bit<32> index) {
+        bit<MAIN_CACHE_SIZE> referenced;
+        r_main_referenced.read(referenced, h);
+        referenced = referenced | (((bit<MAIN_CACHE_SIZE>)1) << index);
+        r_main_referenced.write(h, referenced);
+    }
+
+    // CLOCK: a hit sets the reference bit of way index
+    action reference_front_way(in bit<32> h, in bit<32> index) {
+        bit<FRONT_CACHE_SIZE> referenced;
+        r_front_referenced.read(referenced, h);
+        referenced = referenced | (((bit<FRONT_CACHE_SIZE>)1) << index);
+        r_front_referenced.write(h, referenced);
+    }
+
+    action insert_to_lfu_inner(in bit<32> index, in bit<ELEMENT_SIZE> inserted, inout bit<ELEMENT_SIZE> element) {
+        bit<ELEMENT_SIZE> victim_element = element;
         if (victim_element[31:0] > 0) {
             victim_element[31:0] = victim_element[31:0] - 1;
         }
-        r_victim_element.write(0, victim_element);
+        meta.victim_element = victim_element;
 
          // Update cache[0] to be the new element 
-        element[47:32] = k;
-        element[31:0] = c;
+        element = inserted;
     }
 
     action insert_to_main_cache_with_lfu_first_element(in bit<32> h, in bit<32> index, inout bit<ELEMENT_SIZE> element) {
-        bit<KEY_SIZE> requested_key = hdr.p4kway.k;
-
-        insert_to_lfu_inner(index, requested_key, 1, element);
+        insert_to_lfu_inner(index, requested_element, element);
 
         // Insert the key to the keys_register
         bit<KEY_SIZE> next_victim;
         insert_key_to_main_keys_register(h, index, hdr.p4kway.k, next_victim);
-        r_victim_key.write(0, next_victim);
+        meta.victim_key = next_victim;
     }
 
     action insert_to_front_cache_with_lfu_first_element(in bit<32> h, in bit<32> index, inout bit<ELEMENT_SIZE> element) {
-        bit<KEY_SIZE> requested_key = hdr.p4kway.k;
-
-        insert_to_lfu_inner(index, requested_key, 1, element);
+        insert_to_lfu_inner(index, requested_element, element);
 
         // Insert the key to the keys_register
         bit<KEY_SIZE> next_victim;
         insert_key_to_front_keys_register(h, index, hdr.p4kway.k, next_victim);
-        r_victim_key.write(0, next_victim);
+        meta.victim_key = next_victim;
     }
 
     action insert_to_main_cache_with_lfu(in bit<32> h, in bit<32> index, inout bit<ELEMENT_SIZE> element) {
         bit<ELEMENT_SIZE> current_victim;
-        r_victim_element.read(current_victim, 0);
+        current_victim = meta.victim_element;
 
-        insert_to_lfu_inner(index, current_victim[47:32], current_victim[31:0], element);
+        insert_to_lfu_inner(index, current_victim, element);
 
         // Insert the key to the keys_register
         bit<KEY_SIZE> current_victim_key;
-        r_victim_key.read(current_victim_key, 0);
+        current_victim_key = meta.victim_key;
 
         bit<KEY_SIZE> next_victim_key;
         insert_key_to_main_keys_register(h, index, current_victim_key, next_victim_key);
-        r_victim_key.write(0, next_victim_key);
+        meta.victim_key = next_victim_key;
     }
 
     action insert_to_front_cache_with_lfu(in bit<32> h, in bit<32> index, inout bit<ELEMENT_SIZE> element) {
         bit<ELEMENT_SIZE> current_victim;
-        r_victim_element.read(current_victim, 0);
+        current_victim = meta.victim_element;
 
-        insert_to_lfu_inner(index, current_victim[47:32], current_victim[31:0], element);
+        insert_to_lfu_inner(index, current_victim, element);
 
         // Insert the key to the keys_register
         bit<KEY_SIZE> current_victim_key;
-        r_victim_key.read(current_victim_key, 0);
+        current_victim_key = meta.victim_key;
 
         bit<KEY_SIZE> next_victim_key;
         insert_key_to_front_keys_register(h, index, current_victim_key, next_victim_key);
-        r_victim_key.write(0, next_victim_key);
+        meta.victim_key = next_victim_key;
     }
 
     action operation_drop() {
         mark_to_drop(standard_metadata);
     }
 
-    action mark_main_hit() {
+    action mark_main_hit(bit<32> way) {
+        main_hit_way = way;
 	    hdr.p4kway.cache = 1;
     }
 
-    action mark_front_hit() {
+    action mark_front_hit(bit<32> way) {
+        front_hit_way = way;
 	    hdr.p4kway.front = 1;
     }
 
@@ -274,12 +462,22 @@ control MyIngress(inout headers hdr,
     }
 
     apply {
-        if (hdr.p4kway.isValid()) {
+{% if keys_per_packet > 1 %}        if (hdr.p4kway_multi.isValid()) {
+            if (hdr.p4kway_multi.index < hdr.p4kway_multi.count && hdr.p4kway_multi.count <= KEYS_PER_PACKET) {
+                load_record();
+            }
+        }
+{% endif %}        if (hdr.p4kway.isValid()) {
 
             //Deamorization Process:
             bit<COUNTER_SIZE> counter_value;
             bit<32> current_timestamp;
-            r_timestamp.read(current_timestamp, 0);
+            {% if backend_port %}// A fill answers a request that was already counted: it neither ages nor counts
+            bool fill = hdr.p4kway.op == P4KWAY_OP_FILL;
+            bit<8> requested_cache = hdr.p4kway.cache;
+            bit<8> requested_front = hdr.p4kway.front;
+            if (!fill) {
+            {% endif %}r_timestamp.read(current_timestamp, 0);
             {{deamortization}}
             if (current_timestamp == {{max_turns}}) {
                 current_timestamp = 0;
@@ -288,71 +486,111 @@ control MyIngress(inout headers hdr,
             }
             r_timestamp.write(0, current_timestamp);
             
-            r_counter.read(counter_value, (bit<32>)hdr.p4kway.k);
-            counter_value = counter_value + 1;
-            r_counter.write((bit<32>)hdr.p4kway.k, counter_value);
-            
+            {{count_request}}
+            {% if backend_port %}}
+            {% endif %}
 
-            bit<32> h = (bit<32>)hdr.p4kway.k % MAX_ENTRIES;
+            {{set_index}}
             r_front_keys.read(front_keys_bit, h);
             r_main_keys.read(main_keys_bit, h);
             front_keys_mask = ({{front_keys_mask}}) ^ front_keys_bit;
             main_keys_mask = ({{main_keys_mask}}) ^ main_keys_bit;
 
+            requested_element = 1w0 ++ (bit<VALUE_SIZE>)0 ++ hdr.p4kway.k ++ 32w1;
+            if (hdr.p4kway.op == P4KWAY_OP_PUT) {
+                requested_element = 1w1 ++ hdr.p4kway.v ++ hdr.p4kway.k ++ 32w1;
+            }
+            hdr.p4kway.served = 0;
+
             check_main_cache.apply();
             check_front_cache.apply();
             
             if (hdr.p4kway.cache == 1) {
                 // Retrieve from main cache
-                {{retrieve_from_main_cache}}
+                get_element_from_main_cache_with_lfu(h, main_hit_way);
+                if (hdr.p4kway.main_type == P4GET_VAL_CLOCK) {
+                    {% if backend_port %}if (!fill) {% endif %}reference_main_way(h, main_hit_way);
+                }
 
             } else if (hdr.p4kway.front == 1) {
                 // Retrieve from front cache
-                {{retrieve_from_front_cache}}
+                get_element_from_front_cache_with_lfu(h, front_hit_way);
+                if (hdr.p4kway.front_type == P4GET_VAL_CLOCK) {
+                    {% if backend_port %}if (!fill) {% endif %}reference_front_way(h, front_hit_way);
+                }
 
-            } else {
+            } else {% if backend_port %}if (!fill) {% endif %}{
                 bit<ELEMENT_SIZE> current_victim = 0;
+                // A PUT is served by the front cache from now on
+                hdr.p4kway.served = (bit<8>)requested_element[{{element_size - 1}}:{{element_size - 1}}];
 
                 // Insert to front cache
                 bit<(ELEMENT_SIZE * FRONT_CACHE_SIZE)> front_element;
-                r_front_cache.read(front_element, h);
+                {{load_front_element}}
 
-                bit<ELEMENT_SIZE> front_element0 = front_element[47:0];
-                insert_to_front_cache_with_lfu_first_element(h, 0, front_element0);
+                if (hdr.p4kway.front_type == P4GET_VAL_FIFO || hdr.p4kway.front_type == P4GET_VAL_CLOCK) {
+                    {{replace_front_way}}
+                } else {
+                    bit<ELEMENT_SIZE> front_element0 = front_element[{{element_size - 1}}:0];
+                    insert_to_front_cache_with_lfu_first_element(h, 0, front_element0);
 
-                {{front_actions}}
+                    {{front_actions}}
 
-                front_element = {{build_front_element}};
-                r_front_cache.write(h, front_element);
+                    {{store_front_element}}
+                }
 
-                r_victim_element.read(current_victim, 0);
-                if (current_victim[47:32] != 0) {
+                current_victim = meta.victim_element;
+                if (current_victim{{key_slice}} != 0) {
                     bit<(ELEMENT_SIZE * MAIN_CACHE_SIZE)> main_element;
-                    r_main_cache.read(main_element, h);     
-                    {{main_actions}}
-
-                    // Check our filter mechanism - whether the victim from the main cache should really be evicted
-                    // or the key from the front cache shouldn't be moved to the main cache at all 
-                    r_victim_element.read(current_victim, 0);
-                    r_main_keys.read(main_keys_bit, h);
-                    if (current_victim[47:32] != 0) {
-                        bit<COUNTER_SIZE> first_counter;
-                        r_counter.read(first_counter, (bit<32>)current_victim[47:32]);
-                        bit<COUNTER_SIZE> second_counter;
-                        r_counter.read(second_counter, (bit<32>)main_element0[47:32]);
-                        if (second_counter < first_counter) {
-                            // Our insertion was incorrect
-                            main_element0 = current_victim;
-                            main_keys_bit[15:0] = current_victim[47:32];
+                    {{load_main_element}}     
+                    if (hdr.p4kway.main_type == P4GET_VAL_FIFO || hdr.p4kway.main_type == P4GET_VAL_CLOCK) {
+                        {{replace_main_way}}
+                    } else {
+                        {{main_actions}}
+
+                        // Check our filter mechanism - whether the victim from the main cache should really be evicted
+                        // or the key from the front cache shouldn't be moved to the main cache at all 
+                        current_victim = meta.victim_element;
+                        r_main_keys.read(main_keys_bit, h);
+                        if (current_victim{{key_slice}} != 0) {
+                            bit<COUNTER_SIZE> first_counter;
+                            {{estimate_first_counter}}
+                            bit<COUNTER_SIZE> second_counter;
+                            {{estimate_second_counter}}
+                            if (second_counter < first_counter) {
+                                // Our insertion was incorrect
+                                main_element0 = current_victim;
+                                main_keys_bit[{{key_size - 1}}:0] = current_victim{{key_slice}};
+                            }
                         }
-                    }
-                    r_main_keys.write(h, main_keys_bit);
+                        r_main_keys.write(h, main_keys_bit);
 
-                    main_element = {{build_main_element}};
-                    r_main_cache.write(h, main_element);
+                        {{store_main_element}}
+                    }
                 }    
             }
-            send_back();
+            {% if keys_per_packet > 1 %}if (hdr.p4kway_multi.isValid()) {
+                store_record();
+            } else {% if not backend_port %}{
+                send_back();
+            }
+            {% endif %}{% endif %}{% if backend_port %}if (fill) {
+                // Return the value to the requester, with the outcome of its request
+                hdr.p4kway.cache = requested_cache;
+                hdr.p4kway.front = requested_front;
+                hdr.p4kway.op = P4KWAY_OP_GET;
+                hdr.p4kway.served = 1;
+                standard_metadata.egress_spec = (bit<9>)hdr.p4kway.port;
+            } else if (hdr.p4kway.op == P4KWAY_OP_GET && hdr.p4kway.served == 0) {
+                // Fetch the value from the backend, which answers with a fill
+                hdr.p4kway.op = P4KWAY_OP_FETCH;
+                hdr.p4kway.port = (bit<16>)standard_metadata.ingress_port;
+                standard_metadata.egress_spec = BACKEND_PORT;
+            } else {
+                send_back();
+            }
+            {% elif keys_per_packet == 1 %}send_back();
+            {% endif %}
         } else {
             operation_drop();
         }
@@ -362,8 +600,15 @@ control MyIngress(inout headers hdr,
 control MyEgress(inout headers hdr,
                  inout metadata meta,
                  inout standard_metadata_t standard_metadata) {
-    apply { }
-}
+{% if keys_per_packet > 1 %}    apply {
+        if (meta.recirculate == 1) {
+            // Back to the parser for the next record of a multi-key packet. recirculate(meta) is in
+            // every v1model (newer ones deprecate it for recirculate_preserving_field_list, with a warning)
+            recirculate(meta);
+        }
+    }
+{% else %}    apply { }
+{% endif %}}
 
 control MyComputeChecksum(inout headers hdr, inout metadata meta) {
     apply { }
@@ -373,7 +618,9 @@ control MyDeparser(packet_out packet, in headers hdr) {
     apply {
         packet.emit(hdr.ethernet);
         packet.emit(hdr.p4kway);
-    }
+{% if keys_per_packet > 1 %}        packet.emit(hdr.p4kway_multi);
+        packet.emit(hdr.p4kway_records);
+{% endif %}    }
 }
 
 V1Switch(
@@ -388,8 +635,8 @@ MyDeparser()
 
 
 MAIN_ACTION_TEMPLATE = Template('''
-bit<ELEMENT_SIZE> {{type}}_element{{i}} = {{type}}_element[{{48*(i+1)-1}}:{{48*i}}];
-r_victim_element.read(current_victim, 0);
+bit<ELEMENT_SIZE> {{type}}_element{{i}} = {{type}}_element[{{element_size*(i+1)-1}}:{{element_size*i}}];
+current_victim = meta.victim_element;
 if (hdr.p4kway.{{type}}_type == P4GET_VAL_LFU && {{type}}_element{{i}}[15:0] > current_victim[15:0]) {
     if ({{type}}_element{{i}}[15:0] > 0) {
         {{type}}_element{{i}}[15:0] = {{type}}_element{{i}}[15:0] - 1;
@@ -399,61 +646,434 @@ if (hdr.p4kway.{{type}}_type == P4GET_VAL_LFU && {{type}}_element{{i}}[15:0] > c
 }
 ''')
 
-RETREIVE_FROM_CACHE_TEMPLATE = Template('''get_element_from_{{type}}_cache_with_lfu(h ,{{i}});''')
 BUILD_ELEMENT_TEMPLATE = Template('''{{type}}_element{{i}}''')
-GET_ELEMENT_FROM_CACHE_TEMPLATE = Template('''
-bit<ELEMENT_SIZE> {{type}}_element{{i}} = {{type}}_element[{{48*(i+1)-1}}:{{48*i}}];
-if (index == {{i}}) {
-    if ({{type}}_element{{i}}[47:32] == requested_key) {
-        {{type}}_element{{i}}[15:0] = {{type}}_element{{i}}[15:0] + 1;
-    }
-}
-''')
 
+# Reads a r_*_cache row into the elements of the pipeline and writes it back.
+# The compact layout stores the elements without their keys, which come from
+# the r_*_keys row read before the TCAM lookup (the two are always updated
+# together)
+LOAD_ELEMENTS_TEMPLATE = Template('''
+{%- if layout == 'keyed' -%}
+r_{{type}}_cache.read({{type}}_element, h);
+{%- else -%}
+{%- set stored = element_size - key_size -%}
+bit<({{cached_element}} * {{type.upper()}}_CACHE_SIZE)> {{type}}_stored;
+{{indent}}r_{{type}}_cache.read({{type}}_stored, h);
+{{indent}}{{type}}_element = {% for i in range(cache_size)|reverse %}{{type}}_stored[{{stored*(i+1)-1}}:{{stored*i+32}}] ++ {{type}}_keys_bit[{{key_size*(i+1)-1}}:{{key_size*i}}] ++ {{type}}_stored[{{stored*i+31}}:{{stored*i}}]{% if not loop.last %} ++ {% endif %}{% endfor %};
+{%- endif -%}
+''')
+STORE_ELEMENTS_TEMPLATE = Template('''
+{%- if layout == 'keyed' -%}
+{{type}}_element = {{build_element}};
+{{indent}}r_{{type}}_cache.write(h, {{type}}_element);
+{%- else -%}
+r_{{type}}_cache.write(h, {% for i in range(cache_size)|reverse %}{{type}}_element{{i}}[{{element_size-1}}:{{key_size+32}}] ++ {{type}}_element{{i}}[31:0]{% if not loop.last %} ++ {% endif %}{% endfor %});
+{%- endif -%}
+''')
+# FIFO and CLOCK replace a single way of the set instead of running the LFU
+# cascade. FIFO replaces the way under r_*_hand; CLOCK sweeps from it to the
+# first unreferenced way, clearing the reference bits it passes (all of them
+# referenced: the hand's way), and marks the new element referenced. The hand
+# then moves past the replaced way. The front cache hands its victim on as the
+# LFU cascade does; the main cache only takes it in place of an element that
+# was requested as often or less (the r_counter filter), and drops the evicted one
+REPLACE_WAY_TEMPLATE = Template('''
+{%- set size = type.upper() + '_CACHE_SIZE' -%}
+bit<8> {{type}}_hand;
+{{indent}}r_{{type}}_hand.read({{type}}_hand, h);
+{{indent}}bit<32> {{type}}_way = (bit<32>){{type}}_hand;
+{{indent}}if (hdr.p4kway.{{type}}_type == P4GET_VAL_CLOCK) {
+{{indent}}    bit<{{size}}> {{type}}_referenced;
+{{indent}}    r_{{type}}_referenced.read({{type}}_referenced, h);
+{{indent}}    bool {{type}}_found = false;
+{%- for j in range(cache_size) %}
+{{indent}}    bit<32> {{type}}_position{{j}} = ((bit<32>){{type}}_hand{% if j %} + {{j}}{% endif %}) % {{size}};
+{{indent}}    if (!{{type}}_found) {
+{{indent}}        if ((({{type}}_referenced >> {{type}}_position{{j}}) & 1) == 0) {
+{{indent}}            {{type}}_way = {{type}}_position{{j}};
+{{indent}}            {{type}}_found = true;
+{{indent}}        } else {
+{{indent}}            {{type}}_referenced = {{type}}_referenced & ~(((bit<{{size}}>)1) << {{type}}_position{{j}});
+{{indent}}        }
+{{indent}}    }
+{%- endfor %}
+{{indent}}    {{type}}_referenced = {{type}}_referenced | (((bit<{{size}}>)1) << {{type}}_way);
+{{indent}}    r_{{type}}_referenced.write(h, {{type}}_referenced);
+{{indent}}}
+{{indent}}r_{{type}}_hand.write(h, (bit<8>)(({{type}}_way + 1) % {{size}}));
+
+{{indent}}bit<32> {{type}}_shift = {{type}}_way * ELEMENT_SIZE;
+{{indent}}bit<32> {{type}}_key_shift = {{type}}_way * KEY_SIZE;
+{{indent}}bit<ELEMENT_SIZE> {{type}}_evicted = (bit<ELEMENT_SIZE>)({{type}}_element >> {{type}}_shift);
+{%- if type == 'front' %}
+{{indent}}if (front_evicted[31:0] > 0) {
+{{indent}}    front_evicted[31:0] = front_evicted[31:0] - 1;
+{{indent}}}
+{{indent}}meta.victim_element = front_evicted;
+{{indent}}meta.victim_key = (bit<KEY_SIZE>)(front_keys_bit >> front_key_shift);
+{{indent}}bit<ELEMENT_SIZE> front_inserted = requested_element;
+{{indent}}bit<KEY_SIZE> front_inserted_key = hdr.p4kway.k;
+{%- else %}
+{{indent}}bit<ELEMENT_SIZE> main_inserted = current_victim;
+{{indent}}bit<KEY_SIZE> main_inserted_key = meta.victim_key;
+{{indent}}bit<COUNTER_SIZE> first_counter;
+{{indent}}{{estimate_first_counter}}
+{{indent}}bit<COUNTER_SIZE> second_counter;
+{{indent}}{{estimate_second_counter}}
+{%- endif %}
+{%- set inner = indent + '    ' if type == 'main' else indent %}
+{%- if type == 'main' %}
+{{indent}}if (main_evicted{{key_slice}} == 0 || first_counter <= second_counter) {
+{%- endif %}
+{{inner}}{{type}}_element = ({{type}}_element & ~(((bit<(ELEMENT_SIZE * {{size}})>)(~(bit<ELEMENT_SIZE>)0)) << {{type}}_shift))
+{{inner}}    | (((bit<(ELEMENT_SIZE * {{size}})>){{type}}_inserted) << {{type}}_shift);
+{{inner}}{{type}}_keys_bit = ({{type}}_keys_bit & ~(((bit<(KEY_SIZE * {{size}})>){{key_mask}}) << {{type}}_key_shift))
+{{inner}}    | (((bit<(KEY_SIZE * {{size}})>){{type}}_inserted_key) << {{type}}_key_shift);
+{{inner}}r_{{type}}_keys.write(h, {{type}}_keys_bit);
+{%- if layout == 'keyed' %}
+{{inner}}r_{{type}}_cache.write(h, {{type}}_element);
+{%- else %}
+{{inner}}r_{{type}}_cache.write(h, {% for i in range(cache_size)|reverse %}{{type}}_element[{{element_size*(i+1)-1}}:{{element_size*i+key_size+32}}] ++ {{type}}_element[{{element_size*i+31}}:{{element_size*i}}]{% if not loop.last %} ++ {% endif %}{% endfor %});
+{%- endif %}
+{%- if type == 'main' %}
+{{indent}}}
+{%- endif %}
+''')
 
 DEAMORTIZATION_PROCESS_TEMPLATE = Template('''
-if (current_timestamp == {{8 * (i+1)}}) {
+if (current_timestamp == {{timestamp}}) {
     {{deamortization_inner}}
 }
 ''')
 
 DEAMORTIZATION_INNER_TEMPLATE = Template('''
-r_counter.read(counter_value, {{i}});
-counter_value = counter_value << 1;
+{% if read %}r_counter.read(counter_value, {{i}});
+{% endif %}{{aging}}
 r_counter.write({{i}}, counter_value);
 ''')
 
-def get_first_mask(size, index):
-    mask = ['FFFF'] * size
-    mask[index] = '0000'
-    return ''.join(mask)
+# Ages the width counters selected by r_timestamp, whatever the key size
+COMPACT_DEAMORTIZATION_TEMPLATE = Template('''
+bit<32> aged_index = current_timestamp * {{width}};
+{% for j in range(width) %}
+{% if guarded %}if (aged_index + {{j}} < {{aged_counters}}) {% endif %}{
+    {% if read %}r_counter.read(counter_value, aged_index + {{j}});
+    {% endif %}{{aging}}
+    r_counter.write(aged_index + {{j}}, counter_value);
+}
+{% endfor %}
+''')
+
+# Counts a request of hdr.p4kway.k in r_counter: its own entry, one entry per
+# row of a Count-Min sketch, or only the smallest of them (conservative update).
+# crc32 is affine over GF(2), so salting it with the row number would give every
+# row the same collisions; each row multiplies the key by its own odd constant first.
+COUNT_TEMPLATE = Template('''
+{%- if counter == 'dense' -%}
+r_counter.read(counter_value, (bit<32>)hdr.p4kway.k);
+            counter_value = counter_value + 1;
+            r_counter.write((bit<32>)hdr.p4kway.k, counter_value);
+{%- else -%}
+bit<COUNTER_SIZE> sketch_min = 0xFFFFFFFF;
+{% for r in range(depth) %}
+            bit<32> sketch_index{{r}};
+            hash(sketch_index{{r}}, HashAlgorithm.crc32, (bit<32>){{r * width}}, { (bit<32>)hdr.p4kway.k * 32w{{multipliers[r]}} }, (bit<32>){{width}});
+            bit<COUNTER_SIZE> sketch_value{{r}};
+            r_counter.read(sketch_value{{r}}, sketch_index{{r}});
+            if (sketch_value{{r}} < sketch_min) {
+                sketch_min = sketch_value{{r}};
+            }
+{% endfor %}
+{% for r in range(depth) %}
+            {% if counter == 'conservative' %}if (sketch_value{{r}} == sketch_min) {% endif %}{
+                r_counter.write(sketch_index{{r}}, sketch_value{{r}} + 1);
+            }
+{% endfor %}
+{%- endif -%}
+''')
+
+# Reads the count of key into name: its r_counter entry, or the smallest of its sketch entries
+ESTIMATE_TEMPLATE = Template('''
+{%- if counter == 'dense' -%}
+r_counter.read({{name}}, (bit<32>){{key}});
+{%- else -%}
+{{name}} = 0xFFFFFFFF;
+{% for r in range(depth) %}
+                        bit<32> {{name}}_index{{r}};
+                        hash({{name}}_index{{r}}, HashAlgorithm.crc32, (bit<32>){{r * width}}, { (bit<32>){{key}} * 32w{{multipliers[r]}} }, (bit<32>){{width}});
+                        bit<COUNTER_SIZE> {{name}}_row{{r}};
+                        r_counter.read({{name}}_row{{r}}, {{name}}_index{{r}});
+                        if ({{name}}_row{{r}} < {{name}}) {
+                            {{name}} = {{name}}_row{{r}};
+                        }
+{% endfor %}
+{%- endif -%}
+''')
+
+# The set h of hdr.p4kway.k. identity is the original k % MAX_ENTRIES (what the
+# identity hash() computes), xor-fold mixes the high byte of the key into the
+# low one first, and the CRCs go through the hash() extern
+SET_INDEX_TEMPLATE = Template('''
+{%- if set_hash == 'identity' -%}
+bit<32> h = (bit<32>)hdr.p4kway.k % MAX_ENTRIES;
+{%- elif set_hash == 'xor-fold' -%}
+bit<32> h = (bit<32>)(hdr.p4kway.k ^ (hdr.p4kway.k >> 8)) % MAX_ENTRIES;
+{%- else -%}
+bit<32> h;
+            hash(h, HashAlgorithm.{{set_hash}}, (bit<32>)0, { hdr.p4kway.k }, (bit<32>)MAX_ENTRIES);
+{%- endif -%}
+''')
+
+# How an aged counter_value decays
+AGING_TEMPLATE = Template('''
+{%- if aging == 'double' -%}
+counter_value = counter_value << 1;
+{%- elif aging == 'halve' -%}
+counter_value = counter_value >> 1;
+{%- elif aging == 'decrement' -%}
+if (counter_value > {{decrement}}) { counter_value = counter_value - {{decrement}}; } else { counter_value = 0; }
+{%- else -%}
+counter_value = 0;
+{%- endif -%}
+''')
+
+def get_second_mask(size, index, key_size=16):
+    # Way index is keys[key_size * (index + 1) - 1:key_size * index], way 0 the least significant key of the row
+    mask = ((1 << key_size) - 1) << (key_size * index)
+    return '%0*X' % (-(-key_size * size // 4), mask)
 
-def get_second_mask(size, index):
-    mask = ['0000'] * size
-    mask[index] = 'FFFF'
-    return ''.join(mask)
+def get_first_mask(size, index, key_size=16):
+    mask = ((1 << (key_size * size)) - 1) ^ int(get_second_mask(size, index, key_size), 16)
+    return '%0*X' % (-(-key_size * size // 4), mask)
 
-TCAM_TEMPLATE = Template('''{{16 * cache_size}}w0x{{get_first_mask(cache_size, i)}} &&& {{16 * cache_size}}w0x{{get_second_mask(cache_size, i)}}: mark_{{type}}_hit();''')
+TCAM_TEMPLATE = Template('''{{key_size * cache_size}}w0x{{get_first_mask(cache_size, i, key_size)}} &&& {{key_size * cache_size}}w0x{{get_second_mask(cache_size, i, key_size)}}: mark_{{type}}_hit({{i}});''')
 
 INSERT_KEY_TO_KEY_REGISTER = Template('''
 if (index == {{i}}) {
-    new_victim_key = keys[{{16*(i+1)-1}}:{{16*i}}];
-    keys[{{16*(i+1)-1}}:{{16*i}}] = key_to_insert;
+    new_victim_key = keys[{{key_size*(i+1)-1}}:{{key_size*i}}];
+    keys[{{key_size*(i+1)-1}}:{{key_size*i}}] = key_to_insert;
 } 
 ''')
 
 
-if __name__ == "__main__":
-    max_entries_size = 2
-    main_cache_size = 2
-    front_cache_size = 2
-    key_size = 16
-    
-    main_actions = '\n'.join(list(map(lambda x: MAIN_ACTION_TEMPLATE.render(i=x, type="main"), range(main_cache_size))))
-    front_actions = '\n'.join(list(map(lambda x: MAIN_ACTION_TEMPLATE.render(i=x, type="front"), range(1, front_cache_size))))
+
+PARAMETERS = ('max_entries_size', 'main_cache_size', 'front_cache_size', 'key_size', 'deamortization',
+              'deamortization_width', 'aging', 'aging_period', 'aging_decrement', 'counter', 'sketch_depth',
+              'sketch_width', 'set_hash', 'layout', 'value_size', 'backend_port',
+              'keys_per_packet')
+DEFAULTS = {
+    'max_entries_size': 2,
+    'main_cache_size': 2,
+    'front_cache_size': 2,
+    'key_size': 16,
+    'deamortization': 'unrolled',
+    'deamortization_width': 1,
+    'aging': 'double',
+    'aging_period': 0,      # 0: the natural period of the deamortization, see aging_period()
+    'aging_decrement': 1,
+    'counter': 'dense',
+    'sketch_depth': 3,
+    'sketch_width': 1024,
+    'set_hash': 'identity',
+    'layout': 'keyed',
+    'value_size': 16,
+    'backend_port': 0,      # 0: misses are answered by the switch, see render_program()
+    'keys_per_packet': 1,   # 1: single key packets only
+}
+# Parameters that take one of a few names instead of a number
+CHOICES = {
+    'deamortization': ('unrolled', 'compact'),
+    # double is the original << 1; reset clears the counters (TinyLFU style windows)
+    'aging': ('double', 'halve', 'decrement', 'reset'),
+    # dense is one r_counter entry per key, the others a sketch_depth x sketch_width sketch
+    'counter': ('dense', 'count-min', 'conservative'),
+    # How a key picks its set, identity is k % MAX_ENTRIES
+    'set_hash': ('identity', 'xor-fold', 'crc16', 'crc32'),
+    # keyed elements repeat their key next to the counter, compact ones hold the counter only
+    'layout': ('keyed', 'compact'),
+}
+SKETCH_MULTIPLIER = 0x9E3779B1
+# Largest key size of a dense r_counter, one register entry per key (2 ** 24 is 64MB in bmv2)
+MAX_DENSE_KEY_SIZE = 24
+# Widths of hdr.p4kway.v that p4kway_codec.py can encode
+VALUE_SIZES = (8, 16, 32, 64)
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cahceway.p4')
+VARIANT_NAME = 'kway_e{max_entries_size}_m{main_cache_size}_f{front_cache_size}_k{key_size}'
+# Appended to VARIANT_NAME for the other parameters when they differ from their default
+VARIANT_SUFFIXES = {
+    'deamortization': '_{}',
+    'deamortization_width': '_w{}',
+    'aging': '_{}',
+    'aging_period': '_p{}',
+    'aging_decrement': '_d{}',
+    'counter': '_{}',
+    'sketch_depth': '_sd{}',
+    'sketch_width': '_sw{}',
+    'set_hash': '_{}',
+    'layout': '_{}',
+    'value_size': '_v{}',
+    'backend_port': '_b{}',
+    'keys_per_packet': '_kp{}',
+}
+
+
+def validate(max_entries_size, main_cache_size, front_cache_size, key_size, deamortization='unrolled',
+             deamortization_width=1, aging='double', aging_period=0, aging_decrement=1, counter='dense',
+             sketch_depth=3, sketch_width=1024, set_hash='identity', layout='keyed', value_size=16, backend_port=0,
+             keys_per_packet=1):
+    if min(max_entries_size, main_cache_size, front_cache_size) < 1:
+        raise ValueError("cache sizes must be at least 1")
+    if key_size < 2 or key_size > 32 or key_size % 2:
+        raise ValueError("key size must be an even number of bits up to 32 (the key field), got %d" % key_size)
+    if counter == 'dense' and key_size > MAX_DENSE_KEY_SIZE:
+        raise ValueError("a dense counter has 2 ** %d entries, use --counter conservative (or count-min) for key "
+                         "sizes above %d" % (key_size, MAX_DENSE_KEY_SIZE))
+    if counter == 'dense' and 2 ** (key_size / 2) < max_entries_size * main_cache_size:
+        raise ValueError("key size %d is too small to deamortize %d sets of %d ways"
+                         % (key_size, max_entries_size, main_cache_size))
+    if not 1 <= sketch_depth <= 256 or sketch_width < 1:
+        raise ValueError("sketches have 1 to 256 rows of at least one counter")
+    for name, value in (('deamortization', deamortization), ('aging', aging), ('counter', counter),
+                        ('set_hash', set_hash), ('layout', layout)):
+        if value not in CHOICES[name]:
+            raise ValueError("%s must be one of %s, got %r" % (name, ', '.join(CHOICES[name]), value))
+    if value_size not in VALUE_SIZES:
+        raise ValueError("value size must be one of %s, got %r" % (', '.join(map(str, VALUE_SIZES)), value_size))
+    if not 0 <= backend_port < 511:
+        raise ValueError("backend port must be a bmv2 port below 511, got %d" % backend_port)
+    if not 1 <= keys_per_packet <= 255:
+        raise ValueError("keys per packet must be 1 to 255, got %d" % keys_per_packet)
+    if deamortization_width < 1:
+        raise ValueError("deamortization width must be at least 1")
+    if aging_decrement < 1:
+        raise ValueError("aging decrement must be at least 1")
+    shortest = min_aging_period(max_entries_size, main_cache_size, key_size, deamortization, deamortization_width,
+                                counter, sketch_depth, sketch_width)
+    if aging_period and aging_period < shortest:
+        raise ValueError("aging period must be at least %d packets for this deamortization, got %d"
+                         % (shortest, aging_period))
+
+
+def sketch_multiplier(row):
+    """ The odd constant the key is multiplied by before the crc32 of a sketch row. """
+    return (SKETCH_MULTIPLIER * (2 * row + 1)) & 0xFFFFFFFF
+
+
+def counter_entries(key_size, counter='dense', sketch_depth=3, sketch_width=1024):
+    """ Size of the r_counter register. """
+    if counter == 'dense':
+        return 2 ** key_size - 1
+    return sketch_depth * sketch_width
+
+
+def aged_counters(max_entries_size, main_cache_size, key_size, counter='dense', sketch_depth=3, sketch_width=1024):
+    """
+    Number of r_counter entries (from index 0) that the deamortization ages:
+    the first 2 ** (key_size / 2) of the dense counters, or the whole sketch.
+    """
+    if counter != 'dense':
+        return sketch_depth * sketch_width
+    max_rounds_until_deamortization = max_entries_size * main_cache_size
+    return int((2 ** (key_size/2) / max_rounds_until_deamortization)) * max_rounds_until_deamortization
+
+
+def min_aging_period(max_entries_size, main_cache_size, key_size, deamortization='unrolled', deamortization_width=1,
+                     counter='dense', sketch_depth=3, sketch_width=1024):
+    """ The fewest packets in which the deamortization can age every counter once. """
+    if deamortization == 'compact':
+        aged = aged_counters(max_entries_size, main_cache_size, key_size, counter, sketch_depth, sketch_width)
+        return max(1, -(-aged // deamortization_width))
+    return max_entries_size * main_cache_size + 1
+
+
+def aging_period(max_entries_size, main_cache_size, key_size, deamortization='unrolled', deamortization_width=1,
+                 period=0, counter='dense', sketch_depth=3, sketch_width=1024):
+    """
+    Packets between two agings of a counter, i.e. r_timestamp wraps at
+    aging_period - 1. Unless a period is given it is 8 * MAIN_CACHE_SIZE *
+    MAX_ENTRIES + 1 for the unrolled deamortization and min_aging_period() for
+    the compact one.
+    """
+    if period:
+        return period
+    if deamortization == 'compact':
+        return min_aging_period(max_entries_size, main_cache_size, key_size, deamortization, deamortization_width,
+                                counter, sketch_depth, sketch_width)
+    return 8 * main_cache_size * max_entries_size + 1
+
+
+def max_turns(max_entries_size, main_cache_size, key_size, deamortization='unrolled', deamortization_width=1,
+              period=0, counter='dense', sketch_depth=3, sketch_width=1024):
+    """ The value at which r_timestamp wraps back to 0. """
+    return aging_period(max_entries_size, main_cache_size, key_size, deamortization, deamortization_width,
+                        period, counter, sketch_depth, sketch_width) - 1
+
+
+def render_program(max_entries_size, main_cache_size, front_cache_size, key_size, deamortization='unrolled',
+                   deamortization_width=1, aging='double', aging_period=0, aging_decrement=1, counter='dense',
+                   sketch_depth=3, sketch_width=1024, set_hash='identity', layout='keyed', value_size=16,
+                   backend_port=0, keys_per_packet=1):
+    """
+    Returns the P4 program for one cache geometry.
+
+    The unrolled deamortization ages size_of_each_deamortization counters on
+    every 8th packet, with one stanza per counter. The compact one ages
+    deamortization_width counters on every packet, at the index r_timestamp
+    points at, so the program does not grow with the key size; all the aged
+    counters are then aged once every max_turns + 1 packets.
+
+    Aging doubles the counters (the original behaviour), halves them,
+    subtracts aging_decrement from them or resets them to 0, once every
+    aging_period packets.
+
+    The dense counter has one r_counter entry per key. count-min and
+    conservative make r_counter a sketch_depth x sketch_width Count-Min sketch
+    indexed by crc32 hashes of the key times a per row constant, which only
+    grows with the working set; conservative only increments the smallest of
+    the key's entries. The filter compares the smallest of the entries.
+
+    set_hash picks the set of a key: identity (k % MAX_ENTRIES), xor-fold or
+    the crc16 / crc32 of the key, for key spaces whose low bits are skewed.
+
+    Every element holds a value_size bit value and the bit that tells whether
+    a PUT stored it, so values move with their keys from way to way and from
+    the front cache to the main cache. A GET hit answers with the value, a
+    PUT stores it in the element of its key, or inserts the key like a miss.
+
+    The keyed layout stores every element as valid ++ value ++ key ++ counter
+    in r_*_cache, the compact one leaves the key out: it is already in
+    r_*_keys, at the same way.
+
+    The front_type / main_type byte of each request picks the replacement of
+    its cache on a miss: 'F' runs the LFU cascade over every way, 'R' (FIFO)
+    and 'C' (CLOCK) replace the single way chosen by the per set r_*_hand and,
+    for CLOCK, the r_*_referenced bits that hits set.
+
+    With a backend_port, a GET the switch cannot serve is not bounced back:
+    it leaves on backend_port as a fetch that records its ingress port. The
+    backend (kv_backend.py) answers with a fill, which stores the value in
+    the element of its key, if still cached and not yet stored by a PUT, and
+    carries it to the requester. Fills do not count, age nor move elements.
+
+    With keys_per_packet above 1, a packet of the P4KWAY_MULTI_ETYPE carries
+    up to that many key records. Each pass through the pipeline answers one
+    of them as if it came alone, and egress recirculates the packet until the
+    last one is answered, when it returns to its ingress port. Their misses
+    are answered by the switch, never forwarded to the backend, and records
+    of any op but PUT are taken as GETs.
+    """
+    validate(max_entries_size, main_cache_size, front_cache_size, key_size, deamortization,
+             deamortization_width, aging, aging_period, aging_decrement, counter, sketch_depth, sketch_width,
+             set_hash, layout, value_size, backend_port, keys_per_packet)
+
+    element_size = 33 + key_size + value_size
+    # Bits of the key in an element, and of the value and of its valid bit in an r_*_cache element
+    key_slice = '[%d:32]' % (key_size + 31)
+    value_low = 32 + key_size if layout == 'keyed' else 32
+    stored_element = '(ELEMENT_SIZE - KEY_SIZE)'
+    main_actions = '\n'.join(list(map(lambda x: MAIN_ACTION_TEMPLATE.render(i=x, type="main", element_size=element_size), range(main_cache_size))))
+    front_actions = '\n'.join(list(map(lambda x: MAIN_ACTION_TEMPLATE.render(i=x, type="front", element_size=element_size), range(1, front_cache_size))))
     
-    retrive_from_main_cache = '\n'.join(list(map(lambda x: RETREIVE_FROM_CACHE_TEMPLATE.render(i=x, type="main"), range(main_cache_size))))
-    retrive_from_front_cache = '\n'.join(list(map(lambda x: RETREIVE_FROM_CACHE_TEMPLATE.render(i=x, type="front"), range(front_cache_size))))
     
     build_main_element = ' ++ '.join(list(map(lambda x: BUILD_ELEMENT_TEMPLATE.render(i=x,  type="main"), reversed(range(main_cache_size)))))
     build_front_element = ' ++ '.join(list(map(lambda x: BUILD_ELEMENT_TEMPLATE.render(i=x, type="front"), reversed(range(front_cache_size)))))
@@ -463,50 +1083,289 @@ if __name__ == "__main__":
 
     TCAM_TEMPLATE.globals['get_first_mask'] = get_first_mask
     TCAM_TEMPLATE.globals['get_second_mask'] = get_second_mask
-    tcam_main_cache = '\n'.join(list(map(lambda x: TCAM_TEMPLATE.render(i=x, cache_size=main_cache_size, type="main"), range(main_cache_size))))
-    tcam_front_cache = '\n'.join(list(map(lambda x: TCAM_TEMPLATE.render(i=x, cache_size=front_cache_size, type="front"), range(front_cache_size))))
+    tcam_main_cache = '\n'.join(list(map(lambda x: TCAM_TEMPLATE.render(i=x, cache_size=main_cache_size, key_size=key_size, type="main"), range(main_cache_size))))
+    tcam_front_cache = '\n'.join(list(map(lambda x: TCAM_TEMPLATE.render(i=x, cache_size=front_cache_size, key_size=key_size, type="front"), range(front_cache_size))))
     
-    get_element_from_main_cache = '\n'.join(list(map(lambda x: GET_ELEMENT_FROM_CACHE_TEMPLATE.render(i=x, type="main"), range(main_cache_size))))
-    get_element_from_front_cache = '\n'.join(list(map(lambda x: GET_ELEMENT_FROM_CACHE_TEMPLATE.render(i=x, type="front"), range(front_cache_size))))
     
-    insert_key_to_main = '\n'.join(list(map(lambda x: INSERT_KEY_TO_KEY_REGISTER.render(i=x), range(main_cache_size))))
-    insert_key_to_front = '\n'.join(list(map(lambda x: INSERT_KEY_TO_KEY_REGISTER.render(i=x), range(front_cache_size))))
+    insert_key_to_main = '\n'.join(list(map(lambda x: INSERT_KEY_TO_KEY_REGISTER.render(i=x, key_size=key_size), range(main_cache_size))))
+    insert_key_to_front = '\n'.join(list(map(lambda x: INSERT_KEY_TO_KEY_REGISTER.render(i=x, key_size=key_size), range(front_cache_size))))
 
-    deamortization = ''
+    turns = max_turns(max_entries_size, main_cache_size, key_size, deamortization, deamortization_width,
+                      aging_period, counter, sketch_depth, sketch_width)
+    aged = aged_counters(max_entries_size, main_cache_size, key_size, counter, sketch_depth, sketch_width)
     max_rounds_until_deamortization = max_entries_size * main_cache_size
-    size_of_each_deamortization = int((2 ** (key_size/2) / max_rounds_until_deamortization))
-
-    for i in range(max_rounds_until_deamortization):
-        deamortzation_inner = '\n'.join(list(map(lambda x: DEAMORTIZATION_INNER_TEMPLATE.render(i=x), range(i * size_of_each_deamortization, (i+1) * size_of_each_deamortization))))
-        deamortization += DEAMORTIZATION_PROCESS_TEMPLATE.render(i=i, deamortization_inner=deamortzation_inner) + '\n'
-
+    size_of_each_deamortization = -(-aged // max_rounds_until_deamortization)
+    aging_statement = AGING_TEMPLATE.render(aging=aging, decrement=aging_decrement)
+    read = aging != 'reset'
+
+    if deamortization == 'compact':
+        guarded = (turns + 1) * deamortization_width != aged
+        deamortization = COMPACT_DEAMORTIZATION_TEMPLATE.render(width=deamortization_width, aged_counters=aged,
+                                                                guarded=guarded, aging=aging_statement, read=read)
+    else:
+        # The blocks are spread evenly over the period, every 8th packet by default
+        spacing = turns // max_rounds_until_deamortization
+        deamortization = ''
+        for i in range(max_rounds_until_deamortization):
+            deamortzation_inner = '\n'.join(list(map(lambda x: DEAMORTIZATION_INNER_TEMPLATE.render(i=x, aging=aging_statement, read=read), range(i * size_of_each_deamortization, min((i+1) * size_of_each_deamortization, aged)))))
+            deamortization += DEAMORTIZATION_PROCESS_TEMPLATE.render(timestamp=spacing * (i+1), deamortization_inner=deamortzation_inner) + '\n'
+
+
+    sketch = dict(counter=counter, depth=sketch_depth, width=sketch_width,
+                  multipliers=['0x%08X' % sketch_multiplier(r) for r in range(sketch_depth)])
+    count_request = COUNT_TEMPLATE.render(**sketch)
+    estimate_first_counter = ESTIMATE_TEMPLATE.render(name='first_counter', key='current_victim' + key_slice, **sketch)
+    estimate_second_counter = ESTIMATE_TEMPLATE.render(name='second_counter', key='main_element0' + key_slice, **sketch)
+    key_mask = '0x%X' % ((1 << key_size) - 1)
+    replace_front_way = REPLACE_WAY_TEMPLATE.render(type='front', cache_size=front_cache_size, layout=layout,
+                                                    element_size=element_size, key_size=key_size,
+                                                    key_slice=key_slice, key_mask=key_mask, indent=' ' * 20)
+    replace_main_way = REPLACE_WAY_TEMPLATE.render(
+        type='main', cache_size=main_cache_size, layout=layout, element_size=element_size, key_size=key_size,
+        key_slice=key_slice, key_mask=key_mask, indent=' ' * 24,
+        estimate_first_counter=ESTIMATE_TEMPLATE.render(name='first_counter', key='main_evicted' + key_slice, **sketch),
+        estimate_second_counter=ESTIMATE_TEMPLATE.render(name='second_counter', key='current_victim' + key_slice,
+                                                         **sketch))
+
+    count_hit = 'element[15:0] = element[15:0] + 1;'
+    store_condition = 'hdr.p4kway.op == P4KWAY_OP_PUT'
+    if backend_port:
+        count_hit = 'if (hdr.p4kway.op != P4KWAY_OP_FILL) { %s }' % count_hit
+        store_condition += ' || (hdr.p4kway.op == P4KWAY_OP_FILL && element[{0}:{0}] == 0)'.format(
+            value_low + value_size)
 
     p4_generated_file = (P4_TEMPLATE.render
                         (
+                            counter_entries=counter_entries(key_size, counter, sketch_depth, sketch_width),
+                            count_request=count_request,
+                            set_index=SET_INDEX_TEMPLATE.render(set_hash=set_hash),
+                            estimate_first_counter=estimate_first_counter,
+                            estimate_second_counter=estimate_second_counter,
                             max_entries_size=max_entries_size,
                             key_size=key_size,          
+                            key_slice=key_slice,
+                            value_size=value_size,
+                            element_size=element_size,
+                            value_low=value_low,
+                            value_high=value_low + value_size - 1,
+                            value_valid=value_low + value_size,
+                            count_hit=count_hit,
+                            store_condition=store_condition,
+                            backend_port=backend_port,
+                            keys_per_packet=keys_per_packet,
                             main_cache_size=main_cache_size,
-                            max_turns=8*main_cache_size*max_entries_size,
+                            max_turns=turns,
                             front_cache_size=front_cache_size,
                             insert_key_to_main=insert_key_to_main,
                             insert_key_to_front=insert_key_to_front,
-                            retrieve_from_main_cache=retrive_from_main_cache,
-                            retrieve_from_front_cache=retrive_from_front_cache,
                             main_actions=main_actions,
                             front_actions=front_actions,
-                            build_main_element=build_main_element,
-                            build_front_element=build_front_element,
+                            replace_main_way=replace_main_way,
+                            replace_front_way=replace_front_way,
+                            layout=layout,
+                            cached_element='ELEMENT_SIZE' if layout == 'keyed' else stored_element,
+                            load_main_element=LOAD_ELEMENTS_TEMPLATE.render(type='main', cache_size=main_cache_size,
+                                                                            layout=layout, indent=' ' * 20,
+                                                                            element_size=element_size,
+                                                                            key_size=key_size,
+                                                                            cached_element=stored_element),
+                            store_main_element=STORE_ELEMENTS_TEMPLATE.render(type='main', cache_size=main_cache_size,
+                                                                              layout=layout, indent=' ' * 24,
+                                                                              element_size=element_size,
+                                                                              key_size=key_size,
+                                                                              build_element=build_main_element),
+                            load_front_element=LOAD_ELEMENTS_TEMPLATE.render(type='front', cache_size=front_cache_size,
+                                                                             layout=layout, indent=' ' * 16,
+                                                                             element_size=element_size,
+                                                                             key_size=key_size,
+                                                                             cached_element=stored_element),
+                            store_front_element=STORE_ELEMENTS_TEMPLATE.render(type='front',
+                                                                               cache_size=front_cache_size,
+                                                                               layout=layout, indent=' ' * 20,
+                                                                               element_size=element_size,
+                                                                               key_size=key_size,
+                                                                               build_element=build_front_element),
                             main_keys_mask=main_keys_mask,
                             front_keys_mask=front_keys_mask,
                             tcam_main_cache=tcam_main_cache,
                             tcam_front_cache=tcam_front_cache,
-                            get_element_from_main_cache=get_element_from_main_cache,
-                            get_element_from_front_cache=get_element_from_front_cache,
                             deamortization=deamortization
                         )
             )
 
-    # print(p4_generated_file)
+    return p4_generated_file
+
+
+def program_hash(program):
+    return hashlib.sha256(program.encode('utf-8')).hexdigest()
+
+
+def parse_values(value):
+    """ An int, a list of ints, '2,4,8', '2:16' / '2:16:2' or {'start', 'stop', 'step'} -> list of ints. """
+    if isinstance(value, bool):
+        raise ValueError("expected an integer, got %r" % value)
+    if isinstance(value, int):
+        return [value]
+    if isinstance(value, dict):
+        return list(range(value['start'], value['stop'] + 1, value.get('step', 1)))
+    if isinstance(value, (list, tuple)):
+        return [v for item in value for v in parse_values(item)]
+    value = str(value).strip()
+    if ',' in value:
+        return [v for item in value.split(',') for v in parse_values(item)]
+    if ':' in value:
+        bounds = [int(bound) for bound in value.split(':')]
+        if len(bounds) not in (2, 3):
+            raise ValueError("ranges are start:stop or start:stop:step, got %r" % value)
+        return list(range(bounds[0], bounds[1] + 1, bounds[2] if len(bounds) == 3 else 1))
+    return [int(value)]
+
+
+def parse_choices(name, value):
+    """ One name or several ('a,b' or a list) of the CHOICES of a parameter -> list of names. """
+    values = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    values = [str(v).strip() for v in values]
+    for v in values:
+        if v not in CHOICES[name]:
+            raise ValueError("%s must be one of %s, got %r" % (name, ', '.join(CHOICES[name]), v))
+    return values
+
+
+def variant_name(params):
+    name = VARIANT_NAME.format(**params)
+    for parameter, suffix in sorted(VARIANT_SUFFIXES.items(), key=lambda item: PARAMETERS.index(item[0])):
+        if params[parameter] != DEFAULTS[parameter]:
+            name += suffix.format(params[parameter])
+    return name
+
+
+def load_config(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            config = yaml.safe_load(f)
+        else:
+            config = json.load(f)
+    unknown = set(config) - set(PARAMETERS) - {'build_dir', 'output'}
+    if unknown:
+        raise ValueError("unknown config keys: %s" % ', '.join(sorted(unknown)))
+    return config
+
+
+def variants(sweep):
+    """ Every combination of the swept parameters, as dicts in PARAMETERS order. """
+    values = [parse_choices(name, sweep.get(name, DEFAULTS[name])) if name in CHOICES
+              else parse_values(sweep.get(name, DEFAULTS[name])) for name in PARAMETERS]
+    for combination in itertools.product(*values):
+        yield dict(zip(PARAMETERS, combination))
+
+
+def cost_path(program_path):
+    return os.path.splitext(program_path)[0] + '.cost.json'
+
+
+def write_cost(program, params, path):
+    """ Writes the program_cost report of a rendered program to path and returns it. """
+    turns = max_turns(params['max_entries_size'], params['main_cache_size'], params['key_size'],
+                      params['deamortization'], params['deamortization_width'], params['aging_period'],
+                      params['counter'], params['sketch_depth'], params['sketch_width'])
+    cost = program_cost.analyze(program, turns + 1)
+    cost['parameters'] = params
+    with open(path, 'w') as f:
+        json.dump(cost, f, indent=2)
+        f.write('\n')
+    return cost
+
+
+def build(sweep, build_dir):
+    """ Writes one program and its cost report per variant into build_dir and returns the manifest. """
+    if not os.path.isdir(build_dir):
+        os.makedirs(build_dir)
+    manifest = {'parameters': list(PARAMETERS), 'variants': []}
+    for params in variants(sweep):
+        program = render_program(**params)
+        name = variant_name(params)
+        path = name + '.p4'
+        with open(os.path.join(build_dir, path), 'w') as f:
+            f.write(program)
+        cost = write_cost(program, params, os.path.join(build_dir, cost_path(path)))
+        manifest['variants'].append({
+            'name': name,
+            'path': path,
+            'cost': cost_path(path),
+            'parameters': params,
+            'max_turns': max_turns(params['max_entries_size'], params['main_cache_size'], params['key_size'],
+                                   params['deamortization'], params['deamortization_width'],
+                                   params['aging_period'], params['counter'], params['sketch_depth'],
+                                   params['sketch_width']),
+            'counter_bytes': 4 * counter_entries(params['key_size'], params['counter'], params['sketch_depth'],
+                                                 params['sketch_width']),
+            'register_bytes': cost['register_bytes'],
+            'tcam_entries': cost['tcam_entries'],
+            'sha256': program_hash(program),
+        })
+    with open(os.path.join(build_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return manifest
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Generate P4kway programs')
+    parser.add_argument('-c', '--config', help='JSON or YAML file with parameters, build_dir and output',
+                        type=str, required=False)
+    parser.add_argument('-e', '--max-entries', dest='max_entries_size', help='Number of sets',
+                        type=str, required=False)
+    parser.add_argument('-m', '--main-cache-size', help='Ways of the main cache', type=str, required=False)
+    parser.add_argument('-f', '--front-cache-size', help='Ways of the front cache', type=str, required=False)
+    parser.add_argument('-k', '--key-size', help='Key size in bits', type=str, required=False)
+    parser.add_argument('-d', '--deamortization', help='unrolled (default) or compact, see render_program',
+                        type=str, required=False)
+    parser.add_argument('-w', '--deamortization-width', help='Counters aged per packet by compact deamortization',
+                        type=str, required=False)
+    parser.add_argument('-a', '--aging', help='double (default), halve, decrement or reset', type=str, required=False)
+    parser.add_argument('-p', '--aging-period', help='Packets between two agings of a counter, 0 for the default',
+                        type=str, required=False)
+    parser.add_argument('--aging-decrement', help='Subtracted by the decrement aging', type=str, required=False)
+    parser.add_argument('--counter', help='dense (default), count-min or conservative', type=str, required=False)
+    parser.add_argument('--sketch-depth', help='Rows of the Count-Min sketch', type=str, required=False)
+    parser.add_argument('--sketch-width', help='Counters per row of the Count-Min sketch', type=str, required=False)
+    parser.add_argument('--set-hash', help='identity (default), xor-fold, crc16 or crc32', type=str,
+                        required=False)
+    parser.add_argument('--layout', help='keyed (default) or compact elements', type=str, required=False)
+    parser.add_argument('--value-size', help='Bits of a cached value: 8, 16 (default), 32 or 64', type=str,
+                        required=False)
+    parser.add_argument('--backend-port', help='Forward misses to the backend on this port, 0 (default) to answer them',
+                        type=str, required=False)
+    parser.add_argument('--keys-per-packet', help='Key records of a multi-key packet, 1 (default) for none',
+                        type=str, required=False)
+    parser.add_argument('-b', '--build-dir', help='Emit every variant and a manifest.json here',
+                        type=str, required=False)
+    parser.add_argument('-o', '--output', help='Program to write when there is a single variant',
+                        type=str, required=False)
+    return parser.parse_args()
+
 
-    with open('/home/dor/dev/PKache/src/pKway-tcam-multi/cahceway.p4', 'w') as f:
-        f.write(p4_generated_file)
\ No newline at end of file
+if __name__ == "__main__":
+    args = get_args()
+    sweep = dict(DEFAULTS)
+    if args.config:
+        sweep.update(load_config(args.config))
+    for name in PARAMETERS:
+        if getattr(args, name) is not None:
+            sweep[name] = getattr(args, name)
+    build_dir = args.build_dir or sweep.pop('build_dir', None)
+    output = args.output or sweep.pop('output', None) or DEFAULT_OUTPUT
+
+    if build_dir is None:
+        all_variants = list(variants(sweep))
+        if len(all_variants) != 1:
+            sys.exit("%d variants, give a --build-dir to emit them all" % len(all_variants))
+        program = render_program(**all_variants[0])
+        with open(output, 'w') as f:
+            f.write(program)
+        write_cost(program, all_variants[0], cost_path(output))
+        print('Wrote {} and {}'.format(output, cost_path(output)), file=sys.stderr)
+    else:
+        manifest = build(sweep, build_dir)
+        print('Wrote {} variants to {}'.format(len(manifest['variants']), build_dir), file=sys.stderr)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+asyncio stand-in for the key-value server behind a forwarding switch.
+
+A switch generated with --backend-port sends the GETs it cannot serve out of
+that port as fetches (op OP_FETCH). The backend, h2 in topology.json, answers
+each with a fill (op OP_FILL) carrying the value of the key, and the switch
+stores it and returns it to the requester.
+
+    python3 generate_file.py --backend-port 2
+    python3 kv_backend.py h2-eth0 --values values.txt --latency 1
+
+The values file holds one 'key value' pair per line. Keys without a value are
+answered with the key itself, so answers are easy to check. --latency delays
+every fill, to stand in for a slower store.
+
+The same store serves p4kway_client.read() / write() without the network:
+
+    backend = KVStore()
+    value = await client.read(42, backend.fetch)
+
+Needs CAP_NET_RAW (run it as root inside the Mininet host).
+"""
+import argparse
+import asyncio
+import collections
+import socket
+import sys
+
+from p4kway_codec import OP_FETCH, OP_FILL, P4KWAY_ETYPE, VALUE_SIZE, frame_format, set_value, unpack_frame
+
+PACKET_OUTGOING = 4
+
+
+class KVStore(object):
+    def __init__(self, values=None, value_size=VALUE_SIZE, latency=0.0):
+        self.values = dict(values or {})
+        self.mask = (1 << value_size) - 1
+        self.latency = latency
+
+    def lookup(self, k):
+        return self.values.get(k, k) & self.mask
+
+    async def fetch(self, k):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.lookup(k)
+
+    async def store(self, k, v):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.values[k] = v & self.mask
+
+
+class KVBackend(object):
+    """ Answers the fetches that reach iface with fills from a KVStore. """
+    def __init__(self, iface, store=None, value_size=VALUE_SIZE):
+        self.iface = iface
+        self.store = store or KVStore(value_size=value_size)
+        self.value_size = value_size
+        self.layout = frame_format(value_size)
+        self.sock = None
+        self.loop = None
+        self.tasks = set()
+        self.stats = collections.Counter()
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(P4KWAY_ETYPE))
+        self.sock.bind((self.iface, P4KWAY_ETYPE))
+        self.sock.setblocking(False)
+        self.loop.add_reader(self.sock.fileno(), self._receive)
+        return self
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def _fill(self, frame, k):
+        v = await self.store.fetch(k)
+        # Swapped like send_back(), so the fill reaches the requester addressed to it
+        frame[0:6], frame[6:12] = frame[6:12], frame[0:6]
+        set_value(frame, v, value_size=self.value_size)
+        frame[self.layout.op_offset] = OP_FILL
+        await self.loop.sock_sendall(self.sock, frame)
+        self.stats['fills'] += 1
+
+    def _receive(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # closed
+            if address[2] == PACKET_OUTGOING or len(data) < self.layout.headers_size:
+                continue
+            frame = unpack_frame(data, value_size=self.value_size)
+            if frame is None or frame[9] != OP_FETCH:
+                self.stats['ignored'] += 1
+                continue
+            self.stats['fetches'] += 1
+            task = self.loop.create_task(self._fill(bytearray(data[:self.layout.frame_size]), frame[4]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+
+def load_values(path):
+    """ {key: value} of a file with one 'key value' pair per line. """
+    values = {}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            if len(fields) != 2:
+                raise ValueError("%s:%d: expected 'key value', got %r" % (path, number, line.strip()))
+            values[int(fields[0], 0)] = int(fields[1], 0)
+    return values
+
+
+async def serve(args):
+    values = load_values(args.values) if args.values else None
+    store = KVStore(values, args.value_size, args.latency / 1000.0)
+    async with KVBackend(args.iface, store, args.value_size) as backend:
+        try:
+            await asyncio.Event().wait()
+        finally:
+            print(dict(backend.stats), file=sys.stderr)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Key-value backend answering the fetches of a P4kway switch')
+    parser.add_argument('iface', help='Interface facing the switch backend port, e.g. h2-eth0', type=str)
+    parser.add_argument('--values', help="File with one 'key value' pair per line", type=str, required=False)
+    parser.add_argument('--latency', help='Milliseconds before each fill', type=float, required=False, default=0.0)
+    parser.add_argument('--value-size', help='Bits of hdr.p4kway.v, as generated', type=int, required=False,
+                        default=VALUE_SIZE)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(serve(get_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,117 @@
+"""
+Log-bucketed latency histograms in the style of HdrHistogram.
+
+Values (nanoseconds) below 2 ** SUB_BUCKET_BITS are counted exactly, larger
+ones in buckets whose width is 1 / 2 ** (SUB_BUCKET_BITS - 1) of their value,
+so every percentile is reported within ~1.6% using a few thousand counters.
+Histograms of several receivers or processes are combined with merge().
+"""
+from __future__ import division
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS >> 1
+MAX_VALUE_BITS = 40     # ~18 minutes in nanoseconds
+
+PERCENTILES = (('p50', 50.0), ('p90', 90.0), ('p99', 99.0), ('p999', 99.9))
+
+
+def bucket_index(value):
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * HALF_SUB_BUCKETS + (value >> shift) - HALF_SUB_BUCKETS
+
+
+def bucket_range(index):
+    """ (lowest, highest) value counted by a bucket. """
+    if index < SUB_BUCKETS:
+        return index, index
+    shift = (index - SUB_BUCKETS) // HALF_SUB_BUCKETS + 1
+    mantissa = (index - SUB_BUCKETS) % HALF_SUB_BUCKETS + HALF_SUB_BUCKETS
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram(object):
+    def __init__(self):
+        self.counts = [0] * (SUB_BUCKETS + (MAX_VALUE_BITS - SUB_BUCKET_BITS) * HALF_SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = max(0, min(int(value), (1 << MAX_VALUE_BITS) - 1))
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def percentile(self, percentile):
+        """ Highest value equivalent to the requested percentile, or None when empty. """
+        if not self.count:
+            return None
+        target = max(1, int(round(self.count * percentile / 100.0)))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(bucket_range(i)[1], self.max)
+        return self.max
+
+    def summary(self, unit=1000.0):
+        """ Count, mean, min, max and PERCENTILES, in microseconds for the default unit. """
+        result = {'count': self.count}
+        if not self.count:
+            return result
+        result['mean'] = self.total / self.count / unit
+        result['min'] = self.min / unit
+        result['max'] = self.max / unit
+        for name, percentile in PERCENTILES:
+            result[name] = self.percentile(percentile) / unit
+        return result
+
+
+class OutcomeHistograms(object):
+    """ One histogram per outcome of a lookup: main hit, front hit or miss. """
+    OUTCOMES = ('main_hit', 'front_hit', 'miss')
+
+    def __init__(self):
+        self.histograms = dict((outcome, LatencyHistogram()) for outcome in self.OUTCOMES)
+
+    def record(self, value, cache, front):
+        if cache:
+            outcome = 'main_hit'
+        elif front:
+            outcome = 'front_hit'
+        else:
+            outcome = 'miss'
+        self.histograms[outcome].record(value)
+
+    def merge(self, other):
+        for outcome in self.OUTCOMES:
+            self.histograms[outcome].merge(other.histograms[outcome])
+        return self
+
+    def summary(self, unit=1000.0):
+        total = LatencyHistogram()
+        for histogram in self.histograms.values():
+            total.merge(histogram)
+        result = dict((outcome, self.histograms[outcome].summary(unit)) for outcome in self.OUTCOMES)
+        result['all'] = total.summary(unit)
+        return result
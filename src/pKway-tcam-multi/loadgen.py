@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+"""
+Non-interactive P4kway load generator.
+
+Requests are written to a raw AF_PACKET socket from one pre-built frame whose
+key and seq fields are patched in place, and a receive thread matches the
+switch's answers to the outstanding requests by the echoed seq and records
+their latency per outcome (main hit, front hit, miss). With --ring the answers
+are read in batches from a TPACKET_V3 ring (packet_ring.py) and timed with the
+kernel's receive timestamps, and the frames the ring dropped are reported.
+Two modes are supported:
+
+  open    send at a fixed target rate, whatever the answers do
+  closed  keep a fixed number of requests outstanding
+
+Needs CAP_NET_RAW (run it as root inside the Mininet host).
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from latency import OutcomeHistograms
+from p4kway_codec import (P4KWAY_ETYPE, SWITCH_MAC, KEY_OFFSET, VALUE_CODES, VALUE_SIZE, build_frame, frame_format,
+                          gather_frames, set_key, set_seq, valid_mask)
+from packet_ring import DEFAULT_BLOCK_COUNT, DEFAULT_BLOCK_SIZE, PacketRing
+from trace_file import iter_keys
+
+PACKET_OUTGOING = 4
+SEQ_SPACE = 1 << 32
+KEY_HASH_MULTIPLIER = 2654435761
+
+# Monotonic clock for latencies
+clock = getattr(time, 'perf_counter', time.time)
+
+
+def interface_mac(iface):
+    with open('/sys/class/net/%s/address' % iface) as f:
+        return f.read().strip()
+
+
+class Outstanding(object):
+    """ Requests in flight by seq, expired in sending order. """
+    def __init__(self, timeout, clock=clock):
+        self.timeout = timeout
+        self.clock = clock
+        self.lock = threading.Condition()
+        self.requests = collections.OrderedDict()
+        self.timeouts = 0
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, seq, k, now):
+        with self.lock:
+            self.requests[seq] = (k, now)
+
+    def answer(self, seq, k):
+        """ Returns the send time of request seq if it is outstanding for key k, or None. """
+        with self.lock:
+            request = self.requests.get(seq)
+            if request is None or request[0] != k:
+                return None
+            del self.requests[seq]
+            self.lock.notify()
+            return request[1]
+
+    def answer_batch(self, seqs, keys):
+        """ answer() for a batch of answers under one lock, with None for the unmatched ones. """
+        requests = self.requests
+        sent = []
+        with self.lock:
+            for seq, k in zip(seqs, keys):
+                request = requests.get(seq)
+                if request is None or request[0] != k:
+                    sent.append(None)
+                    continue
+                del requests[seq]
+                sent.append(request[1])
+            self.lock.notify()
+        return sent
+
+    def expire(self, now):
+        with self.lock:
+            self._expire(now)
+
+    def _expire(self, now):
+        requests = self.requests
+        while requests:
+            seq, (k, sent) = next(iter(requests.items()))
+            if now - sent <= self.timeout:
+                break
+            del requests[seq]
+            self.timeouts += 1
+
+    def wait_below(self, window):
+        """ Blocks until fewer than window requests are in flight, expiring stale ones. """
+        with self.lock:
+            while len(self.requests) >= window:
+                self._expire(self.clock())
+                if len(self.requests) < window:
+                    break
+                self.lock.wait(self.timeout / 10.0)
+
+
+class Receiver(threading.Thread):
+    """
+    Matches answers to the outstanding requests. Answers whose seq is not
+    seq_base modulo seq_stride belong to another generator on the same
+    interface and are ignored. value_size is the width of v the program was
+    generated with, which places the fields after it.
+    """
+    def __init__(self, sock, outstanding, latency=None, seq_base=0, seq_stride=1, value_size=VALUE_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.outstanding = outstanding
+        self.stopped = threading.Event()
+        self.received = 0
+        self.unmatched = 0
+        self.main_hits = 0
+        self.front_hits = 0
+        self.last_receive = None
+        self.latency = latency if latency is not None else OutcomeHistograms()
+        self.seq_base = seq_base
+        self.seq_stride = seq_stride
+        self.value_size = value_size
+        self.layout = frame_format(value_size)
+
+    def run(self):
+        layout = self.layout
+        buf = bytearray(2048)
+        view = memoryview(buf)
+        unpack_key = struct.Struct('!I').unpack_from
+        unpack_seq = struct.Struct('!I').unpack_from
+        while not self.stopped.is_set():
+            try:
+                length, address = self.sock.recvfrom_into(view)
+            except socket.timeout:
+                continue
+            if address[2] == PACKET_OUTGOING or length < layout.headers_size:
+                continue
+            now = clock()
+            seq = unpack_seq(buf, layout.seq_offset)[0]
+            if seq % self.seq_stride != self.seq_base:
+                continue
+            sent = self.outstanding.answer(seq, unpack_key(buf, KEY_OFFSET)[0])
+            if sent is None:
+                self.unmatched += 1
+                continue
+            self.last_receive = now
+            self.received += 1
+            cache = buf[layout.cache_offset]
+            front = buf[layout.front_offset]
+            self.main_hits += cache
+            self.front_hits += front & (cache ^ 1)
+            self.latency.record((now - sent) * 1e9, cache, front)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class RingReceiver(Receiver):
+    """
+    Receiver reading the answers a block at a time from a PacketRing. Send
+    times must come from time.time, the clock of the kernel timestamps.
+    """
+    def __init__(self, ring, outstanding, latency=None, seq_base=0, seq_stride=1, value_size=VALUE_SIZE):
+        Receiver.__init__(self, None, outstanding, latency, seq_base, seq_stride, value_size)
+        self.ring = ring
+
+    def run(self):
+        ring = self.ring
+        while not self.stopped.is_set():
+            block = ring.read_block(50, self.layout.headers_size)
+            if block is None:
+                continue
+            offsets, times = block
+            if len(offsets):
+                self.process(gather_frames(ring.view, offsets, self.value_size), times)
+            ring.release_block()
+
+    def process(self, frames, times):
+        header = frames['p4kway']
+        seqs = header['seq']
+        mine = valid_mask(frames) & (seqs % self.seq_stride == self.seq_base)
+        if not mine.all():
+            indexes = mine.nonzero()[0]
+            frames, header, seqs = frames[indexes], header[indexes], seqs[indexes]
+            times = [times[i] for i in indexes.tolist()]
+        caches = header['cache'].tolist()
+        fronts = header['front'].tolist()
+        answered = self.outstanding.answer_batch(seqs.tolist(), header['k'].tolist())
+        record = self.latency.record
+        for sent, now, cache, front in zip(answered, times, caches, fronts):
+            if sent is None:
+                self.unmatched += 1
+                continue
+            self.received += 1
+            self.main_hits += cache
+            self.front_hits += front & (cache ^ 1)
+            record((now - sent) * 1e9, cache, front)
+            if self.last_receive is None or now > self.last_receive:
+                self.last_receive = now
+
+    def stop(self):
+        Receiver.stop(self)
+        self.ring.close()
+
+
+def open_socket(iface, receive=True):
+    """ Raw socket on iface, receiving the P4kway frames unless receive is False. """
+    protocol = P4KWAY_ETYPE if receive else 0
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(protocol))
+    sock.bind((iface, protocol))
+    sock.settimeout(0.05)
+    return sock
+
+
+def shard_mask(keys, positions, shard):
+    """ Which of the keys at the given stream positions belong to shard (index, shards, partition). """
+    index, shards, partition = shard
+    if partition == 'round-robin':
+        return positions % shards == index
+    return ((keys.astype(np.uint64) * KEY_HASH_MULTIPLIER) & 0xFFFFFFFF) % shards == index
+
+
+def request_keys(path, count, repeat, shard=None):
+    """
+    Yields the keys among the first count requests of a trace, starting over
+    when repeat is set. With shard = (index, shards, 'round-robin' or
+    'key-hash') only that shard's part of the stream is yielded.
+    """
+    position = 0
+    while True:
+        empty = True
+        for chunk in iter_keys(path):
+            if count is not None:
+                chunk = chunk[:max(0, count - position)]
+            if not len(chunk):
+                break
+            empty = False
+            if shard is not None:
+                positions = np.arange(position, position + len(chunk), dtype=np.int64)
+                selected = chunk[shard_mask(chunk, positions, shard)]
+            else:
+                selected = chunk
+            position += len(chunk)
+            for k in selected.tolist():
+                yield k
+        if not repeat or empty or (count is not None and position >= count):
+            return
+
+
+def run(iface, keys, mode='open', rate=1000.0, window=1, timeout=1.0, front_type='F', main_type='F',
+        dst_mac=SWITCH_MAC, duration=None, latency=None, seq_base=0, seq_stride=1, ring=False,
+        ring_block_size=DEFAULT_BLOCK_SIZE, ring_blocks=DEFAULT_BLOCK_COUNT, value_size=VALUE_SIZE):
+    """
+    Sends the keys and returns the results as a dict. Latencies are recorded
+    into latency (an OutcomeHistograms) when given. Generators sharing an
+    interface must use distinct seq_base values with the same seq_stride.
+    With ring the answers are received through a TPACKET_V3 ring. value_size
+    must match the --value-size of the program under test.
+    """
+    # The ring's kernel timestamps are wall clock times
+    send_clock = time.time if ring else clock
+    sock = open_socket(iface, receive=not ring)
+    frame = build_frame(interface_mac(iface), front_type, main_type, dst_mac=dst_mac, value_size=value_size)
+    outstanding = Outstanding(timeout, send_clock)
+    if ring:
+        packet_ring = PacketRing(iface, P4KWAY_ETYPE, ring_block_size, ring_blocks)
+        receiver = RingReceiver(packet_ring, outstanding, latency, seq_base, seq_stride, value_size)
+    else:
+        packet_ring = None
+        receiver = Receiver(sock, outstanding, latency, seq_base, seq_stride, value_size)
+    receiver.start()
+    seq_period = SEQ_SPACE // seq_stride
+
+    sent = 0
+    start = send_clock()
+    deadline = start + duration if duration else None
+    interval = 1.0 / rate if mode == 'open' else 0.0
+    for k in keys:
+        now = send_clock()
+        if deadline is not None and now >= deadline:
+            break
+        if mode == 'open':
+            due = start + sent * interval
+            if due > now:
+                time.sleep(due - now)
+            if sent % 1024 == 0:
+                outstanding.expire(now)
+        else:
+            outstanding.wait_below(window)
+
+        seq = seq_base + seq_stride * (sent % seq_period)
+        set_key(frame, k)
+        set_seq(frame, seq, value_size=value_size)
+        outstanding.add(seq, k, send_clock())
+        sock.send(frame)
+        sent += 1
+    send_end = send_clock()
+
+    # Drain the answers that are still on their way
+    while len(outstanding) and send_clock() - send_end <= timeout:
+        time.sleep(0.01)
+    outstanding.expire(float('inf'))
+    receiver.stop()
+    sock.close()
+
+    send_seconds = send_end - start
+    receive_seconds = (receiver.last_receive or start) - start
+    results = {
+        'mode': mode,
+        'iface': iface,
+        'target_pps': rate if mode == 'open' else None,
+        'window': window if mode == 'closed' else None,
+        'sent': sent,
+        'received': receiver.received,
+        'timeouts': outstanding.timeouts,
+        'unmatched': receiver.unmatched,
+        'main_hits': receiver.main_hits,
+        'front_hits': receiver.front_hits,
+        'send_seconds': send_seconds,
+        'achieved_pps': sent / send_seconds if send_seconds > 0 else 0.0,
+        'response_pps': receiver.received / receive_seconds if receive_seconds > 0 else 0.0,
+        'latency_us': receiver.latency.summary(),
+    }
+    if packet_ring is not None:
+        results['ring_packets'] = packet_ring.packets
+        results['ring_drops'] = packet_ring.drops
+        results['ring_freezes'] = packet_ring.freezes
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='P4kway load generator')
+    parser.add_argument('trace', help='Binary trace or text file with one key per line', type=str)
+    parser.add_argument('-i', '--iface', type=str, required=False, default='eth0')
+    parser.add_argument('-m', '--mode', choices=['open', 'closed'], required=False, default='open')
+    parser.add_argument('-r', '--rate', help='Target packets per second in open loop',
+                        type=float, required=False, default=1000.0)
+    parser.add_argument('-w', '--window', help='Outstanding requests in closed loop',
+                        type=int, required=False, default=1)
+    parser.add_argument('-n', '--count', help='Number of requests to send',
+                        type=int, required=False, default=None)
+    parser.add_argument('-d', '--duration', help='Stop sending after this many seconds',
+                        type=float, required=False, default=None)
+    parser.add_argument('--repeat', help='Start the trace over when it runs out',
+                        action='store_true', required=False, default=False)
+    parser.add_argument('--timeout', type=float, required=False, default=1.0)
+    parser.add_argument('--front-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--main-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--dst-mac', type=str, required=False, default=SWITCH_MAC)
+    parser.add_argument('--value-size', help='Bits of v, as the program was generated with',
+                        type=int, choices=sorted(VALUE_CODES), required=False, default=VALUE_SIZE)
+    parser.add_argument('--ring', help='Receive the answers through a TPACKET_V3 ring',
+                        action='store_true', required=False, default=False)
+    parser.add_argument('--ring-block-size', type=int, required=False, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument('--ring-blocks', type=int, required=False, default=DEFAULT_BLOCK_COUNT)
+    parser.add_argument('-o', '--output', help='Write the JSON results here instead of stdout',
+                        type=str, required=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    keys = request_keys(args.trace, args.count, args.repeat)
+    results = run(args.iface, keys, args.mode, args.rate, args.window, args.timeout,
+                  args.front_type, args.main_type, args.dst_mac, args.duration, ring=args.ring,
+                  ring_block_size=args.ring_block_size, ring_blocks=args.ring_blocks, value_size=args.value_size)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
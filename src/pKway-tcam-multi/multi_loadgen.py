@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+Runs several loadgen.py generators in parallel, one process per target.
+
+A target is a host interface, optionally inside the network namespace of a
+Mininet host (IFACE@h1) or of any process (IFACE@PID). Every worker is
+pinned to its own CPU, reads the shared trace and keeps its shard of it,
+split round-robin by request position or by a hash of the key. The
+coordinator merges the counters and latency histograms of the workers.
+
+Workers that share an interface number their requests in disjoint seq
+classes, so each only matches its own answers. A worker that dies without
+reporting (killed, out of memory) is reported as failed with its exit code
+instead of blocking the coordinator.
+"""
+from __future__ import print_function
+
+import argparse
+import ctypes
+import json
+import multiprocessing
+import os
+import sys
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import loadgen
+from latency import OutcomeHistograms
+
+CLONE_NEWNET = 0x40000000
+COUNTERS = ('sent', 'received', 'timeouts', 'unmatched', 'main_hits', 'front_hits', 'ring_drops')
+# Seconds between two checks of the worker exit codes while waiting for results
+POLL_SECONDS = 1.0
+
+
+def mininet_host_pid(name):
+    """ The pid of the shell Mininet runs for a host (bash ... mininet:<name>). """
+    marker = ('mininet:%s' % name).encode()
+    for pid in filter(str.isdigit, os.listdir('/proc')):
+        try:
+            with open('/proc/%s/cmdline' % pid, 'rb') as f:
+                arguments = f.read().split(b'\0')
+        except IOError:
+            continue
+        if marker in arguments:
+            return int(pid)
+    raise ValueError("no Mininet host named %s is running" % name)
+
+
+def enter_network_namespace(pid):
+    with open('/proc/%d/ns/net' % pid) as f:
+        if hasattr(os, 'setns'):
+            os.setns(f.fileno(), CLONE_NEWNET)
+            return
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.setns(f.fileno(), CLONE_NEWNET) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+
+def parse_target(target):
+    """ 'eth0', 'h1-eth0@h1' or 'eth0@1234' -> (iface, pid of the namespace or None). """
+    iface, _, host = target.partition('@')
+    if not host:
+        return iface, None
+    if host.isdigit():
+        return iface, int(host)
+    return iface, mininet_host_pid(host)
+
+
+def worker(index, workers, target, cpu, options, results):
+    try:
+        if cpu is not None and hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, {cpu})
+        iface, pid = parse_target(target)
+        if pid is not None:
+            enter_network_namespace(pid)
+
+        shard = (index, workers, options['partition'])
+        keys = loadgen.request_keys(options['trace'], options['count'], options['repeat'], shard)
+        latency = OutcomeHistograms()
+        result = loadgen.run(iface, keys, options['mode'], options['rate'] / workers, options['window'],
+                             options['timeout'], options['front_type'], options['main_type'],
+                             options['dst_mac'], options['duration'], latency,
+                             seq_base=index, seq_stride=workers, ring=options.get('ring', False),
+                             value_size=options.get('value_size', loadgen.VALUE_SIZE))
+        result['target'] = target
+        result['cpu'] = cpu
+        results.put((index, result, latency, None))
+    except Exception as error:
+        results.put((index, None, None, '%s: %s' % (type(error).__name__, error)))
+
+
+def exit_error(exitcode):
+    if exitcode < 0:
+        return 'killed by signal %d before reporting a result' % -exitcode
+    return 'exited with code %d before reporting a result' % exitcode
+
+
+def collect(processes, results, poll=POLL_SECONDS):
+    """
+    The (index, result, latency, error) of every worker, in any order. A
+    worker that had already exited when a poll began and sent nothing during
+    it never will: everything it put was flushed before it exited.
+    """
+    collected = {}
+    while len(collected) < len(processes):
+        exited = [(index, process.exitcode) for index, process in enumerate(processes)
+                  if index not in collected and process.exitcode is not None]
+        try:
+            item = results.get(timeout=poll)
+        except queue.Empty:
+            for index, exitcode in exited:
+                collected[index] = (index, None, None, exit_error(exitcode))
+            continue
+        collected[item[0]] = item
+    return list(collected.values())
+
+
+def run(targets, options, cpus=None):
+    """ Runs one worker per target and returns the merged and per worker results. """
+    workers = len(targets)
+    if cpus is None:
+        available = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else [None]
+        cpus = [available[i % len(available)] for i in range(workers)]
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(i, workers, target, cpus[i], options, results))
+                 for i, target in enumerate(targets)]
+    for process in processes:
+        process.start()
+    collected = collect(processes, results)
+    for process in processes:
+        process.join()
+
+    collected.sort(key=lambda item: item[0])
+    errors = dict((targets[index], error) for index, _, _, error in collected if error)
+    per_worker = [result for _, result, _, _ in collected if result is not None]
+
+    latency = OutcomeHistograms()
+    merged = dict((name, 0) for name in COUNTERS)
+    for _, result, histograms, _ in collected:
+        if result is None:
+            continue
+        latency.merge(histograms)
+        for name in COUNTERS:
+            merged[name] += result.get(name, 0)
+
+    send_seconds = max([result['send_seconds'] for result in per_worker] or [0.0])
+    merged.update({
+        'workers': workers,
+        'mode': options['mode'],
+        'send_seconds': send_seconds,
+        'achieved_pps': merged['sent'] / send_seconds if send_seconds > 0 else 0.0,
+        'response_pps': sum(result['response_pps'] for result in per_worker),
+        'latency_us': latency.summary(),
+    })
+    return {'merged': merged, 'workers': per_worker, 'errors': errors}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Parallel P4kway load generators')
+    parser.add_argument('trace', help='Binary trace or text file with one key per line', type=str)
+    parser.add_argument('-t', '--target', help='IFACE, IFACE@<mininet host> or IFACE@<pid>, once per worker',
+                        type=str, action='append', required=True)
+    parser.add_argument('--cpus', help='Comma separated CPUs to pin the workers to, in target order',
+                        type=str, required=False, default=None)
+    parser.add_argument('-p', '--partition', choices=['round-robin', 'key-hash'], required=False,
+                        default='round-robin')
+    parser.add_argument('-m', '--mode', choices=['open', 'closed'], required=False, default='open')
+    parser.add_argument('-r', '--rate', help='Aggregate target packets per second in open loop',
+                        type=float, required=False, default=1000.0)
+    parser.add_argument('-w', '--window', help='Outstanding requests per worker in closed loop',
+                        type=int, required=False, default=1)
+    parser.add_argument('-n', '--count', help='Number of requests to send across all workers',
+                        type=int, required=False, default=None)
+    parser.add_argument('-d', '--duration', type=float, required=False, default=None)
+    parser.add_argument('--repeat', action='store_true', required=False, default=False)
+    parser.add_argument('--timeout', type=float, required=False, default=1.0)
+    parser.add_argument('--front-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--main-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--dst-mac', type=str, required=False, default=loadgen.SWITCH_MAC)
+    parser.add_argument('--value-size', help='Bits of v, as the program was generated with',
+                        type=int, choices=sorted(loadgen.VALUE_CODES), required=False, default=loadgen.VALUE_SIZE)
+    parser.add_argument('--ring', help='Receive the answers through TPACKET_V3 rings',
+                        action='store_true', required=False, default=False)
+    parser.add_argument('-o', '--output', help='Write the JSON results here instead of stdout',
+                        type=str, required=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    options = dict((name, getattr(args, name)) for name in
+                   ('trace', 'partition', 'mode', 'rate', 'window', 'count', 'duration', 'repeat', 'timeout',
+                    'front_type', 'main_type', 'dst_mac', 'ring', 'value_size'))
+    cpus = [int(cpu) for cpu in args.cpus.split(',')] if args.cpus else None
+    results = run(args.target, options, cpus)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if results['errors']:
+        for target, error in sorted(results['errors'].items()):
+            print('worker %s failed: %s' % (target, error), file=sys.stderr)
+        sys.exit(1)
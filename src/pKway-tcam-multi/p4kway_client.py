@@ -0,0 +1,256 @@
+"""
+asyncio client for P4kway lookups.
+
+    async with P4KwayClient('h1-eth0') as client:
+        response = await client.get(42)
+        responses = await client.get_many([1, 2, 3])
+        await client.put(42, 7)
+        value = await client.read(42, backend.fetch)
+
+All coroutines share one raw AF_PACKET socket; answers are read by an event
+loop reader and matched to their request by the echoed seq. At most window
+requests are on the wire at once, each is retried up to retries times after
+timeout seconds without an answer before P4KwayTimeout is raised. Concurrent
+lookups of a key that is already in flight wait for the same request
+(single flight) instead of sending another one. The request runs as its own
+task, so a lookup that is cancelled only stops waiting for it; it is
+cancelled once none is left waiting.
+
+With keys_per_packet above 1 (for programs generated with the same
+--keys-per-packet), get_many() and put_many() send their keys that many to a
+multi-key packet, on a second socket for the P4KWAY_MULTI_ETYPE. A packet is
+one request: it takes one window slot and is retried as a whole.
+
+A response's v is only the value of k when served is set, i.e. a PUT stored
+it in the switch or the switch fetched it from its backend (generate_file.py
+--backend-port). read() and write() keep the switch in front of a backend:
+read() answers from the switch when it can and otherwise fetches the value and
+installs it with a PUT, write() updates the backend and then the switch.
+
+Needs CAP_NET_RAW (run it as root inside the Mininet host).
+"""
+import asyncio
+import collections
+import functools
+import socket
+
+from p4kway_codec import (P4KWAY_ETYPE, P4KWAY_MULTI_ETYPE, SWITCH_MAC, VALUE_SIZE, build_frame,
+                          build_multi_frame, frame_format, record_format, set_key, set_seq, set_value, unpack_frame,
+                          unpack_multi_frame)
+from trace_file import OP_GET, OP_PUT
+
+PACKET_OUTGOING = 4
+SEQ_SPACE = 1 << 32
+
+P4KwayResponse = collections.namedtuple('P4KwayResponse', ['k', 'v', 'cache', 'front', 'served'])
+
+
+class P4KwayTimeout(Exception):
+    pass
+
+
+class P4KwayClient(object):
+    def __init__(self, iface, front_type='F', main_type='F', window=64, timeout=0.1, retries=2,
+                 dst_mac=SWITCH_MAC, value_size=VALUE_SIZE, keys_per_packet=1):
+        self.iface = iface
+        self.front_type = front_type
+        self.main_type = main_type
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.dst_mac = dst_mac
+        self.value_size = value_size
+        self.layout = frame_format(value_size)
+        self.keys_per_packet = keys_per_packet
+        self.src_mac = None
+        self.sock = None
+        self.multi_sock = None
+        self.loop = None
+        self.template = None
+        self.slots = None
+        self.pending = {}
+        self.in_flight = {}
+        self.waiters = collections.Counter()
+        self.seq = 0
+        self.stats = collections.Counter()
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        with open('/sys/class/net/%s/address' % self.iface) as f:
+            self.src_mac = src_mac = f.read().strip()
+        self.template = build_frame(src_mac, self.front_type, self.main_type, dst_mac=self.dst_mac,
+                                    value_size=self.value_size)
+        self.slots = asyncio.Semaphore(self.window)
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(P4KWAY_ETYPE))
+        self.sock.bind((self.iface, P4KWAY_ETYPE))
+        self.sock.setblocking(False)
+        self.loop.add_reader(self.sock.fileno(), self._receive)
+        if self.keys_per_packet > 1:
+            self.multi_sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(P4KWAY_MULTI_ETYPE))
+            self.multi_sock.bind((self.iface, P4KWAY_MULTI_ETYPE))
+            self.multi_sock.setblocking(False)
+            self.loop.add_reader(self.multi_sock.fileno(), self._receive_multi)
+        return self
+
+    def close(self):
+        if self.sock is None:
+            return
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        if self.multi_sock is not None:
+            self.loop.remove_reader(self.multi_sock.fileno())
+            self.multi_sock.close()
+            self.multi_sock = None
+        for _, future in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def get(self, k):
+        """ Looks k up in the switch cache and returns its P4KwayResponse. """
+        flight = self.in_flight.get(k)
+        if flight is None:
+            flight = self.in_flight[k] = self.loop.create_task(self._request(k))
+            flight.add_done_callback(functools.partial(self._landed, k))
+        else:
+            self.stats['coalesced'] += 1
+        self.waiters[flight] += 1
+        try:
+            return await asyncio.shield(flight)
+        finally:
+            self.waiters[flight] -= 1
+            if not self.waiters[flight]:
+                del self.waiters[flight]
+                if not flight.done():
+                    # Nobody is left waiting for the answer
+                    self._landed(k, flight)
+                    flight.cancel()
+
+    def _landed(self, k, flight):
+        if self.in_flight.get(k) is flight:
+            del self.in_flight[k]
+
+    async def get_many(self, keys):
+        """ get() for every key concurrently, the responses in the order of keys. """
+        if self.keys_per_packet > 1:
+            return await self._request_many([(k, OP_GET, 0) for k in keys])
+        return await asyncio.gather(*[self.get(k) for k in keys])
+
+    async def put(self, k, v):
+        """ Stores v as the value of k in the switch cache and returns the P4KwayResponse. """
+        return await self._request(k, OP_PUT, v)
+
+    async def put_many(self, items):
+        """ put() for every (k, v) concurrently, the responses in the order of items. """
+        if self.keys_per_packet > 1:
+            return await self._request_many([(k, OP_PUT, v) for k, v in items])
+        return await asyncio.gather(*[self.put(k, v) for k, v in items])
+
+    async def read(self, k, fetch):
+        """
+        The value of k: from the switch when it serves it, otherwise from
+        await fetch(k), which is then installed in the switch.
+        """
+        response = await self.get(k)
+        if response.served:
+            self.stats['served'] += 1
+            return response.v
+        self.stats['fetched'] += 1
+        v = await fetch(k)
+        await self.put(k, v)
+        return v
+
+    async def write(self, k, v, store):
+        """ Write-through: await store(k, v) on the backend, then put(k, v). """
+        await store(k, v)
+        await self.put(k, v)
+
+    async def _request(self, k, op=OP_GET, v=0):
+        def build(seq):
+            frame = bytearray(self.template)
+            set_key(frame, k)
+            set_seq(frame, seq, value_size=self.value_size)
+            if op != OP_GET:
+                set_value(frame, v, value_size=self.value_size)
+                frame[self.layout.op_offset] = op
+            return frame
+        return await self._send(self.sock, k, build, "key %d" % k)
+
+    async def _request_many(self, records):
+        """ The responses to records of (k, op, v), keys_per_packet to a packet. """
+        packets = [records[i:i + self.keys_per_packet] for i in range(0, len(records), self.keys_per_packet)]
+        answers = await asyncio.gather(*[self._request_multi(packet) for packet in packets])
+        return [response for answer in answers for response in answer]
+
+    async def _request_multi(self, records):
+        keys = tuple(k for k, _, _ in records)
+
+        def build(seq):
+            return build_multi_frame(self.src_mac, records, self.front_type, self.main_type, seq, self.dst_mac,
+                                     self.value_size)
+        return await self._send(self.multi_sock, keys, build, "%d keys from %d" % (len(keys), keys[0]))
+
+    async def _send(self, sock, match, build, what):
+        """ Sends build(seq) until the answer matching match arrives. """
+        async with self.slots:
+            for _ in range(self.retries + 1):
+                seq = self.seq
+                self.seq = (seq + 1) % SEQ_SPACE
+                answer = self.loop.create_future()
+                self.pending[seq] = (match, answer)
+                try:
+                    await self.loop.sock_sendall(sock, build(seq))
+                    self.stats['sent'] += 1
+                    return await asyncio.wait_for(answer, self.timeout)
+                except asyncio.TimeoutError:
+                    self.stats['timeouts'] += 1
+                finally:
+                    self.pending.pop(seq, None)
+        raise P4KwayTimeout("no answer for %s after %d attempts" % (what, self.retries + 1))
+
+    def _receive(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            if address[2] == PACKET_OUTGOING or len(data) < self.layout.headers_size:
+                continue
+            frame = unpack_frame(data, value_size=self.value_size)
+            if frame is None:
+                continue
+            _, _, _, _, k, v, cache, front, seq, _, served, _ = frame
+            request = self.pending.get(seq)
+            if request is None or request[0] != k or request[1].done():
+                self.stats['unmatched'] += 1
+                continue
+            self.stats['received'] += 1
+            request[1].set_result(P4KwayResponse(k, v, cache, front, served))
+
+    def _receive_multi(self):
+        record_size = record_format(self.value_size).size
+        while True:
+            try:
+                data, address = self.multi_sock.recvfrom(64 + 255 * record_size)
+            except (BlockingIOError, InterruptedError):
+                return
+            if address[2] == PACKET_OUTGOING:
+                continue
+            frame = unpack_multi_frame(data, value_size=self.value_size)
+            if frame is None:
+                continue
+            records = frame[6]
+            request = self.pending.get(frame[5])
+            if request is None or request[0] != tuple(k for k, _, _, _, _, _ in records) or request[1].done():
+                self.stats['unmatched'] += 1
+                continue
+            self.stats['received'] += 1
+            request[1].set_result([P4KwayResponse(k, v, cache, front, served)
+                                   for k, v, cache, front, _, served in records])
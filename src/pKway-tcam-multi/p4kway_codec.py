@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+Scapy-free encoding of P4kway frames.
+
+Frames are packed into and decoded from caller owned bytearray/memoryview
+buffers with struct.pack_into/unpack_from, one at a time or as a batch of
+fixed-stride frames, and the P4KWAY_FRAME_DTYPE structured dtype decodes a
+whole buffer of frames with numpy at once. The bytes are the ones sender.py
+produces with Ether(...)/P4kway(...)/' ', tests/test_p4kway_codec.py checks
+them against scapy.
+
+The width of v is the VALUE_SIZE the program was generated with. The module
+constants describe the default 16 bit values; the pack / unpack functions
+take a value_size for the others, and frame_format() gives their layout.
+k is 32 bits wide whatever the KEY_SIZE; the program uses its low KEY_SIZE
+bits.
+
+Programs generated with --keys-per-packet also take multi-key frames of the
+P4KWAY_MULTI_ETYPE: one MULTI_HEADER followed by count records of (k, v,
+cache, front, op, served), see build_multi_frame().
+"""
+import collections
+import struct
+
+import numpy as np
+
+from trace_file import OP_GET
+
+P4KWAY_ETYPE = 0x1234
+P4KWAY_MULTI_ETYPE = 0x1235
+P4KWAY_P = 0x50     # 'P'
+P4KWAY_4 = 0x34     # '4'
+P4KWAY_VER = 0x05   # v0.5, 32-bit key field
+P4KWAY_PREFIX = b'P4\x05'
+SWITCH_MAC = '00:04:00:00:00:00'
+
+# Operations the switch exchanges with the backend (GET / PUT are trace_file's)
+OP_FETCH = 2    # A request the switch could not serve, on its way to the backend
+OP_FILL = 3     # The backend's answer, with the value for the switch to store
+
+VALUE_SIZE = 16
+# struct / numpy codes of the value widths the generator accepts
+VALUE_CODES = {8: ('B', 'u1'), 16: ('H', '>u2'), 32: ('I', '>u4'), 64: ('Q', '>u8')}
+
+ETHERNET_HEADER = struct.Struct('!6s6sH')
+# sender.py appends a one byte ' ' payload to every request
+PADDING = b' '
+
+P4KWAY_OFFSET = ETHERNET_HEADER.size
+KEY_OFFSET = P4KWAY_OFFSET + 5
+VALUE_OFFSET = P4KWAY_OFFSET + 9
+
+FrameFormat = collections.namedtuple('FrameFormat', ['header', 'cache_offset', 'front_offset', 'seq_offset',
+                                                     'op_offset', 'served_offset', 'headers_size', 'frame_size',
+                                                     'dtype', 'frame_dtype'])
+_formats = {}
+
+
+def frame_format(value_size=VALUE_SIZE):
+    """ The FrameFormat of frames whose v is value_size bits wide. """
+    layout = _formats.get(value_size)
+    if layout is not None:
+        return layout
+    if value_size not in VALUE_CODES:
+        raise ValueError("value size must be one of %s, got %r" % (', '.join(map(str, sorted(VALUE_CODES))),
+                                                                   value_size))
+    code, dtype = VALUE_CODES[value_size]
+    # p, four, ver, front_type, main_type, k, v, cache, front, seq, op, served, port
+    header = struct.Struct('!BBBBBI%sBBIBBH' % code)
+    cache_offset = VALUE_OFFSET + value_size // 8
+    headers_size = ETHERNET_HEADER.size + header.size
+    p4kway_dtype = np.dtype([
+        ('p', 'u1'), ('four', 'u1'), ('ver', 'u1'), ('front_type', 'u1'), ('main_type', 'u1'),
+        ('k', '>u4'), ('v', dtype), ('cache', 'u1'), ('front', 'u1'), ('seq', '>u4'), ('op', 'u1'),
+        ('served', 'u1'), ('port', '>u2'),
+    ])
+    layout = _formats[value_size] = FrameFormat(
+        header, cache_offset, cache_offset + 1, cache_offset + 2, cache_offset + 6, cache_offset + 7, headers_size,
+        headers_size + len(PADDING), p4kway_dtype,
+        np.dtype([('dst', 'V6'), ('src', 'V6'), ('etherType', '>u2'), ('p4kway', p4kway_dtype)]))
+    return layout
+
+
+# p, four, ver, front_type, main_type, count, index, port, seq
+MULTI_HEADER = struct.Struct('!BBBBBBBHI')
+MULTI_OFFSET = ETHERNET_HEADER.size
+RECORDS_OFFSET = MULTI_OFFSET + MULTI_HEADER.size
+_records = {}
+
+
+def record_format(value_size=VALUE_SIZE):
+    """ struct of one record of a multi-key frame whose v is value_size bits wide. """
+    record = _records.get(value_size)
+    if record is None:
+        frame_format(value_size)  # rejects the widths the generator does not accept
+        # k, v, cache, front, op, served
+        record = _records[value_size] = struct.Struct('!I%sBBBB' % VALUE_CODES[value_size][0])
+    return record
+
+
+_default = frame_format()
+P4KWAY_HEADER = _default.header
+CACHE_OFFSET = _default.cache_offset
+FRONT_OFFSET = _default.front_offset
+SEQ_OFFSET = _default.seq_offset
+OP_OFFSET = _default.op_offset
+SERVED_OFFSET = _default.served_offset
+HEADERS_SIZE = _default.headers_size
+FRAME_SIZE = _default.frame_size
+P4KWAY_DTYPE = _default.dtype
+P4KWAY_FRAME_DTYPE = _default.frame_dtype
+
+_pack_ethernet = ETHERNET_HEADER.pack_into
+_pack_key = struct.Struct('!I').pack_into
+_pack_seq = struct.Struct('!I').pack_into
+_unpack_seq = struct.Struct('!I').unpack_from
+
+
+def mac_to_bytes(mac):
+    return bytes(bytearray(int(octet, 16) for octet in mac.split(':')))
+
+
+def bytes_to_mac(raw):
+    return ':'.join('%02x' % octet for octet in bytearray(raw))
+
+
+def policy_byte(policy):
+    """ 'F' / 'R' (or the raw byte value) as the front_type / main_type byte. """
+    return ord(policy) if not isinstance(policy, int) else policy
+
+
+def pack_header(buf, offset, front_type, main_type, k, v=0, cache=0, front=0, seq=0, op=OP_GET, served=0, port=0,
+                value_size=VALUE_SIZE):
+    frame_format(value_size).header.pack_into(buf, offset, P4KWAY_P, P4KWAY_4, P4KWAY_VER, policy_byte(front_type),
+                                              policy_byte(main_type), k, v, cache, front, seq, op, served, port)
+
+
+def unpack_header(buf, offset=P4KWAY_OFFSET, value_size=VALUE_SIZE):
+    """
+    Returns (front_type, main_type, k, v, cache, front, seq, op, served,
+    port), or None if buf holds no P4kway header.
+    """
+    p, four, ver, front_type, main_type, k, v, cache, front, seq, op, served, port = \
+        frame_format(value_size).header.unpack_from(buf, offset)
+    if (p, four, ver) != (P4KWAY_P, P4KWAY_4, P4KWAY_VER):
+        return None
+    return front_type, main_type, k, v, cache, front, seq, op, served, port
+
+
+def pack_frame(buf, offset, src_mac, front_type, main_type, k, v=0, cache=0, front=0, seq=0, dst_mac=SWITCH_MAC,
+               op=OP_GET, value_size=VALUE_SIZE):
+    """ Writes a whole request frame (frame_size bytes) at offset. MACs are 6 raw bytes or strings. """
+    if not isinstance(src_mac, bytes) or len(src_mac) != 6:
+        src_mac = mac_to_bytes(src_mac)
+    if not isinstance(dst_mac, bytes) or len(dst_mac) != 6:
+        dst_mac = mac_to_bytes(dst_mac)
+    layout = frame_format(value_size)
+    _pack_ethernet(buf, offset, dst_mac, src_mac, P4KWAY_ETYPE)
+    pack_header(buf, offset + P4KWAY_OFFSET, front_type, main_type, k, v, cache, front, seq, op,
+                value_size=value_size)
+    buf[offset + layout.headers_size:offset + layout.frame_size] = PADDING
+
+
+def build_frame(src_mac, front_type='F', main_type='F', k=0, v=0, cache=0, front=0, seq=0, dst_mac=SWITCH_MAC,
+                op=OP_GET, value_size=VALUE_SIZE):
+    frame = bytearray(frame_format(value_size).frame_size)
+    pack_frame(frame, 0, src_mac, front_type, main_type, k, v, cache, front, seq, dst_mac, op, value_size)
+    return frame
+
+
+def set_key(frame, k, offset=0):
+    """ Patches the key of a packed frame in place. """
+    _pack_key(frame, offset + KEY_OFFSET, k)
+
+
+def set_value(frame, v, offset=0, value_size=VALUE_SIZE):
+    """ Patches the value of a packed frame in place. """
+    struct.pack_into('!' + VALUE_CODES[value_size][0], frame, offset + VALUE_OFFSET, v)
+
+
+def set_seq(frame, seq, offset=0, value_size=VALUE_SIZE):
+    _pack_seq(frame, offset + frame_format(value_size).seq_offset, seq)
+
+
+def get_seq(frame, offset=0, value_size=VALUE_SIZE):
+    return _unpack_seq(frame, offset + frame_format(value_size).seq_offset)[0]
+
+
+def unpack_frame(buf, offset=0, value_size=VALUE_SIZE):
+    """
+    Returns (dst, src, front_type, main_type, k, v, cache, front, seq, op,
+    served, port) or None for non P4kway frames.
+    """
+    dst, src, ether_type = ETHERNET_HEADER.unpack_from(buf, offset)
+    if ether_type != P4KWAY_ETYPE:
+        return None
+    header = unpack_header(buf, offset + P4KWAY_OFFSET, value_size)
+    if header is None:
+        return None
+    return (dst, src) + header
+
+
+def build_multi_frame(src_mac, records, front_type='F', main_type='F', seq=0, dst_mac=SWITCH_MAC,
+                      value_size=VALUE_SIZE):
+    """ A multi-key request frame for records of (k, op, v). """
+    if not isinstance(src_mac, bytes) or len(src_mac) != 6:
+        src_mac = mac_to_bytes(src_mac)
+    if not isinstance(dst_mac, bytes) or len(dst_mac) != 6:
+        dst_mac = mac_to_bytes(dst_mac)
+    record = record_format(value_size)
+    frame = bytearray(RECORDS_OFFSET + len(records) * record.size)
+    _pack_ethernet(frame, 0, dst_mac, src_mac, P4KWAY_MULTI_ETYPE)
+    MULTI_HEADER.pack_into(frame, MULTI_OFFSET, P4KWAY_P, P4KWAY_4, P4KWAY_VER, policy_byte(front_type),
+                           policy_byte(main_type), len(records), 0, 0, seq)
+    for i, (k, op, v) in enumerate(records):
+        record.pack_into(frame, RECORDS_OFFSET + i * record.size, k, v, 0, 0, op, 0)
+    return frame
+
+
+def unpack_multi_frame(buf, offset=0, value_size=VALUE_SIZE):
+    """
+    Returns (dst, src, front_type, main_type, index, seq, records), records a
+    list of (k, v, cache, front, op, served), or None for other frames.
+    """
+    dst, src, ether_type = ETHERNET_HEADER.unpack_from(buf, offset)
+    if ether_type != P4KWAY_MULTI_ETYPE or len(buf) - offset < RECORDS_OFFSET:
+        return None
+    p, four, ver, front_type, main_type, count, index, _, seq = MULTI_HEADER.unpack_from(buf, offset + MULTI_OFFSET)
+    record = record_format(value_size)
+    if (p, four, ver) != (P4KWAY_P, P4KWAY_4, P4KWAY_VER) or \
+            len(buf) - offset < RECORDS_OFFSET + count * record.size:
+        return None
+    records = [record.unpack_from(buf, offset + RECORDS_OFFSET + i * record.size) for i in range(count)]
+    return dst, src, front_type, main_type, index, seq, records
+
+
+def pack_batch(buf, src_mac, front_type, main_type, keys, first_seq=0, stride=None, dst_mac=SWITCH_MAC,
+               value_size=VALUE_SIZE):
+    """
+    Packs one request frame per key, stride (by default frame_size) bytes
+    apart and numbered from first_seq, into buf.
+    """
+    layout = frame_format(value_size)
+    stride = stride or layout.frame_size
+    if len(buf) < len(keys) * stride:
+        raise ValueError("buffer holds %d frames, %d requested" % (len(buf) // stride, len(keys)))
+    if not len(keys):
+        return
+    pack_frame(buf, 0, src_mac, front_type, main_type, 0, dst_mac=dst_mac, value_size=value_size)
+    first = bytes(buf[:layout.frame_size])
+    offset = 0
+    for seq, k in enumerate(keys, first_seq):
+        buf[offset:offset + layout.frame_size] = first
+        _pack_key(buf, offset + KEY_OFFSET, k)
+        _pack_seq(buf, offset + layout.seq_offset, seq)
+        offset += stride
+
+
+def unpack_batch(buf, count, stride=None, value_size=VALUE_SIZE):
+    """ unpack_frame for count frames stride (by default frame_size) bytes apart. """
+    stride = stride or frame_format(value_size).frame_size
+    return [unpack_frame(buf, i * stride, value_size) for i in range(count)]
+
+
+def decode_frames(buf, count=None, stride=None, value_size=VALUE_SIZE):
+    """
+    Views count fixed-stride frames of buf as a frame_dtype array, without
+    copying. Fields are accessed as e.g. frames['p4kway']['k'].
+    """
+    layout = frame_format(value_size)
+    stride = stride or layout.frame_size
+    if count is None:
+        count = len(buf) // stride
+    return np.ndarray((count,), dtype=layout.frame_dtype, buffer=buf, strides=(stride,))
+
+
+def gather_frames(data, offsets, value_size=VALUE_SIZE):
+    """
+    Decodes the headers of the frames starting at the given offsets of a
+    uint8 array (e.g. a receive ring) into a frame_dtype array. Only the
+    headers_size header bytes of each frame are copied.
+    """
+    layout = frame_format(value_size)
+    rows = data[np.asarray(offsets, dtype=np.int64)[:, None] + np.arange(layout.headers_size)]
+    return rows.view(layout.frame_dtype).reshape(-1)
+
+
+def valid_mask(frames):
+    """ Boolean mask of the decoded frames (of any value size) that carry a P4kway header. """
+    header = frames['p4kway']
+    return ((frames['etherType'] == P4KWAY_ETYPE) & (header['p'] == P4KWAY_P) &
+            (header['four'] == P4KWAY_4) & (header['ver'] == P4KWAY_VER))
+
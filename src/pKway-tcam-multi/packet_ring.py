@@ -0,0 +1,123 @@
+"""
+TPACKET_V3 (PACKET_MMAP) receive ring on an AF_PACKET socket.
+
+The kernel fills blocks of a ring shared with the process and hands over a
+whole block at a time, when it is full or after retire_ms, so a burst of
+answers costs one poll() instead of one recv() per frame. Frames are read in
+place: read_block() only walks the block's frame headers and returns the
+offsets of the frames in the ring, which p4kway_codec.gather_frames decodes
+with numpy.
+
+Frames the kernel had to drop because every block was still owned by the
+process are counted by the kernel and reported by statistics().
+"""
+import mmap
+import select
+import socket
+import struct
+
+import numpy as np
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+PACKET_IGNORE_OUTGOING = 23
+TPACKET_V3 = 2
+PACKET_OUTGOING = 4
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+TPACKET_REQ3 = struct.Struct('IIIIIII')
+# tp_packets, tp_drops, tp_freeze_q_cnt
+TPACKET_STATS_V3 = struct.Struct('III')
+# tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1 block_status, num_pkts,
+# offset_to_first_pkt
+BLOCK_HEADER = struct.Struct('IIIII')
+# tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac
+FRAME_HEADER = struct.Struct('IIIIIIH')
+BLOCK_STATUS_OFFSET = 8
+# sll_pkttype of the sockaddr_ll that follows the 48 byte tpacket3_hdr
+PKTTYPE_OFFSET = 48 + 10
+
+DEFAULT_BLOCK_SIZE = 1 << 18
+DEFAULT_BLOCK_COUNT = 64
+DEFAULT_FRAME_SIZE = 1 << 11
+DEFAULT_RETIRE_MS = 1
+
+
+class PacketRing(object):
+    def __init__(self, iface, protocol, block_size=DEFAULT_BLOCK_SIZE, block_count=DEFAULT_BLOCK_COUNT,
+                 frame_size=DEFAULT_FRAME_SIZE, retire_ms=DEFAULT_RETIRE_MS):
+        if block_size % mmap.PAGESIZE or block_size % frame_size:
+            raise ValueError("block size must be a multiple of the page size and of the frame size")
+        self.block_size = block_size
+        self.block_count = block_count
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(protocol))
+        sock = self.sock
+        sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        try:
+            # Keep the frames this host sends out of the ring (Linux >= 4.20)
+            sock.setsockopt(SOL_PACKET, PACKET_IGNORE_OUTGOING, 1)
+        except (OSError, socket.error):
+            pass
+        sock.setsockopt(SOL_PACKET, PACKET_RX_RING,
+                        TPACKET_REQ3.pack(block_size, block_count, frame_size,
+                                          block_size // frame_size * block_count, retire_ms, 0, 0))
+        sock.bind((iface, protocol))
+        self.ring = mmap.mmap(sock.fileno(), block_size * block_count, mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.view = np.frombuffer(self.ring, dtype=np.uint8)
+        self.poller = select.poll()
+        self.poller.register(sock.fileno(), select.POLLIN | select.POLLERR)
+        self.block = 0
+        self.packets = 0
+        self.drops = 0
+        self.freezes = 0
+
+    def read_block(self, timeout_ms, min_length=0):
+        """
+        Waits up to timeout_ms for the next block and returns the ring offsets
+        of its incoming frames of at least min_length bytes and their kernel
+        receive times in seconds, or None. The block belongs to the caller
+        until release_block().
+        """
+        start = self.block * self.block_size
+        ring = self.ring
+        if not BLOCK_HEADER.unpack_from(ring, start)[2] & TP_STATUS_USER:
+            self.poller.poll(timeout_ms)
+            if not BLOCK_HEADER.unpack_from(ring, start)[2] & TP_STATUS_USER:
+                return None
+        _, _, _, count, position = BLOCK_HEADER.unpack_from(ring, start)
+        position += start
+        offsets = []
+        times = []
+        for _ in range(count):
+            next_offset, seconds, nanoseconds, length, _, _, mac = FRAME_HEADER.unpack_from(ring, position)
+            if length >= min_length and ring[position + PKTTYPE_OFFSET] != PACKET_OUTGOING:
+                offsets.append(position + mac)
+                times.append(seconds + nanoseconds * 1e-9)
+            position += next_offset
+        return np.array(offsets, dtype=np.int64), times
+
+    def release_block(self):
+        """ Hands the current block back to the kernel and moves on to the next one. """
+        struct.pack_into('I', self.ring, self.block * self.block_size + BLOCK_STATUS_OFFSET, TP_STATUS_KERNEL)
+        self.block = (self.block + 1) % self.block_count
+
+    def statistics(self):
+        """ Totals of (packets, drops, queue freezes); the kernel resets its counters on every read. """
+        packets, drops, freezes = TPACKET_STATS_V3.unpack(
+            self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, TPACKET_STATS_V3.size))
+        self.packets += packets
+        self.drops += drops
+        self.freezes += freezes
+        return self.packets, self.drops, self.freezes
+
+    def close(self):
+        self.statistics()
+        self.view = None
+        self.ring.close()
+        self.sock.close()
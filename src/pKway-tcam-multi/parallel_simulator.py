@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""
+Set-parallel version of simulator.KwayCacheSimulator.
+
+A key only ever touches the registers of its set h (k % MAX_ENTRIES, or the
+set hash of the key), so the trace
+is partitioned by set and the sets are simulated independently in a process
+pool. The two pieces of state shared between sets are reconstructed without
+replaying the whole trace:
+
+  * r_timestamp is a pure function of the request index (n % (max_turns + 1)),
+    so the number of deamortization rounds that aged a counter between two
+    requests has a closed form.
+  * r_counter entries of keys owned by the set are kept lazily (value and the
+    index it was last brought up to date at). Key 0 is the value of empty
+    slots and is read by the filter of every set, so its counter trajectory is
+    precomputed once as prefix arrays and looked up by request index.
+
+Running with a single process goes through exactly the same code path, which
+makes it a reference for the parallel one.
+"""
+from __future__ import print_function
+
+import argparse
+import bisect
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from simulator import (KwayCacheSimulator, P4GET_VAL_LFU, POLICIES, COUNTER_MASK, AGING_DOUBLE, AGINGS,
+                       COUNTER_DENSE, COUNTERS, SET_HASH_IDENTITY, SET_HASHES, age, deamortization_schedule, set_index)
+from trace_file import DEFAULT_CHUNK_SIZE, load_keys
+
+# Keys that are read by the filter of sets they don't belong to (the empty slot value)
+SHARED_KEYS = (0,)
+
+
+class AgingClock(object):
+    """
+    Closed form of the r_timestamp deamortization schedule: blocks of
+    size_of_each_deamortization consecutive counters, aged at timestamps
+    first_timestamp, first_timestamp + spacing, ...
+    """
+    def __init__(self, max_entries_size, main_cache_size, key_size, deamortization='unrolled',
+                 deamortization_width=1, aging=AGING_DOUBLE, aging_period=0, aging_decrement=1):
+        schedule, max_turns = deamortization_schedule(max_entries_size, main_cache_size, key_size,
+                                                      deamortization, deamortization_width, aging_period)
+        self.aging = aging
+        self.aging_decrement = aging_decrement
+        self.period = max_turns + 1
+        self.size_of_each_deamortization = 0
+        self.aged_keys = 0
+        self.first_timestamp = 0
+        self.spacing = 1
+        timestamps = sorted(schedule)
+        if timestamps:
+            start, end = schedule[timestamps[0]]
+            self.first_timestamp = timestamps[0]
+            if len(timestamps) > 1:
+                self.spacing = timestamps[1] - timestamps[0]
+            self.size_of_each_deamortization = end - start
+            self.aged_keys = schedule[timestamps[-1]][1]
+
+    def timestamp_of(self, key):
+        """ The r_timestamp value at which the counter of key is aged, or None. """
+        if key >= self.aged_keys:
+            return None
+        return self.first_timestamp + self.spacing * (key // self.size_of_each_deamortization)
+
+    def rounds(self, key, after, until):
+        """ Number of times key was aged by requests with index in (after, until]. """
+        t = self.timestamp_of(key)
+        if t is None:
+            return 0
+        return (until - t) // self.period - (after - t) // self.period
+
+    def age(self, key, value, after, until):
+        return age(value, self.aging, self.aging_decrement, self.rounds(key, after, until))
+
+
+def shared_counter_prefix(keys, key, clock, counter_size):
+    """
+    Returns (positions, values): the indexes at which key was requested and
+    its r_counter value right after each of them.
+    """
+    positions = np.flatnonzero(keys == key).astype(np.int64)
+    if key >= counter_size:
+        return positions, np.zeros(len(positions), dtype=np.int64)
+    if clock.timestamp_of(key) is None:
+        return positions, (np.arange(1, len(positions) + 1, dtype=np.int64) & COUNTER_MASK)
+
+    values = np.empty(len(positions), dtype=np.int64)
+    value = 0
+    last = -1
+    for j, n in enumerate(positions.tolist()):
+        value = (clock.age(key, value, last, n) + 1) & COUNTER_MASK
+        values[j] = value
+        last = n
+    return positions, values
+
+
+class SetSimulator(KwayCacheSimulator):
+    """
+    Simulates a subset of the sets, given the request indexes of their keys.
+    shared maps each of SHARED_KEYS to its (positions, values) prefix lists.
+    """
+    def __init__(self, config, shared):
+        KwayCacheSimulator.__init__(self, *config)
+        self.clock = AgingClock(self.max_entries_size, self.main_cache_size, self.key_size, self.deamortization,
+                                self.deamortization_width, self.aging, self.aging_period, self.aging_decrement)
+        self.counters = {}
+        self.shared = shared
+        self.index = -1
+
+    def count(self, k):
+        if k < self.counter_size and k not in self.shared:
+            value, last = self.counters.get(k, (0, -1))
+            value = self.clock.age(k, value, last, self.index)
+            self.counters[k] = ((value + 1) & COUNTER_MASK, self.index)
+
+    def read_counter(self, key):
+        if key >= self.counter_size:
+            return 0
+        if key in self.shared:
+            positions, values = self.shared[key]
+            j = bisect.bisect_right(positions, self.index) - 1
+            if j < 0:
+                return 0
+            return self.clock.age(key, values[j], positions[j], self.index)
+        value, last = self.counters.get(key, (0, -1))
+        return self.clock.age(key, value, last, self.index)
+
+    def run_set(self, h, positions, keys):
+        cache_bits = np.empty(len(keys), dtype=np.uint8)
+        front_bits = np.empty(len(keys), dtype=np.uint8)
+        for j, (n, k) in enumerate(zip(positions.tolist(), keys.tolist())):
+            self.index = n
+            self.count(k)
+            cache_bits[j], front_bits[j] = self.lookup(h, k)
+        return cache_bits, front_bits
+
+
+# State of the pool workers, inherited (or unpickled once) through the initializer
+_worker = {}
+
+
+def _init_worker(config, keys, order, bounds, shared):
+    _worker['config'] = config
+    _worker['keys'] = keys
+    _worker['order'] = order
+    _worker['bounds'] = bounds
+    _worker['shared'] = dict((key, (positions.tolist(), values.tolist()))
+                             for key, (positions, values) in shared.items())
+
+
+def _simulate_sets(job):
+    first_set, last_set = job
+    keys, order, bounds = _worker['keys'], _worker['order'], _worker['bounds']
+    simulator = SetSimulator(_worker['config'], _worker['shared'])
+
+    cache_bits = []
+    front_bits = []
+    for h in range(first_set, last_set):
+        positions = order[bounds[h]:bounds[h + 1]]
+        cache, front = simulator.run_set(h, positions, keys[positions])
+        cache_bits.append(cache)
+        front_bits.append(front)
+    if not cache_bits:
+        return job, np.empty(0, dtype=np.uint8), np.empty(0, dtype=np.uint8)
+    return job, np.concatenate(cache_bits), np.concatenate(front_bits)
+
+
+def set_indexes(keys, max_entries_size, set_hash=SET_HASH_IDENTITY, key_size=16):
+    """ simulator.set_index of every key, as int64. """
+    if set_hash == SET_HASH_IDENTITY:
+        return (keys % max_entries_size).astype(np.int64)
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    table = np.array([set_index(k, max_entries_size, set_hash, key_size) for k in distinct.tolist()], dtype=np.int64)
+    return table[inverse.reshape(-1)]
+
+
+def partition(keys, max_entries_size, set_hash=SET_HASH_IDENTITY, key_size=16):
+    """ Returns (order, bounds): request indexes grouped by set, stable within a set. """
+    sets = set_indexes(keys, max_entries_size, set_hash, key_size)
+    order = np.argsort(sets, kind='stable')
+    bounds = np.searchsorted(sets[order], np.arange(max_entries_size + 1))
+    return order, bounds
+
+
+def make_jobs(bounds, jobs):
+    """ Splits the sets into at most `jobs` contiguous ranges of similar request counts. """
+    max_entries_size = len(bounds) - 1
+    targets = np.linspace(0, bounds[-1], jobs + 1)[1:-1]
+    cuts = np.unique(np.concatenate(([0], np.searchsorted(bounds, targets), [max_entries_size])))
+    return [(int(a), int(b)) for a, b in zip(cuts[:-1], cuts[1:]) if b > a]
+
+
+def simulate(keys, max_entries_size, main_cache_size, front_cache_size, key_size,
+             front_type=P4GET_VAL_LFU, main_type=P4GET_VAL_LFU, deamortization='unrolled', deamortization_width=1,
+             aging=AGING_DOUBLE, aging_period=0, aging_decrement=1, counter=COUNTER_DENSE, sketch_depth=3,
+             sketch_width=1024, set_hash=SET_HASH_IDENTITY, processes=None, jobs_per_process=4,
+             chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Simulates the whole trace and returns (cache bits, front bits) as uint8
+    arrays in request order. processes=1 runs in the calling process.
+    Count-Min counters are shared by keys of every set, so those
+    configurations are simulated sequentially, chunk_size keys at a time.
+
+    keys can be any unsigned or int64 array, including the memory mapped key
+    column of trace_file.load_keys: it is indexed in place, never copied
+    whole, and forked workers share its pages.
+    """
+    config = (max_entries_size, main_cache_size, front_cache_size, key_size, front_type, main_type, deamortization,
+              deamortization_width, aging, aging_period, aging_decrement, counter, sketch_depth, sketch_width,
+              set_hash)
+    keys = np.asarray(keys)
+    if counter != COUNTER_DENSE:
+        simulator = KwayCacheSimulator(*config)
+        cache_bits = np.empty(len(keys), dtype=np.uint8)
+        front_bits = np.empty(len(keys), dtype=np.uint8)
+        for start in range(0, len(keys), chunk_size):
+            cache, front = simulator.run(keys[start:start + chunk_size].tolist())
+            cache_bits[start:start + len(cache)] = np.frombuffer(cache, dtype=np.uint8)
+            front_bits[start:start + len(front)] = np.frombuffer(front, dtype=np.uint8)
+        return cache_bits, front_bits
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    clock = AgingClock(max_entries_size, main_cache_size, key_size, deamortization, deamortization_width, aging,
+                       aging_period, aging_decrement)
+    counter_size = 2 ** key_size - 1
+    shared = dict((key, shared_counter_prefix(keys, key, clock, counter_size)) for key in SHARED_KEYS)
+
+    order, bounds = partition(keys, max_entries_size, set_hash, key_size)
+    jobs = make_jobs(bounds, max(1, processes * jobs_per_process))
+
+    cache_bits = np.zeros(len(keys), dtype=np.uint8)
+    front_bits = np.zeros(len(keys), dtype=np.uint8)
+
+    initargs = (config, keys, order, bounds, shared)
+    if processes == 1:
+        _init_worker(*initargs)
+        results = map(_simulate_sets, jobs)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, initargs)
+        results = pool.imap_unordered(_simulate_sets, jobs)
+
+    try:
+        for (first_set, last_set), cache, front in results:
+            positions = order[bounds[first_set]:bounds[last_set]]
+            cache_bits[positions] = cache
+            front_bits[positions] = front
+    finally:
+        if processes != 1:
+            pool.close()
+            pool.join()
+    return cache_bits, front_bits
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Set-parallel simulation of the generated K-way cache')
+    parser.add_argument('trace', help='Binary trace or text file with one key per line', type=str)
+    parser.add_argument('--max-entries-size', type=int, required=False, default=2)
+    parser.add_argument('--main-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--front-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--front-type', choices=POLICIES, required=False, default=P4GET_VAL_LFU)
+    parser.add_argument('--main-type', choices=POLICIES, required=False, default=P4GET_VAL_LFU)
+    parser.add_argument('--deamortization', choices=['unrolled', 'compact'], required=False, default='unrolled')
+    parser.add_argument('--deamortization-width', type=int, required=False, default=1)
+    parser.add_argument('--aging', choices=AGINGS, required=False, default=AGING_DOUBLE)
+    parser.add_argument('--aging-period', help='Packets between two agings of a counter, 0 for the default',
+                        type=int, required=False, default=0)
+    parser.add_argument('--aging-decrement', type=int, required=False, default=1)
+    parser.add_argument('--counter', choices=COUNTERS, required=False, default=COUNTER_DENSE)
+    parser.add_argument('--sketch-depth', type=int, required=False, default=3)
+    parser.add_argument('--sketch-width', type=int, required=False, default=1024)
+    parser.add_argument('--set-hash', choices=SET_HASHES, required=False, default=SET_HASH_IDENTITY)
+    parser.add_argument('-j', '--processes', help='Worker processes, 1 to run in-process',
+                        type=int, required=False, default=None)
+    parser.add_argument('--verify', help='Compare against the single-process run',
+                        action='store_true', required=False, default=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    keys = load_keys(args.trace)
+    geometry = (args.max_entries_size, args.main_cache_size, args.front_cache_size, args.key_size,
+                args.front_type, args.main_type, args.deamortization, args.deamortization_width, args.aging,
+                args.aging_period, args.aging_decrement, args.counter, args.sketch_depth, args.sketch_width,
+                args.set_hash)
+
+    start = time.time()
+    cache_bits, front_bits = simulate(keys, *geometry, processes=args.processes)
+    elapsed = time.time() - start
+
+    requests = len(keys)
+    main_hits = int(cache_bits.sum())
+    front_hits = int((front_bits & (cache_bits ^ 1)).sum())
+    summary = {
+        'requests': requests,
+        'main_hits': main_hits,
+        'front_hits': front_hits,
+        'hit_ratio': float(main_hits + front_hits) / requests if requests else 0.0,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed if elapsed > 0 else 0.0,
+    }
+    if args.verify:
+        reference_cache, reference_front = simulate(keys, *geometry, processes=1)
+        summary['identical_to_single_process'] = bool((reference_cache == cache_bits).all() and
+                                                      (reference_front == front_bits).all())
+
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    if args.verify and not summary['identical_to_single_process']:
+        sys.exit(1)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Extracts P4kway request/response pairs from pcap captures into a binary trace.
+
+The captures written by the switches (pcap_dump / --pcap, one <iface>_in.pcap
+and <iface>_out.pcap per port) or by tcpdump on a host are read straight from
+a memory mapping and the P4kway header is decoded with struct, no scapy
+dissection involved. A packet answers an outstanding request when its MAC
+addresses are the request's swapped (see send_back() in the P4 program) and
+it carries the same key and seq. The fetches and fills a switch exchanges with
+its backend (generate_file.py --backend-port) are skipped, the fill reaches
+the requester as its response.
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import heapq
+import json
+import mmap
+import struct
+import sys
+
+from p4kway_codec import (P4KWAY_ETYPE, P4KWAY_OFFSET, P4KWAY_PREFIX, OP_FETCH, OP_FILL, VALUE_CODES, VALUE_SIZE,
+                          frame_format)
+from trace_file import TraceWriter, NO_RESPONSE
+
+PCAP_GLOBAL_HEADER_SIZE = 24
+PCAP_RECORD_HEADER_SIZE = 16
+# magic number -> (byte order, nanoseconds per timestamp fraction unit)
+PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1000),
+    b'\xa1\xb2\xc3\xd4': ('>', 1000),
+    b'\x4d\x3c\xb2\xa1': ('<', 1),
+    b'\xa1\xb2\x3c\x4d': ('>', 1),
+}
+LINKTYPE_ETHERNET = 1
+
+
+def read_pcap(path, value_size=VALUE_SIZE):
+    """
+    Yields (timestamp ns, dst mac, src mac, k, v, cache, front, seq, op) for
+    every P4kway packet of a pcap file, whose v is value_size bits wide.
+    """
+    layout = frame_format(value_size)
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return  # empty file
+    try:
+        magic = data[:4]
+        if magic not in PCAP_MAGICS:
+            raise ValueError("%s is not a pcap file" % path)
+        byte_order, fraction_ns = PCAP_MAGICS[magic]
+        linktype = struct.unpack_from(byte_order + 'I', data, 20)[0]
+        if linktype != LINKTYPE_ETHERNET:
+            raise ValueError("%s: unsupported link type %d" % (path, linktype))
+
+        record_header = struct.Struct(byte_order + 'IIII')
+        unpack_p4kway = layout.header.unpack_from
+        etype = struct.pack('!H', P4KWAY_ETYPE)
+
+        offset = PCAP_GLOBAL_HEADER_SIZE
+        size = len(data)
+        while offset + PCAP_RECORD_HEADER_SIZE <= size:
+            seconds, fraction, captured, _ = record_header.unpack_from(data, offset)
+            offset += PCAP_RECORD_HEADER_SIZE
+            start = offset
+            offset += captured
+            if offset > size:
+                break  # truncated capture
+            if captured < layout.headers_size or data[start + 12:start + 14] != etype:
+                continue
+            if data[start + P4KWAY_OFFSET:start + P4KWAY_OFFSET + 3] != P4KWAY_PREFIX:
+                continue
+            _, _, _, _, _, k, v, cache, front, seq, op, _, _ = unpack_p4kway(data, start + P4KWAY_OFFSET)
+            if op == OP_FETCH or op == OP_FILL:
+                continue
+            yield (seconds * 1000000000 + fraction * fraction_ns,
+                   data[start:start + 6], data[start + 6:start + 12], k, v, cache, front, seq, op)
+    finally:
+        data.close()
+
+
+def read_pcaps(paths, value_size=VALUE_SIZE):
+    """ The P4kway packets of several captures merged in timestamp order. """
+    return heapq.merge(*[read_pcap(path, value_size) for path in paths])
+
+
+class RequestMatcher(object):
+    """
+    Pairs requests with the responses that answer them and hands out the
+    records in request order once they are answered or timed out.
+    """
+    def __init__(self, timeout_ns):
+        self.timeout_ns = timeout_ns
+        self.pending = collections.deque()
+        self.outstanding = collections.defaultdict(collections.deque)
+        self.stats = collections.Counter()
+
+    def add(self, timestamp, dst, src, k, v, cache, front, seq, op):
+        self.stats['packets'] += 1
+        waiting = self.outstanding.get((dst, src, seq, k))
+        if waiting:
+            record = waiting.popleft()
+            if not waiting:
+                del self.outstanding[(dst, src, seq, k)]
+            record[2], record[3], record[4] = cache, front, timestamp
+            self.stats['responses'] += 1
+            self.stats['main_hits'] += cache
+            self.stats['front_hits'] += front & (cache ^ 1)
+        else:
+            record = [k, timestamp, NO_RESPONSE, NO_RESPONSE, 0, (src, dst, seq), op]
+            self.pending.append(record)
+            self.outstanding[(src, dst, seq, k)].append(record)
+            self.stats['requests'] += 1
+        return self.ready(timestamp)
+
+    def ready(self, now=None):
+        """ Pops the leading records that are answered, or expired at time now (all if None). """
+        done = []
+        pending = self.pending
+        while pending:
+            record = pending[0]
+            if record[2] == NO_RESPONSE:
+                if now is not None and now - record[1] <= self.timeout_ns:
+                    break
+                self._expire(record)
+            done.append(pending.popleft())
+        return done
+
+    def _expire(self, record):
+        key = record[5] + (record[0],)
+        waiting = self.outstanding.get(key)
+        if waiting and waiting[0] is record:
+            waiting.popleft()
+            if not waiting:
+                del self.outstanding[key]
+        self.stats['unanswered'] += 1
+
+
+def extract(paths, dst, key_size=16, timeout=1.0, chunk_size=1 << 16, value_size=VALUE_SIZE):
+    """ Writes the request/response pairs found in paths to the trace dst and returns statistics. """
+    matcher = RequestMatcher(int(timeout * 1000000000))
+    batch = []
+    with TraceWriter(dst, key_size, ops=True, timestamps=True, responses=True) as writer:
+        for packet in read_pcaps(paths, value_size):
+            batch.extend(matcher.add(*packet))
+            if len(batch) >= chunk_size:
+                _write_batch(writer, batch)
+                batch = []
+        batch.extend(matcher.ready())
+        if batch:
+            _write_batch(writer, batch)
+    return dict(matcher.stats)
+
+
+def _write_batch(writer, batch):
+    keys, timestamps, cache, front, response_timestamps, _, ops = zip(*batch)
+    writer.write(keys, op=ops, timestamp=timestamps, cache=cache, front=front,
+                 response_timestamp=response_timestamps)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Extract P4kway request/response pairs from pcap files')
+    parser.add_argument('pcaps', help='Captures to merge, e.g. pcaps/s1-eth1_in.pcap pcaps/s1-eth1_out.pcap',
+                        type=str, nargs='+')
+    parser.add_argument('-o', '--output', help='Binary trace to write', type=str, required=True)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--value-size', help='Bits of v, as the program was generated with',
+                        type=int, choices=sorted(VALUE_CODES), required=False, default=VALUE_SIZE)
+    parser.add_argument('--timeout', help='Seconds after which a request counts as unanswered',
+                        type=float, required=False, default=1.0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    stats = extract(args.pcaps, args.output, args.key_size, args.timeout, value_size=args.value_size)
+    json.dump(stats, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+Hit ratio / register traffic trade-off of the replacement policies.
+
+For every --front-type and --main-type combination the report gives the hit
+ratio the simulator reaches on the workload, its difference to LFU in both
+caches, and the register reads / writes per request of the generated program
+(program_cost.py) under that combination, weighted by the main hit, front hit
+and miss rates measured on the workload. Misses are counted as
+miss_main_insert, the costlier of the two miss paths. Printed as JSON.
+
+    python policy_report.py --workload 'zipf:alpha=0.99' --max-entries-size 64 --main-cache-size 8
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+import program_cost
+from generate_file import render_program
+from parallel_simulator import simulate
+from simulator import P4GET_VAL_LFU, P4GET_VAL_FIFO, P4GET_VAL_CLOCK, POLICIES
+from workload import generate_keys, parse_spec
+
+DEFAULT_WORKLOAD = 'zipf:alpha=0.99'
+# program_cost.POLICIES of the front_type / main_type bytes
+POLICY_NAMES = {P4GET_VAL_LFU: 'lfu', P4GET_VAL_FIFO: 'fifo', P4GET_VAL_CLOCK: 'clock'}
+
+
+def path_costs(program, front_type, main_type):
+    """ program_cost summary of every request path with the caches running the given policies. """
+    conditions = program_cost.policy_conditions(POLICY_NAMES[front_type], POLICY_NAMES[main_type])
+    return dict((path, program.summary(program.cost(program.apply, dict(path_conditions, **conditions))))
+                for path, path_conditions in program.paths())
+
+
+def report(keys, geometry, front_types, main_types, processes=None):
+    """ One result dict per policy combination, the highest hit ratio first. """
+    max_entries_size, main_cache_size, front_cache_size, key_size = geometry
+    program = program_cost.Program(render_program(max_entries_size, main_cache_size, front_cache_size, key_size))
+    requests = len(keys)
+    results = []
+    for front_type in front_types:
+        for main_type in main_types:
+            cache_bits, front_bits = simulate(keys, max_entries_size, main_cache_size, front_cache_size, key_size,
+                                              front_type, main_type, processes=processes)
+            main_hits = int(cache_bits.sum())
+            front_hits = int((front_bits & (cache_bits ^ 1)).sum())
+            misses = requests - main_hits - front_hits
+            costs = path_costs(program, front_type, main_type)
+            weights = (('main_hit', main_hits), ('front_hit', front_hits), ('miss_main_insert', misses))
+            results.append({
+                'front_type': front_type,
+                'main_type': main_type,
+                'hit_ratio': float(main_hits + front_hits) / requests if requests else 0.0,
+                'miss_reads': costs['miss_main_insert']['reads'],
+                'miss_writes': costs['miss_main_insert']['writes'],
+                'reads_per_request': float(sum(costs[path]['reads'] * n for path, n in weights)) / max(1, requests),
+                'writes_per_request': float(sum(costs[path]['writes'] * n for path, n in weights)) / max(1, requests),
+                'bits_per_request': float(sum((costs[path]['read_bits'] + costs[path]['write_bits']) * n
+                                              for path, n in weights)) / max(1, requests),
+            })
+    baseline = [result['hit_ratio'] for result in results
+                if result['front_type'] == P4GET_VAL_LFU and result['main_type'] == P4GET_VAL_LFU]
+    for result in results:
+        result['hit_ratio_delta'] = result['hit_ratio'] - baseline[0] if baseline else None
+    results.sort(key=lambda result: -result['hit_ratio'])
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Hit ratio and register traffic of the replacement policies')
+    parser.add_argument('--workload', help='workload.py spec', type=str, required=False, default=DEFAULT_WORKLOAD)
+    parser.add_argument('-n', '--requests', type=int, required=False, default=200000)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    parser.add_argument('--max-entries-size', type=int, required=False, default=2)
+    parser.add_argument('--main-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--front-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--front-type', help='Comma separated policies', type=str, required=False,
+                        default=','.join(POLICIES))
+    parser.add_argument('--main-type', help='Comma separated policies', type=str, required=False,
+                        default=','.join(POLICIES))
+    parser.add_argument('-j', '--processes', type=int, required=False, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    keys = np.ascontiguousarray(generate_keys(parse_spec(args.workload, args.key_size), args.requests, args.seed))
+    geometry = (args.max_entries_size, args.main_cache_size, args.front_cache_size, args.key_size)
+    for policy in args.front_type.split(',') + args.main_type.split(','):
+        if policy not in POLICIES:
+            sys.exit("policies are %s, got %r" % (', '.join(POLICIES), policy))
+    results = report(keys, geometry, args.front_type.split(','), args.main_type.split(','), args.processes)
+    json.dump({'workload': args.workload, 'requests': args.requests, 'results': results}, sys.stdout, indent=2)
+    print()
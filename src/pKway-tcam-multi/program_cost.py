@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+"""
+Register access cost of a generated P4kway program, read off its source.
+
+The apply block of MyIngress is walked once per request path, inlining the
+actions it calls, and every register read / write on the way is counted
+together with the bits it moves. The paths are told apart by the conditions
+that decide them; any other condition (the LFU comparisons, the way
+selection inside actions, the conservative update) is data dependent and
+counted by its most expensive branch, so the figures are per packet worst
+cases.
+
+Programs that forward misses to a backend (generate_file.py --backend-port)
+get one more path, backend_fill: the backend's answer storing its value.
+
+The replacement policy of each cache is picked by the front_type / main_type
+byte of the request; the paths are reported for the worst of them and again
+for every policy (both caches running it).
+
+The unrolled deamortization ages a block of counters on one packet out of
+every few, guarded by current_timestamp; it is reported apart from the paths
+as the cost of its most expensive packet and the average per packet. The
+compact deamortization runs on every packet and is part of every path.
+
+    python program_cost.py cahceway.p4
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import re
+import sys
+
+# Conditions that select the request path, and their value on each path.
+# [KEY] stands for the key bits of an element, [KEY_SIZE + 31:32]
+REQUEST = {'fill': False, '!fill': True}
+PATHS = collections.OrderedDict([
+    ('main_hit', dict(REQUEST, **{'hdr.p4kway.cache == 1': True})),
+    ('front_hit', dict(REQUEST, **{'hdr.p4kway.cache == 1': False, 'hdr.p4kway.front == 1': True})),
+    ('miss_main_insert', dict(REQUEST, **{'hdr.p4kway.cache == 1': False, 'hdr.p4kway.front == 1': False,
+                                          'current_victim[KEY] != 0': True})),
+    ('miss_front_only', dict(REQUEST, **{'hdr.p4kway.cache == 1': False, 'hdr.p4kway.front == 1': False,
+                                         'current_victim[KEY] != 0': False})),
+    ('backend_fill', {'fill': True, '!fill': False}),
+])
+# Paths that only exist in programs testing their condition
+OPTIONAL_PATHS = {'backend_fill': 'fill'}
+POLICY_CONDITIONS = ('hdr.p4kway.{0}_type == P4GET_VAL_FIFO || hdr.p4kway.{0}_type == P4GET_VAL_CLOCK',
+                     'hdr.p4kway.{0}_type == P4GET_VAL_CLOCK')
+# Values of POLICY_CONDITIONS under each policy
+POLICIES = collections.OrderedDict([
+    ('lfu', (False, False)),
+    ('fifo', (True, False)),
+    ('clock', (True, True)),
+])
+ALWAYS = {'hdr.p4kway.isValid()': True}
+TIMESTAMP_CONDITION = re.compile(r'^current_timestamp == \d+$')
+
+DEFINE = re.compile(r'^#define\s+(\w+)\s+(.+)$', re.M)
+REGISTER = re.compile(r'register<bit<(.+?)>>\s*\((.+?)\)\s*(\w+)\s*;')
+ACTION = re.compile(r'\baction\s+(\w+)\s*\([^)]*\)\s*\{')
+TABLE = re.compile(r'\btable\s+(\w+)\s*\{')
+APPLY = re.compile(r'\bapply\s*\{')
+ACCESS = re.compile(r'\b(\w+)\.(read|write)\s*\(')
+CALL = re.compile(r'^(\w+)\s*\(')
+APPLY_CALL = re.compile(r'\b(\w+)\.apply\s*\(')
+TABLE_KEY = re.compile(r'([\w.\[\]:]+)\s*:\s*(ternary|exact|lpm|range)\s*;')
+CONST_ENTRY = re.compile(r':\s*\w+\s*\([^)]*\)\s*;')
+ARITHMETIC = re.compile(r'^[\d\s()+\-*/%]+$')
+
+
+def strip_comments(source):
+    return re.sub(r'//[^\n]*', '', re.sub(r'/\*.*?\*/', '', source, flags=re.S))
+
+
+def evaluate(expression, defines):
+    """ Value of a width / size expression made of numbers and #defines. """
+    expression = re.sub(r'\b[A-Za-z_]\w*\b', lambda name: '(%s)' % defines.get(name.group(0), name.group(0)),
+                        expression)
+    if not ARITHMETIC.match(expression):
+        raise ValueError("cannot evaluate %r" % expression)
+    return int(eval(expression.replace('/', '//'), {'__builtins__': {}}))
+
+
+def matching(source, start, opening='{', closing='}'):
+    """ Index just past the bracket that closes the one at start. """
+    depth = 0
+    for i in range(start, len(source)):
+        if source[i] == opening:
+            depth += 1
+        elif source[i] == closing:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    raise ValueError("unbalanced %s at %d" % (opening, start))
+
+
+def braced(source, match):
+    """ The body of the block whose '{' ends match. """
+    end = matching(source, match.end() - 1)
+    return source[match.end():end - 1], end
+
+
+def parse_block(text):
+    """
+    Splits a block into ('stmt', text), ('block', nodes) and
+    ('if', [(condition, nodes), ...], else nodes or None) nodes.
+    """
+    nodes = []
+    i = 0
+    while True:
+        while i < len(text) and text[i] in ' \t\r\n;':
+            i += 1
+        if i >= len(text):
+            return nodes
+        if text[i] == '{':
+            end = matching(text, i)
+            nodes.append(('block', parse_block(text[i + 1:end - 1])))
+            i = end
+        elif re.match(r'if\s*\(', text[i:]):
+            branches = []
+            otherwise = None
+            while True:
+                open_paren = text.index('(', i)
+                close_paren = matching(text, open_paren, '(', ')')
+                body, i = _branch(text, close_paren)
+                branches.append((' '.join(text[open_paren + 1:close_paren - 1].split()), body))
+                following = re.match(r'\s*else\b\s*', text[i:])
+                if not following:
+                    break
+                i += following.end()
+                if not re.match(r'if\s*\(', text[i:]):
+                    otherwise, i = _branch(text, i)
+                    break
+            nodes.append(('if', branches, otherwise))
+        else:
+            end = _statement_end(text, i)
+            nodes.append(('stmt', ' '.join(text[i:end].split())))
+            i = end + 1
+
+
+def _branch(text, i):
+    while text[i] in ' \t\r\n':
+        i += 1
+    if text[i] == '{':
+        end = matching(text, i)
+        return parse_block(text[i + 1:end - 1]), end
+    end = _statement_end(text, i)
+    return [('stmt', ' '.join(text[i:end].split()))], end + 1
+
+
+def _statement_end(text, i):
+    depth = 0
+    for j in range(i, len(text)):
+        if text[j] in '({':
+            depth += 1
+        elif text[j] in ')}':
+            depth -= 1
+        elif text[j] == ';' and depth == 0:
+            return j
+    return len(text)
+
+
+class Program(object):
+    def __init__(self, source):
+        source = strip_comments(source)
+        self.defines = dict(DEFINE.findall(source))
+        self.key_slice = '[%d:32]' % (evaluate('KEY_SIZE', self.defines) + 31)
+        self.registers = collections.OrderedDict()
+        for width, size, name in REGISTER.findall(source):
+            self.registers[name] = (evaluate(width, self.defines), evaluate(size, self.defines))
+        self.actions = {}
+        for match in ACTION.finditer(source):
+            self.actions[match.group(1)] = parse_block(braced(source, match)[0])
+        self.tables = collections.OrderedDict()
+        for match in TABLE.finditer(source):
+            body = braced(source, match)[0]
+            keys = TABLE_KEY.findall(body)
+            entries = body[body.index('entries'):] if 'entries' in body else ''
+            self.tables[match.group(1)] = {
+                'match_kinds': sorted(set(kind for _, kind in keys)),
+                'key_bits': sum(self.field_bits(source, field) for field, _ in keys),
+                'entries': len(CONST_ENTRY.findall(entries)),
+            }
+        ingress = source[source.index('control MyIngress'):]
+        applies = list(APPLY.finditer(ingress))
+        self.apply = parse_block(braced(ingress, applies[0])[0]) if applies else []
+        self.conditions = set(branch_conditions(self.apply))
+        self._action_costs = {}
+
+    def paths(self):
+        """ The PATHS of this program, as (name, conditions). """
+        return [(path, dict((condition.replace('[KEY]', self.key_slice), value)
+                            for condition, value in conditions.items()))
+                for path, conditions in PATHS.items()
+                if OPTIONAL_PATHS.get(path, 'hdr.p4kway.isValid()') in self.conditions]
+
+    def field_bits(self, source, field):
+        declaration = re.search(r'bit<(.+?)>\s+%s\s*;' % re.escape(field.split('.')[-1]), source)
+        return evaluate(declaration.group(1), self.defines) if declaration else 0
+
+    def cost(self, nodes, conditions, timestamped=None):
+        """
+        Counter of (register, 'read' / 'write') and ('table', name) of the
+        nodes. Blocks guarded by current_timestamp are skipped, or appended
+        to timestamped when it is a list.
+        """
+        total = collections.Counter()
+        for node in nodes:
+            if node[0] == 'stmt':
+                total.update(self.statement_cost(node[1]))
+            elif node[0] == 'block':
+                total.update(self.cost(node[1], conditions, timestamped))
+            else:
+                total.update(self.chain_cost(node[1], node[2], conditions, timestamped))
+        return total
+
+    def chain_cost(self, branches, otherwise, conditions, timestamped):
+        if not branches:
+            return self.cost(otherwise or [], conditions, timestamped)
+        condition, body = branches[0]
+        if TIMESTAMP_CONDITION.match(condition):
+            block = self.cost(body, conditions)
+            if timestamped is not None and block:
+                timestamped.append(block)
+            return self.chain_cost(branches[1:], otherwise, conditions, timestamped)
+        known = conditions.get(condition, ALWAYS.get(condition))
+        if known is True:
+            return self.cost(body, conditions, timestamped)
+        if known is False:
+            return self.chain_cost(branches[1:], otherwise, conditions, timestamped)
+        return max(self.cost(body, conditions, timestamped),
+                   self.chain_cost(branches[1:], otherwise, conditions, timestamped),
+                   key=self.weight)
+
+    def statement_cost(self, statement):
+        total = collections.Counter()
+        for register, operation in ACCESS.findall(statement):
+            if register in self.registers:
+                total[(register, operation)] += 1
+        for table in APPLY_CALL.findall(statement):
+            if table in self.tables:
+                total[('table', table)] += 1
+        call = CALL.match(statement)
+        if call and call.group(1) in self.actions:
+            total.update(self.action_cost(call.group(1)))
+        return total
+
+    def action_cost(self, name):
+        if name not in self._action_costs:
+            self._action_costs[name] = self.cost(self.actions[name], {})
+        return self._action_costs[name]
+
+    def weight(self, cost):
+        accesses = sum(count for (kind, _), count in cost.items() if kind != 'table')
+        return accesses, self.bits(cost)
+
+    def bits(self, cost):
+        return sum(self.registers[register][0] * count for (register, _), count in cost.items()
+                   if register in self.registers)
+
+    def summary(self, cost, scale=1):
+        registers = collections.OrderedDict()
+        for name in self.registers:
+            reads, writes = cost[(name, 'read')], cost[(name, 'write')]
+            if reads or writes:
+                registers[name] = {'reads': reads * scale, 'writes': writes * scale}
+        reads = sum(count for (name, operation), count in cost.items() if operation == 'read' and name != 'table')
+        writes = sum(count for (name, operation), count in cost.items() if operation == 'write' and name != 'table')
+        width = dict((name, register[0]) for name, register in self.registers.items())
+        return collections.OrderedDict([
+            ('reads', reads * scale),
+            ('writes', writes * scale),
+            ('read_bits', sum(width[name] * cost[(name, 'read')] for name in registers) * scale),
+            ('write_bits', sum(width[name] * cost[(name, 'write')] for name in registers) * scale),
+            ('table_lookups', sum(count for (kind, _), count in cost.items() if kind == 'table') * scale),
+            ('registers', registers),
+        ])
+
+
+def branch_conditions(nodes):
+    """ Every if condition of the nodes, nested ones included. """
+    for node in nodes:
+        if node[0] == 'block':
+            for condition in branch_conditions(node[1]):
+                yield condition
+        elif node[0] == 'if':
+            for condition, body in node[1]:
+                yield condition
+                for nested in branch_conditions(body):
+                    yield nested
+            for nested in branch_conditions(node[2] or []):
+                yield nested
+
+
+def policy_conditions(front_policy, main_policy=None):
+    """ The conditions of the front cache running front_policy and the main cache main_policy (the same by default). """
+    conditions = {}
+    for cache, policy in (('front', front_policy), ('main', main_policy or front_policy)):
+        for condition, value in zip(POLICY_CONDITIONS, POLICIES[policy]):
+            conditions[condition.format(cache)] = value
+    return conditions
+
+
+def analyze(source, packets_per_period=None):
+    """
+    The cost report of a program as a dict. packets_per_period (max_turns + 1)
+    turns the unrolled deamortization into a per packet average.
+    """
+    program = Program(source)
+    report = collections.OrderedDict()
+    report['registers'] = collections.OrderedDict(
+        (name, {'width': width, 'entries': entries, 'bits': width * entries})
+        for name, (width, entries) in program.registers.items())
+    report['register_bits'] = sum(register['bits'] for register in report['registers'].values())
+    report['register_bytes'] = -(-report['register_bits'] // 8)
+    report['tables'] = program.tables
+    report['tcam_entries'] = sum(table['entries'] for table in program.tables.values()
+                                 if 'ternary' in table['match_kinds'])
+    report['tcam_bits'] = sum(table['entries'] * table['key_bits'] for table in program.tables.values()
+                              if 'ternary' in table['match_kinds'])
+    report['paths'] = collections.OrderedDict(
+        (path, program.summary(program.cost(program.apply, conditions))) for path, conditions in program.paths())
+    report['policies'] = collections.OrderedDict()
+    for policy in POLICIES:
+        report['policies'][policy] = collections.OrderedDict(
+            (path, program.summary(program.cost(program.apply, dict(conditions, **policy_conditions(policy)))))
+            for path, conditions in program.paths())
+
+    timestamped = []
+    program.cost(program.apply, PATHS['main_hit'], timestamped)
+    deamortization = collections.OrderedDict([('blocks', len(timestamped))])
+    if timestamped:
+        deamortization['worst_packet'] = program.summary(max(timestamped, key=program.weight))
+        if packets_per_period:
+            total = sum(timestamped, collections.Counter())
+            deamortization['per_packet'] = program.summary(total, 1.0 / packets_per_period)
+    report['deamortization'] = deamortization
+    return report
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Register access cost of a P4kway program')
+    parser.add_argument('program', help='Generated .p4 file', type=str)
+    parser.add_argument('--period', help='Packets between two runs of the same deamortization block',
+                        type=int, required=False, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    with open(args.program) as f:
+        json.dump(analyze(f.read(), args.period), sys.stdout, indent=2)
+    print()
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from __future__ import print_function
 
 import argparse
 import sys
@@ -9,72 +10,127 @@ import re
 
 from scapy.all import sendp, send, srp1
 from scapy.all import Packet, hexdump
-from scapy.all import Ether, StrFixedLenField, XByteField, XShortField, BitField
-from scapy.all import bind_layers
+from scapy.all import Ether, StrFixedLenField, XByteField, BitField, IntField, ByteField, ShortField
+from scapy.all import bind_layers, split_layers
 import readline
 
-class P4kway(Packet):
-    name = "p4kway"
-    fields_desc = [ StrFixedLenField("P", "P", length=1),
-                    StrFixedLenField("Four", "4", length=1),
-                    XByteField("version", 0x01),
-                    StrFixedLenField("front_type", "F", length=1),
-                    StrFixedLenField("main_type", "F", length=1),
-                    BitField("k", 0, 16),
-                    XShortField("v", 0),
-                    BitField("cache", 0, 8),
-                    BitField("front", 0, 8),
-                    ]
+from p4kway_codec import VALUE_CODES, VALUE_SIZE
 
+try:
+    input = raw_input
+except NameError:
+    pass
 
-bind_layers(Ether, P4kway, type=0x1234)
+# P4kway header classes by the width of v
+LAYERS = {}
 
 
-def main():
+def p4kway_layer(value_size=VALUE_SIZE):
+    """ The P4kway header of a program generated with --value-size value_size, the one Ether dissects from now on. """
+    if value_size not in LAYERS:
+        class P4kway(Packet):
+            name = "p4kway"
+            fields_desc = [ StrFixedLenField("P", "P", length=1),
+                            StrFixedLenField("Four", "4", length=1),
+                            XByteField("version", 0x05),
+                            StrFixedLenField("front_type", "F", length=1),
+                            StrFixedLenField("main_type", "F", length=1),
+                            BitField("k", 0, 32),
+                            BitField("v", 0, value_size),
+                            BitField("cache", 0, 8),
+                            BitField("front", 0, 8),
+                            IntField("seq", 0),
+                            ByteField("op", 0),         # 0 GET, 1 PUT
+                            ByteField("served", 0),     # Set by the switch when v is the value of k
+                            ShortField("port", 0),      # Ingress port of a request forwarded to the backend
+                            ]
+        LAYERS[value_size] = P4kway
+    # Ether dissects with the first layer bound to the type
+    for layer in LAYERS.values():
+        split_layers(Ether, layer, type=0x1234)
+    bind_layers(Ether, LAYERS[value_size], type=0x1234)
+    return LAYERS[value_size]
+
+
+P4kway = p4kway_layer()
+
+
+def parse_request(s, value_size=VALUE_SIZE):
+    """ (op, key, value) of 'key' or 'put key value', ValueError if it is neither or does not fit the header. """
+    fields = s.split()
+    op, v = 0, 0
+    if fields[:1] == ['put']:
+        if len(fields) != 3:
+            raise ValueError("expected put <key> <value>, got %r" % s)
+        op, v, fields = 1, int(fields[2], 0), fields[1:2]
+    if len(fields) != 1:
+        raise ValueError("expected a key or put <key> <value>, got %r" % s)
+    k = int(fields[0], 0)
+    if not 0 <= k < 1 << 32:
+        raise ValueError("keys are 32 bits, got %d" % k)
+    if not 0 <= v < 1 << value_size:
+        raise ValueError("values are %d bits, got %d" % (value_size, v))
+    return op, k, v
+
+
+def main(value_size=VALUE_SIZE):
     s = ''
     iface = 'eth0'
+    layer = p4kway_layer(value_size)
 
-    while s not in ['LFU', 'FIFO']:
-        s = str(raw_input('Type FIFO or LFU for FRONT > '))
-    if s == 'LFU':
-        t1 = 'F'
-    elif s == 'FIFO':
-        t1 = 'R'
+    policies = {'LFU': 'F', 'FIFO': 'R', 'CLOCK': 'C'}
+    while s not in policies:
+        s = str(input('Type FIFO, CLOCK or LFU for FRONT > '))
+    t1 = policies[s]
     
     s = ''
-    while s not in ['LFU', 'FIFO']:
-        s = str(raw_input('Type FIFO or LFU for MAIN > '))
-    if s == 'LFU':
-        t2 = 'F'
-    elif s == 'FIFO':
-        t2 = 'R'
+    while s not in policies:
+        s = str(input('Type FIFO, CLOCK or LFU for MAIN > '))
+    t2 = policies[s]
 
+    seq = 0
     while True:
-        s = str(raw_input('Type a key or quit or exit> '))
+        s = str(input('Type a key, put <key> <value>, quit or exit> '))
         if s == "quit":
             break
         if s == "exit":
             break
-        s = int(s)
+        try:
+            op, s, v = parse_request(s, value_size)
+        except ValueError as error:
+            print('error --> ' + str(error))
+            continue
 
-        print s
+        print(s)
         try:
-            pkt = Ether(dst='00:04:00:00:00:00', type=0x1234) / P4kway(front_type=t1, main_type=t2, k=s)
+            seq += 1
+            pkt = Ether(dst='00:04:00:00:00:00', type=0x1234) / layer(front_type=t1, main_type=t2, k=s, v=v, seq=seq,
+                                                                    op=op)
             pkt = pkt/' '
 
 #            pkt.show()
             resp = srp1(pkt, iface=iface, timeout=1, verbose=False)
             if resp:
-                p4kway=resp[P4kway]
-                if p4kway:
-                    print('key={}, value={}, from_cache={}, from_front={}'.format(p4kway.k, p4kway.v, p4kway.cache, p4kway.front))
+                p4kway=resp[layer]
+                if p4kway and p4kway.seq != seq:
+                    print("response for request {} instead of {}".format(p4kway.seq, seq))
+                elif p4kway:
+                    print('key={}, value={}, served={}, from_cache={}, from_front={}'.format(
+                        p4kway.k, p4kway.v, p4kway.served, p4kway.cache, p4kway.front))
                 else:
-                    print "cannot find P4aggregate header in the packet"
+                    print("cannot find P4aggregate header in the packet")
             else:
-                print "Didn't receive response"
+                print("Didn't receive response")
         except Exception as error:
-            print 'error --> ' + error.message
+            print('error --> ' + str(error))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Send P4kway requests typed at the prompt')
+    parser.add_argument('--value-size', help='Bits of v, as the program was generated with',
+                        type=int, choices=sorted(VALUE_CODES), required=False, default=VALUE_SIZE)
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    main()
+    main(get_args().value_size)
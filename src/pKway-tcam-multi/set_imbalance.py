@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Load imbalance of the key -> set mapping on a trace.
+
+For every --set-hash the report gives the spread of the requests and of the
+distinct keys over the MAX_ENTRIES sets (max / mean, coefficient of variation,
+idle sets, sets with more distinct keys than main cache ways) and the
+conflict miss rate: the hit ratio a fully associative cache of the same total
+size (1 set of MAX_ENTRIES * MAIN_CACHE_SIZE ways) reaches on the trace minus
+the hit ratio of the set associative one. A negative rate means keeping hot
+keys apart in their sets helped. Printed as JSON.
+
+    python set_imbalance.py trace.bin --max-entries-size 64 --main-cache-size 4
+    python set_imbalance.py --workload 'uniform' --stride 64 --max-entries-size 64
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from parallel_simulator import set_indexes, simulate
+from simulator import P4GET_VAL_LFU, POLICIES, SET_HASHES
+from trace_file import load_keys
+from workload import generate_keys, parse_spec
+
+
+def spread(counts):
+    """ max / mean and coefficient of variation of per set counts. """
+    mean = counts.mean() if len(counts) else 0.0
+    if not mean:
+        return 0.0, 0.0
+    return float(counts.max() / mean), float(counts.std() / mean)
+
+
+def hit_ratio(keys, max_entries_size, main_cache_size, front_cache_size, key_size, front_type, main_type,
+              set_hash, processes):
+    cache_bits, front_bits = simulate(keys, max_entries_size, main_cache_size, front_cache_size, key_size,
+                                      front_type, main_type, set_hash=set_hash, processes=processes)
+    hits = int(cache_bits.sum()) + int((front_bits & (cache_bits ^ 1)).sum())
+    return float(hits) / len(keys) if len(keys) else 0.0
+
+
+def analyze(keys, geometry, set_hashes, processes=None):
+    """ One result dict per set hash, the most balanced request spread first. """
+    max_entries_size, main_cache_size, front_cache_size, key_size, front_type, main_type = geometry
+    keys = np.asarray(keys)
+    distinct = np.unique(keys)
+    fully_associative = hit_ratio(keys, 1, max_entries_size * main_cache_size, max_entries_size * front_cache_size,
+                                  key_size, front_type, main_type, SET_HASHES[0], processes)
+    results = []
+    for set_hash in set_hashes:
+        requests = np.bincount(set_indexes(keys, max_entries_size, set_hash, key_size), minlength=max_entries_size)
+        occupancy = np.bincount(set_indexes(distinct, max_entries_size, set_hash, key_size), minlength=max_entries_size)
+        request_max_mean, request_cv = spread(requests)
+        key_max_mean, key_cv = spread(occupancy)
+        ratio = hit_ratio(keys, max_entries_size, main_cache_size, front_cache_size, key_size, front_type,
+                          main_type, set_hash, processes)
+        results.append({
+            'set_hash': set_hash,
+            'request_max_mean': request_max_mean,
+            'request_cv': request_cv,
+            'key_max_mean': key_max_mean,
+            'key_cv': key_cv,
+            'idle_sets': int((requests == 0).sum()),
+            'overflowing_sets': int((occupancy > main_cache_size).sum()),
+            'hit_ratio': ratio,
+            'fully_associative_hit_ratio': fully_associative,
+            'conflict_miss_rate': fully_associative - ratio,
+        })
+    results.sort(key=lambda result: result['request_cv'])
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Key to set load imbalance of the set hashes')
+    parser.add_argument('trace', help='Binary trace or text file with one key per line', type=str, nargs='?')
+    parser.add_argument('--workload', help='workload.py spec, when no trace is given', type=str,
+                        required=False, default='uniform')
+    parser.add_argument('--stride', help='Multiply the workload keys by this (strided key spaces)',
+                        type=int, required=False, default=1)
+    parser.add_argument('-n', '--requests', type=int, required=False, default=200000)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    parser.add_argument('--max-entries-size', type=int, required=False, default=2)
+    parser.add_argument('--main-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--front-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--front-type', choices=POLICIES, required=False, default=P4GET_VAL_LFU)
+    parser.add_argument('--main-type', choices=POLICIES, required=False, default=P4GET_VAL_LFU)
+    parser.add_argument('--set-hash', help='Comma separated set hashes', type=str, required=False,
+                        default=','.join(SET_HASHES))
+    parser.add_argument('-j', '--processes', type=int, required=False, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    if args.trace:
+        keys = load_keys(args.trace)
+        source = args.trace
+    else:
+        workload_key_size = args.key_size - (args.stride - 1).bit_length()
+        keys = generate_keys(parse_spec(args.workload, workload_key_size), args.requests, args.seed) * args.stride
+        source = args.workload
+    geometry = (args.max_entries_size, args.main_cache_size, args.front_cache_size, args.key_size,
+                args.front_type, args.main_type)
+    results = analyze(keys, geometry, args.set_hash.split(','), args.processes)
+    json.dump({'source': source, 'requests': len(keys), 'results': results}, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,444 @@
+#!/usr/bin/env python
+"""
+Reference model of the MyIngress pipeline emitted by generate_file.py.
+
+The model follows the generated apply block statement by statement, so the
+per-request cache/front bits match what bmv2 returns for the same sequence of
+keys: the k % MAX_ENTRIES set index, the victim element/key handed along
+the insertion cascade, the r_counter filter in front of the main cache and the
+r_timestamp driven deamortization of r_counter. The FIFO and CLOCK policies
+replace a single way per set, the one under the r_*_hand pointer, instead of
+running the LFU cascade. Count-Min r_counter sketches
+are indexed with zlib's crc32, which is bmv2's HashAlgorithm.crc32, of the key
+times a per row constant as in generate_file.py. The crc16 set hash is bmv2's
+HashAlgorithm.crc16, CRC-16/ARC. A PUT takes the same path as a GET of its
+key, so values are not modelled.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import struct
+import sys
+import time
+import zlib
+
+from trace_file import iter_keys
+
+P4GET_VAL_LFU = 'F'
+P4GET_VAL_FIFO = 'R'
+P4GET_VAL_CLOCK = 'C'
+POLICIES = (P4GET_VAL_LFU, P4GET_VAL_FIFO, P4GET_VAL_CLOCK)
+
+COUNTER_MASK = 0xFFFFFFFF
+LOW_COUNTER_MASK = 0xFFFF
+
+AGING_DOUBLE = 'double'
+AGING_HALVE = 'halve'
+AGING_DECREMENT = 'decrement'
+AGING_RESET = 'reset'
+AGINGS = (AGING_DOUBLE, AGING_HALVE, AGING_DECREMENT, AGING_RESET)
+
+COUNTER_DENSE = 'dense'
+COUNTER_COUNT_MIN = 'count-min'
+COUNTER_CONSERVATIVE = 'conservative'
+COUNTERS = (COUNTER_DENSE, COUNTER_COUNT_MIN, COUNTER_CONSERVATIVE)
+SKETCH_MULTIPLIER = 0x9E3779B1
+
+SET_HASH_IDENTITY = 'identity'
+SET_HASH_XOR_FOLD = 'xor-fold'
+SET_HASH_CRC16 = 'crc16'
+SET_HASH_CRC32 = 'crc32'
+SET_HASHES = (SET_HASH_IDENTITY, SET_HASH_XOR_FOLD, SET_HASH_CRC16, SET_HASH_CRC32)
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _crc16_table()
+
+
+def crc16(data):
+    """ CRC-16/ARC (reflected 0x8005, no xor), bmv2's crc16. """
+    crc = 0
+    for byte in bytearray(data):
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def set_index(k, max_entries_size, set_hash=SET_HASH_IDENTITY, key_size=16):
+    """ The set h of the key_size bit key k, as the generated program computes it. """
+    if set_hash == SET_HASH_IDENTITY:
+        return k % max_entries_size
+    if set_hash == SET_HASH_XOR_FOLD:
+        return (k ^ (k >> 8)) % max_entries_size
+    # The hash() externs take the key field as its whole bytes, big endian
+    data = struct.pack('>I', k)[-(-key_size // 8):]
+    if set_hash == SET_HASH_CRC16:
+        return crc16(data) % max_entries_size
+    return zlib.crc32(data) % max_entries_size
+
+
+def deamortization_schedule(max_entries_size, main_cache_size, key_size, deamortization='unrolled',
+                            deamortization_width=1, aging_period=0, aged=None):
+    """
+    Returns {timestamp: (first index, last index + 1)} of the r_counter entries
+    aged at that timestamp, and the timestamp at which r_timestamp wraps.
+    Mirrors the unrolled and compact deamortization of generate_file.py. aged
+    is the number of entries to age, the first 2 ** (key_size / 2) dense
+    counters by default.
+    """
+    max_rounds_until_deamortization = max_entries_size * main_cache_size
+    if aged is None:
+        aged = int((2 ** (key_size / 2) / max_rounds_until_deamortization)) * max_rounds_until_deamortization
+    size_of_each_deamortization = -(-aged // max_rounds_until_deamortization)
+
+    schedule = {}
+    if deamortization == 'compact':
+        turns = max(1, -(-aged // deamortization_width))
+        for t in range(turns):
+            start = t * deamortization_width
+            schedule[t] = (start, min(start + deamortization_width, aged))
+        return schedule, (aging_period or turns) - 1
+
+    max_turns = (aging_period or 8 * main_cache_size * max_entries_size + 1) - 1
+    spacing = max_turns // max_rounds_until_deamortization
+    for i in range(max_rounds_until_deamortization):
+        schedule[spacing * (i + 1)] = (min(i * size_of_each_deamortization, aged),
+                                       min((i + 1) * size_of_each_deamortization, aged))
+    return schedule, max_turns
+
+
+def age(value, aging, decrement=1, rounds=1):
+    """ A counter after rounds agings with the given policy (double, halve, decrement or reset). """
+    if rounds <= 0:
+        return value
+    if aging == AGING_DOUBLE:
+        return (value << rounds) & COUNTER_MASK if rounds < 32 else 0
+    if aging == AGING_HALVE:
+        return value >> rounds if rounds < 32 else 0
+    if aging == AGING_DECREMENT:
+        return max(0, value - decrement * rounds)
+    return 0
+
+
+def sketch_indexes(k, depth, width):
+    """ The r_counter entries of key k in a depth x width sketch, one per row. """
+    return [r * width + zlib.crc32(struct.pack('>I', k * ((SKETCH_MULTIPLIER * (2 * r + 1)) & 0xFFFFFFFF)
+                                               & 0xFFFFFFFF)) % width
+            for r in range(depth)]
+
+
+class KwayCacheSimulator(object):
+    def __init__(self, max_entries_size, main_cache_size, front_cache_size, key_size,
+                 front_type=P4GET_VAL_LFU, main_type=P4GET_VAL_LFU, deamortization='unrolled',
+                 deamortization_width=1, aging=AGING_DOUBLE, aging_period=0, aging_decrement=1,
+                 counter=COUNTER_DENSE, sketch_depth=3, sketch_width=1024, set_hash=SET_HASH_IDENTITY):
+        if front_type not in POLICIES or main_type not in POLICIES:
+            raise ValueError("front_type and main_type must be one of %s" % ', '.join(POLICIES))
+        if aging not in AGINGS:
+            raise ValueError("aging must be one of %s" % ', '.join(AGINGS))
+        if counter not in COUNTERS:
+            raise ValueError("counter must be one of %s" % ', '.join(COUNTERS))
+        if set_hash not in SET_HASHES:
+            raise ValueError("set_hash must be one of %s" % ', '.join(SET_HASHES))
+
+        self.max_entries_size = max_entries_size
+        self.main_cache_size = main_cache_size
+        self.front_cache_size = front_cache_size
+        self.key_size = key_size
+        self.front_type = front_type
+        self.main_type = main_type
+        self.deamortization = deamortization
+        self.deamortization_width = deamortization_width
+        self.aging = aging
+        self.aging_period = aging_period
+        self.aging_decrement = aging_decrement
+        self.counter = counter
+        self.sketch_depth = sketch_depth
+        self.sketch_width = sketch_width
+        self.set_hash = set_hash
+        self.set_index_cache = {}
+
+        # register<bit<COUNTER_SIZE>>(2 ** key_size - 1) r_counter, or the sketch_depth x sketch_width sketch
+        aged = None
+        if counter == COUNTER_DENSE:
+            self.counter_size = 2 ** key_size - 1
+        else:
+            self.counter_size = aged = sketch_depth * sketch_width
+        self.counters = [0] * self.counter_size
+        self.sketch_index_cache = {}
+        self.timestamp = 0
+        self.schedule, self.max_turns = deamortization_schedule(max_entries_size, main_cache_size, key_size,
+                                                                deamortization, deamortization_width, aging_period,
+                                                                aged)
+
+        # Per set: r_*_keys slots, and the key / counter halves of the r_*_cache elements
+        self.main_keys = [[0] * main_cache_size for _ in range(max_entries_size)]
+        self.main_element_keys = [[0] * main_cache_size for _ in range(max_entries_size)]
+        self.main_element_counters = [[0] * main_cache_size for _ in range(max_entries_size)]
+        self.front_keys = [[0] * front_cache_size for _ in range(max_entries_size)]
+        self.front_element_keys = [[0] * front_cache_size for _ in range(max_entries_size)]
+        self.front_element_counters = [[0] * front_cache_size for _ in range(max_entries_size)]
+        # Per set: r_*_hand and the r_*_referenced bits of FIFO / CLOCK
+        self.main_hands = [0] * max_entries_size
+        self.main_referenced = [[0] * main_cache_size for _ in range(max_entries_size)]
+        self.front_hands = [0] * max_entries_size
+        self.front_referenced = [[0] * front_cache_size for _ in range(max_entries_size)]
+
+    def read_counter(self, key):
+        if self.counter != COUNTER_DENSE:
+            counters = self.counters
+            return min(counters[i] for i in self.sketch_indexes(key))
+        # Out of range register reads return 0 in bmv2
+        if key < self.counter_size:
+            return self.counters[key]
+        return 0
+
+    def sketch_indexes(self, key):
+        indexes = self.sketch_index_cache.get(key)
+        if indexes is None:
+            indexes = self.sketch_index_cache[key] = sketch_indexes(key, self.sketch_depth, self.sketch_width)
+        return indexes
+
+    def tick(self):
+        """ The deamortization process and r_timestamp update at the top of apply. """
+        current_timestamp = self.timestamp
+        if current_timestamp in self.schedule:
+            counters = self.counters
+            start, end = self.schedule[current_timestamp]
+            for i in range(start, end):
+                counters[i] = age(counters[i], self.aging, self.aging_decrement)
+        if current_timestamp == self.max_turns:
+            self.timestamp = 0
+        else:
+            self.timestamp = current_timestamp + 1
+
+    def count(self, k):
+        if self.counter != COUNTER_DENSE:
+            counters = self.counters
+            indexes = self.sketch_indexes(k)
+            smallest = min(counters[i] for i in indexes)
+            for i in indexes:
+                if self.counter == COUNTER_COUNT_MIN or counters[i] == smallest:
+                    counters[i] = (counters[i] + 1) & COUNTER_MASK
+        elif k < self.counter_size:
+            self.counters[k] = (self.counters[k] + 1) & COUNTER_MASK
+
+    def request(self, k):
+        """ Processes a single GET for key k and returns the (cache, front) bits. """
+        self.tick()
+        self.count(k)
+        if self.set_hash == SET_HASH_IDENTITY:
+            return self.lookup(k % self.max_entries_size, k)
+        h = self.set_index_cache.get(k)
+        if h is None:
+            h = self.set_index_cache[k] = set_index(k, self.max_entries_size, self.set_hash, self.key_size)
+        return self.lookup(h, k)
+
+    def lookup(self, h, k):
+        cache = 1 if k in self.main_keys[h] else 0
+        front = 1 if k in self.front_keys[h] else 0
+
+        # The first matching check_*_cache entry gives the way
+        if cache:
+            way = self.main_keys[h].index(k)
+            hit(self.main_element_keys[h], self.main_element_counters[h], k, way)
+            if self.main_type == P4GET_VAL_CLOCK:
+                self.main_referenced[h][way] = 1
+        elif front:
+            way = self.front_keys[h].index(k)
+            hit(self.front_element_keys[h], self.front_element_counters[h], k, way)
+            if self.front_type == P4GET_VAL_CLOCK:
+                self.front_referenced[h][way] = 1
+        else:
+            self.miss(h, k)
+        return cache, front
+
+    def miss(self, h, k):
+        keys = self.front_keys[h]
+        element_keys = self.front_element_keys[h]
+        element_counters = self.front_element_counters[h]
+
+        if self.front_type != P4GET_VAL_LFU:
+            way = advance_hand(self.front_hands, self.front_referenced[h], h, self.front_type == P4GET_VAL_CLOCK)
+            first_way = way
+        else:
+            # insert_to_front_cache_with_lfu_first_element
+            first_way = 0
+        victim_key = element_keys[first_way]
+        victim_counter = element_counters[first_way]
+        if victim_counter > 0:
+            victim_counter -= 1
+        element_keys[first_way] = k
+        element_counters[first_way] = 1
+        victim_register_key = keys[first_way]
+        keys[first_way] = k
+
+        if self.front_type == P4GET_VAL_LFU:
+            victim_key, victim_counter, victim_register_key = cascade(
+                keys, element_keys, element_counters, 1, victim_key, victim_counter, victim_register_key)
+
+        if victim_key == 0:
+            return
+
+        keys = self.main_keys[h]
+        element_keys = self.main_element_keys[h]
+        element_counters = self.main_element_counters[h]
+
+        if self.main_type != P4GET_VAL_LFU:
+            # The victim of the front cache only replaces a main element requested as often or less
+            way = advance_hand(self.main_hands, self.main_referenced[h], h, self.main_type == P4GET_VAL_CLOCK)
+            evicted_key = element_keys[way]
+            if evicted_key == 0 or self.read_counter(evicted_key) <= self.read_counter(victim_key):
+                element_keys[way] = victim_key
+                element_counters[way] = victim_counter
+                keys[way] = victim_register_key
+            return
+
+        victim_key, victim_counter, victim_register_key = cascade(
+            keys, element_keys, element_counters, 0, victim_key, victim_counter, victim_register_key)
+
+        # The r_counter filter: keep the evicted key in way 0 if it was requested more often
+        if victim_key != 0:
+            first_counter = self.read_counter(victim_key)
+            second_counter = self.read_counter(element_keys[0])
+            if second_counter < first_counter:
+                element_keys[0] = victim_key
+                element_counters[0] = victim_counter
+                keys[0] = victim_key
+
+    def run(self, keys):
+        """ Processes an iterable of keys and returns (cache bits, front bits) as bytearrays. """
+        cache_bits = bytearray()
+        front_bits = bytearray()
+        request = self.request
+        for k in keys:
+            cache, front = request(int(k))
+            cache_bits.append(cache)
+            front_bits.append(front)
+        return cache_bits, front_bits
+
+
+def hit(element_keys, element_counters, k, way):
+    # get_element_from_*_cache_with_lfu of the matched way: only the low 16 bits are incremented
+    if element_keys[way] == k:
+        c = element_counters[way]
+        element_counters[way] = (c & ~LOW_COUNTER_MASK) | ((c + 1) & LOW_COUNTER_MASK)
+
+
+def advance_hand(hands, referenced, h, clock):
+    """
+    The way FIFO / CLOCK replaces in set h, moving its hand past it. CLOCK
+    sweeps from the hand to the first unreferenced way, clearing the reference
+    bits on the way, and marks the replaced way referenced.
+    """
+    hand = hands[h]
+    way = hand
+    if clock:
+        ways = len(referenced)
+        for j in range(ways):
+            position = (hand + j) % ways
+            if not referenced[position]:
+                way = position
+                break
+            referenced[position] = 0
+        referenced[way] = 1
+    hands[h] = (way + 1) % len(referenced)
+    return way
+
+
+def cascade(keys, element_keys, element_counters, first_way, victim_key, victim_counter, victim_register_key):
+    """
+    The unrolled MAIN_ACTION_TEMPLATE of LFU: a way whose counter beats the
+    victim keeps its element and is aged, otherwise it swaps with the victim.
+    """
+    for i in range(first_way, len(keys)):
+        c = element_counters[i]
+        if (c & LOW_COUNTER_MASK) > (victim_counter & LOW_COUNTER_MASK):
+            element_counters[i] = c - 1
+        else:
+            next_victim_key = element_keys[i]
+            next_victim_counter = c - 1 if c > 0 else 0
+            element_keys[i] = victim_key
+            element_counters[i] = victim_counter
+            victim_key = next_victim_key
+            victim_counter = next_victim_counter
+
+            next_victim_register_key = keys[i]
+            keys[i] = victim_register_key
+            victim_register_key = next_victim_register_key
+    return victim_key, victim_counter, victim_register_key
+
+
+def summarize(cache_bits, front_bits, elapsed):
+    requests = len(cache_bits)
+    main_hits = sum(cache_bits)
+    front_hits = sum(1 for cache, front in zip(cache_bits, front_bits) if front and not cache)
+    return {
+        'requests': requests,
+        'main_hits': main_hits,
+        'front_hits': front_hits,
+        'hit_ratio': float(main_hits + front_hits) / requests if requests else 0.0,
+        'seconds': elapsed,
+        'requests_per_second': requests / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Simulate the generated K-way cache on a key trace')
+    parser.add_argument('trace', help='Binary trace or text file with one key per line', type=str)
+    parser.add_argument('--max-entries-size', type=int, required=False, default=2)
+    parser.add_argument('--main-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--front-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--front-type', choices=POLICIES, required=False, default=P4GET_VAL_LFU)
+    parser.add_argument('--main-type', choices=POLICIES, required=False, default=P4GET_VAL_LFU)
+    parser.add_argument('--deamortization', choices=['unrolled', 'compact'], required=False, default='unrolled')
+    parser.add_argument('--deamortization-width', type=int, required=False, default=1)
+    parser.add_argument('--aging', choices=AGINGS, required=False, default=AGING_DOUBLE)
+    parser.add_argument('--aging-period', help='Packets between two agings of a counter, 0 for the default',
+                        type=int, required=False, default=0)
+    parser.add_argument('--aging-decrement', type=int, required=False, default=1)
+    parser.add_argument('--counter', choices=COUNTERS, required=False, default=COUNTER_DENSE)
+    parser.add_argument('--sketch-depth', type=int, required=False, default=3)
+    parser.add_argument('--sketch-width', type=int, required=False, default=1024)
+    parser.add_argument('--set-hash', choices=SET_HASHES, required=False, default=SET_HASH_IDENTITY)
+    parser.add_argument('-o', '--output', help='Write "key,cache,front" per request to this file',
+                        type=str, required=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    simulator = KwayCacheSimulator(args.max_entries_size, args.main_cache_size, args.front_cache_size,
+                                   args.key_size, args.front_type, args.main_type, args.deamortization,
+                                   args.deamortization_width, args.aging, args.aging_period, args.aging_decrement,
+                                   args.counter, args.sketch_depth, args.sketch_width, args.set_hash)
+    output = open(args.output, 'w') if args.output else None
+
+    cache_bits = bytearray()
+    front_bits = bytearray()
+    elapsed = 0.0
+    for keys in iter_keys(args.trace):
+        keys = keys.tolist()
+        start = time.time()
+        cache, front = simulator.run(keys)
+        elapsed += time.time() - start
+        cache_bits += cache
+        front_bits += front
+        if output:
+            for k, c, f in zip(keys, cache, front):
+                output.write('{},{},{}\n'.format(k, c, f))
+    if output:
+        output.close()
+
+    json.dump(summarize(cache_bits, front_bits, elapsed), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Accuracy / memory trade-off of the Count-Min r_counter sketches.
+
+For every --counter, --sketch-depth and --sketch-width combination the report
+lists the r_counter bytes next to the dense register's, the Count-Min bounds
+(an estimate exceeds the true count by more than e / width * N with
+probability at most e ** -depth), the overestimation measured on the workload
+without aging, and the hit ratio the simulator reaches with that counter
+compared to the dense one. Printed as JSON.
+
+The deamortization ages every entry of a sketch but only the first
+2 ** (key_size / 2) dense counters, so part of the hit ratio difference is the
+aging reaching more keys, not the estimation error.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from generate_file import counter_entries
+from parallel_simulator import simulate
+from simulator import COUNTER_DENSE, COUNTER_COUNT_MIN, COUNTER_CONSERVATIVE, sketch_indexes
+from workload import generate_keys, parse_spec
+
+DEFAULT_WORKLOAD = 'zipf:alpha=0.99'
+COUNTER_BYTES = 4
+
+
+def sketch_counts(keys, counter, depth, width):
+    """ The sketch of the keys without aging, and its estimate of every distinct key. """
+    distinct = np.unique(keys)
+    indexes = dict((k, sketch_indexes(k, depth, width)) for k in distinct.tolist())
+    sketch = np.zeros(depth * width, dtype=np.int64)
+    if counter == COUNTER_COUNT_MIN:
+        rows = np.array([indexes[k] for k in distinct.tolist()], dtype=np.int64).reshape(-1, depth)
+        counts = np.bincount(np.searchsorted(distinct, keys), minlength=len(distinct))
+        np.add.at(sketch, rows, counts[:, None])
+    else:
+        counters = sketch.tolist()
+        for k in keys.tolist():
+            row = indexes[k]
+            smallest = min(counters[i] for i in row)
+            for i in row:
+                if counters[i] == smallest:
+                    counters[i] += 1
+        sketch = np.array(counters, dtype=np.int64)
+        rows = np.array([indexes[k] for k in distinct.tolist()], dtype=np.int64).reshape(-1, depth)
+    return distinct, sketch[rows].min(axis=1)
+
+
+def hit_ratio(keys, geometry, counter, depth, width, processes):
+    max_entries_size, main_cache_size, front_cache_size, key_size, front_type, main_type = geometry
+    cache_bits, front_bits = simulate(keys, max_entries_size, main_cache_size, front_cache_size, key_size,
+                                      front_type, main_type, counter=counter, sketch_depth=depth,
+                                      sketch_width=width, processes=processes)
+    hits = int(cache_bits.sum()) + int((front_bits & (cache_bits ^ 1)).sum())
+    return float(hits) / len(keys) if len(keys) else 0.0
+
+
+def report(keys, geometry, counters, depths, widths, processes=None):
+    """ One result dict per sketch configuration, smallest first, after the dense baseline. """
+    key_size = geometry[3]
+    exact = np.bincount(keys)
+    dense_bytes = COUNTER_BYTES * counter_entries(key_size)
+    results = [{
+        'counter': COUNTER_DENSE,
+        'counter_bytes': dense_bytes,
+        'hit_ratio': hit_ratio(keys, geometry, COUNTER_DENSE, 0, 0, processes),
+    }]
+    baseline = results[0]['hit_ratio']
+    for depth in depths:
+        for width in widths:
+            for counter in counters:
+                start = time.time()
+                distinct, estimates = sketch_counts(keys, counter, depth, width)
+                error = estimates - exact[distinct]
+                epsilon = math.e / width
+                ratio = hit_ratio(keys, geometry, counter, depth, width, processes)
+                results.append({
+                    'counter': counter,
+                    'sketch_depth': depth,
+                    'sketch_width': width,
+                    'counter_bytes': COUNTER_BYTES * counter_entries(key_size, counter, depth, width),
+                    'memory_ratio': float(COUNTER_BYTES * depth * width) / dense_bytes,
+                    'epsilon': epsilon,
+                    'delta': math.exp(-depth),
+                    'mean_overestimate': float(error.mean()),
+                    'max_overestimate': int(error.max()),
+                    'exact_fraction': float((error == 0).mean()),
+                    'beyond_bound_fraction': float((error > epsilon * len(keys)).mean()),
+                    'hit_ratio': ratio,
+                    'hit_ratio_delta': ratio - baseline,
+                    'seconds': time.time() - start,
+                })
+    results[1:] = sorted(results[1:], key=lambda result: (result['counter_bytes'], result['counter']))
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Accuracy and memory of the r_counter sketches')
+    parser.add_argument('--workload', help='workload.py spec', type=str, required=False, default=DEFAULT_WORKLOAD)
+    parser.add_argument('-n', '--requests', type=int, required=False, default=200000)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    parser.add_argument('--max-entries-size', type=int, required=False, default=2)
+    parser.add_argument('--main-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--front-cache-size', type=int, required=False, default=2)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--front-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--main-type', choices=['F', 'R', 'C'], required=False, default='F')
+    parser.add_argument('--counter', help='Comma separated sketch counters', type=str, required=False,
+                        default=','.join((COUNTER_COUNT_MIN, COUNTER_CONSERVATIVE)))
+    parser.add_argument('--sketch-depth', help='Comma separated depths', type=str, required=False, default='2,3,4')
+    parser.add_argument('--sketch-width', help='Comma separated widths', type=str, required=False,
+                        default='256,1024,4096')
+    parser.add_argument('-j', '--processes', type=int, required=False, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    keys = generate_keys(parse_spec(args.workload, args.key_size), args.requests, args.seed)
+    geometry = (args.max_entries_size, args.main_cache_size, args.front_cache_size, args.key_size,
+                args.front_type, args.main_type)
+    results = report(keys, geometry, args.counter.split(','), [int(d) for d in args.sketch_depth.split(',')],
+                     [int(w) for w in args.sketch_width.split(',')], args.processes)
+    json.dump({'workload': args.workload, 'requests': args.requests, 'results': results}, sys.stdout, indent=2)
+    print()
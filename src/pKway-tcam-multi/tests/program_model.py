@@ -0,0 +1,102 @@
+"""
+Pieces of a program rendered by generate_file.py evaluated in Python, read
+off the program text rather than the templates, so the tests check what
+bmv2 would run. The parsing is cached per program, as the simulator tests
+evaluate the same program for every request.
+"""
+import functools
+import re
+
+
+@functools.lru_cache(maxsize=None)
+def define(program, name):
+    return int(re.search(r'#define %s (\d+)' % name, program).group(1))
+
+
+@functools.lru_cache(maxsize=None)
+def key_slots(program, cache):
+    """ {way: low bit} of the r_<cache>_keys slots insert_key_to_<cache>_keys_register writes. """
+    action = program[program.index('action insert_key_to_%s_keys_register' % cache):]
+    action = action[:action.index('r_%s_keys.write' % cache)]
+    return {int(way): int(low) for way, low in
+            re.findall(r'if \(index == (\d+)\) \{\s*new_victim_key = keys\[\d+:(\d+)\];', action)}
+
+
+def keys_row(program, cache, keys):
+    """ The r_<cache>_keys row holding keys[way] in every way. """
+    slots = key_slots(program, cache)
+    return sum(k << slots[way] for way, k in enumerate(keys))
+
+
+@functools.lru_cache(maxsize=None)
+def tcam_entries(program, cache):
+    """ (value, mask, way) of the check_<cache>_cache entries, in priority order. """
+    return tuple((int(value, 16), int(mask, 16), int(way)) for value, mask, way in
+                 re.findall(r'\d+w0x([0-9A-F]+) &&& \d+w0x([0-9A-F]+): mark_%s_hit\((\d+)\);' % cache, program))
+
+
+def hit_way(program, cache, row, k):
+    """ The way check_<cache>_cache reports for key k against a r_<cache>_keys row, None on a miss. """
+    key_size = define(program, 'KEY_SIZE')
+    ways = define(program, '%s_CACHE_SIZE' % cache.upper())
+    # <cache>_keys_mask = (k ++ ... ++ k) ^ <cache>_keys_bit
+    lookup = sum(k << (key_size * i) for i in range(ways)) ^ row
+    for value, mask, way in tcam_entries(program, cache):
+        if lookup & mask == value & mask:
+            return way
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def element_width(program, cache):
+    """ Bits of a way in r_<cache>_cache, the shift of get_element_from_<cache>_cache_with_lfu. """
+    action = program[program.index('action get_element_from_%s_cache_with_lfu' % cache):]
+    width = re.search(r'bit<32> shift = index \* (.+);', action).group(1)
+    return eval(re.sub(r'[A-Z_]+', lambda name: str(define(program, name.group(0))), width))
+
+
+@functools.lru_cache(maxsize=None)
+def element_slices(program, cache):
+    """ (high, low) of the key guard (None if absent), counter and value of get_element_from_<cache>_cache_with_lfu. """
+    action = program[program.index('action get_element_from_%s_cache_with_lfu' % cache):]
+    action = action[:action.index('r_%s_cache.write' % cache)]
+    guard = re.search(r'if \(element\[(\d+):(\d+)\] == hdr\.p4kway\.k\)', action)
+    counter = re.search(r'element\[(\d+):(0)\] = element\[\d+:0\] \+ 1;', action)
+    value = re.search(r'hdr\.p4kway\.v = element\[(\d+):(\d+)\];', action)
+    return tuple(tuple(map(int, match.groups())) if match else None for match in (guard, counter, value))
+
+
+def bits(element, high, low):
+    return (element >> low) & ((1 << (high - low + 1)) - 1)
+
+
+def get_element(program, cache, row, index, k):
+    """
+    get_element_from_<cache>_cache_with_lfu(h, index) for a GET of key k on a
+    r_<cache>_cache row: the row it writes back and the value it answers with,
+    None when the key guard of the keyed layout leaves the element alone.
+    """
+    guard, counter, value = element_slices(program, cache)
+    width = element_width(program, cache)
+    shift = index * width
+    element = bits(row, shift + width - 1, shift)
+    if guard and bits(element, *guard) != k:
+        return row, None
+    counter_mask = (1 << (counter[0] + 1)) - 1
+    element = (element & ~counter_mask) | ((element + 1) & counter_mask)
+    row = (row & ~(((1 << width) - 1) << shift)) | (element << shift)
+    return row, bits(element, *value)
+
+
+@functools.lru_cache(maxsize=None)
+def reference_shift(program, cache):
+    """ The bit reference_<cache>_way sets for way index, as a function of index. """
+    action = program[program.index('action reference_%s_way' % cache):]
+    action = action[:action.index('r_%s_referenced.write' % cache)]
+    shift = re.search(r'referenced = referenced \| \(\(\(bit<[A-Z_]+>\)1\) << (.+)\);', action).group(1)
+    return eval('lambda index: %s' % shift)
+
+
+def reference_way(program, cache, referenced, index):
+    """ The r_<cache>_referenced bits reference_<cache>_way(h, index) writes back. """
+    return referenced | (1 << reference_shift(program, cache)(index))
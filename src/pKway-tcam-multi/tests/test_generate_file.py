@@ -0,0 +1,106 @@
+import re
+
+import pytest
+
+from generate_file import get_first_mask, get_second_mask, render_program, validate
+from program_cost import analyze
+from program_model import element_width, get_element, hit_way, keys_row
+
+
+def slices(program, name):
+    return [(int(high), int(low)) for high, low in re.findall(r'\b%s\[(\d+):(\d+)\]' % name, program)]
+
+
+@pytest.mark.parametrize('layout', ['keyed', 'compact'])
+@pytest.mark.parametrize('key_size', [8, 24, 32])
+def test_key_width_follows_key_size(key_size, layout):
+    program = render_program(4, 2, 3, key_size, layout=layout, counter='count-min', deamortization='compact')
+    key_slice = '[%d:32]' % (key_size + 31)
+
+    assert '#define KEY_SIZE %d' % key_size in program
+    assert 'current_victim[47:32]' not in program and 'main_evicted[47:32]' not in program
+    assert 'current_victim%s != 0' % key_slice in program
+    assert 'main_keys_bit[%d:0] = current_victim%s;' % (key_size - 1, key_slice) in program
+    assert ('bit<%d> k_pad;' % (32 - key_size) in program) == (key_size < 32)
+    assert 'bit<KEY_SIZE> k;' in program and 'bit<16> k;' not in program
+    assert '(bit<(KEY_SIZE * MAIN_CACHE_SIZE)>)0x%X)' % ((1 << key_size) - 1) in program
+
+    # Every way of a keys row is KEY_SIZE bits, way i at [KEY_SIZE * (i + 1) - 1:KEY_SIZE * i]
+    for name, ways in (('keys', 3), ('main_keys_bit', 2), ('front_keys_bit', 3)):
+        for high, low in slices(program, name):
+            assert high - low + 1 == key_size and low % key_size == 0 and high < key_size * ways
+
+    for way in range(2):
+        assert '%dw0x%s &&& %dw0x%s: mark_main_hit(%d);' % (
+            2 * key_size, get_first_mask(2, way, key_size), 2 * key_size, get_second_mask(2, way, key_size),
+            way) in program
+    if layout == 'compact':
+        assert '(ELEMENT_SIZE - KEY_SIZE)' in program and '(ELEMENT_SIZE - 16)' not in program
+
+
+@pytest.mark.parametrize('key_size', [16, 24])
+def test_cost_tells_the_miss_paths_apart(key_size):
+    paths = analyze(render_program(2, 2, 2, key_size, layout='compact'))['paths']
+    assert paths['miss_main_insert']['reads'] > paths['miss_front_only']['reads']
+
+
+def test_masks():
+    assert get_first_mask(2, 0) == 'FFFF0000' and get_second_mask(2, 0) == '0000FFFF'
+    assert get_first_mask(3, 1) == 'FFFF0000FFFF'
+    assert get_first_mask(2, 1, 6) == '03F' and get_second_mask(2, 1, 6) == 'FC0'
+
+
+@pytest.mark.parametrize('key_size', [8, 16, 24])
+@pytest.mark.parametrize('ways', [2, 3, 4])
+def test_tcam_reports_the_way_holding_the_key(ways, key_size):
+    program = render_program(2, ways, ways, key_size, counter='count-min')
+    keys = [(way * 0x5B + 1) % (1 << key_size) for way in range(ways)]
+    for cache in ('main', 'front'):
+        row = keys_row(program, cache, keys)
+        for way, k in enumerate(keys):
+            assert hit_way(program, cache, row, k) == way
+        assert hit_way(program, cache, row, max(keys) + 1) is None
+        # A set with the key in one way only, the others empty
+        for way, k in enumerate(keys):
+            assert hit_way(program, cache, keys_row(program, cache, [k if i == way else 0 for i in range(ways)]),
+                           k) == way
+
+
+@pytest.mark.parametrize('key_size', [0, 7, 34])
+def test_validate_rejects_key_sizes(key_size):
+    with pytest.raises(ValueError):
+        validate(2, 2, 2, key_size, counter='count-min')
+
+
+@pytest.mark.parametrize('key_size', [26, 32])
+def test_validate_rejects_dense_counters_of_wide_keys(key_size):
+    with pytest.raises(ValueError, match='--counter conservative'):
+        validate(2, 2, 2, key_size)
+    validate(2, 2, 2, key_size, counter='conservative')
+
+
+def test_multi_key_records():
+    program = render_program(2, 2, 2, 16, backend_port=2, keys_per_packet=3)
+    load_record = program[program.index('action load_record()'):program.index('action store_record()')]
+    # A client cannot pass a record off as a backend fill
+    assert 'if (hdr.p4kway.op != P4KWAY_OP_PUT) {\n            hdr.p4kway.op = P4KWAY_OP_GET;' in load_record
+    assert 'meta.recirculate = 0;' in load_record
+    assert 'recirculate(meta);' in program and 'recirculate_preserving_field_list(' not in program
+    assert 'recirculate' not in render_program(2, 2, 2, 16, backend_port=2)
+
+
+@pytest.mark.parametrize('layout', ['compact', 'keyed'])
+def test_hit_updates_and_answers_the_matched_way(layout):
+    program = render_program(2, 2, 2, 16, layout=layout)
+    keys, values, counters = [0x1234, 0x0042], [0xAAAA, 0x5555], [7, 3]
+    for cache in ('main', 'front'):
+        width = element_width(program, cache)
+        # valid ++ value ++ key ++ counter, the compact layout without the key
+        elements = [(1 << 48) | (v << 32) | c if layout == 'compact' else (1 << 64) | (v << 48) | (k << 32) | c
+                    for k, v, c in zip(keys, values, counters)]
+        row = elements[0] | (elements[1] << width)
+        way = hit_way(program, cache, keys_row(program, cache, keys), keys[1])
+        row, value = get_element(program, cache, row, way, keys[1])
+        assert value == values[1]
+        assert row & ((1 << width) - 1) == elements[0]
+        assert row >> width == elements[1] + 1
@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+import multi_loadgen
+from latency import OutcomeHistograms
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason='the fake workers are inherited through fork')
+
+
+def fake_worker(index, workers, target, cpu, options, results):
+    if target == 'exit':
+        os._exit(3)
+    if target == 'kill':
+        os.kill(os.getpid(), signal.SIGKILL)
+    if target == 'error':
+        results.put((index, None, None, 'ValueError: no such interface'))
+        return
+    result = dict((name, index + 1) for name in multi_loadgen.COUNTERS)
+    result.update(send_seconds=1.0, response_pps=10.0, target=target, cpu=cpu)
+    results.put((index, result, OutcomeHistograms(), None))
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    monkeypatch.setattr(multi_loadgen, 'worker', fake_worker)
+    monkeypatch.setattr(multi_loadgen, 'POLL_SECONDS', 0.05)
+
+
+def test_merges_the_workers(workers):
+    results = multi_loadgen.run(['a', 'b', 'c'], {'mode': 'open'}, cpus=[None] * 3)
+    assert results['errors'] == {}
+    assert [result['target'] for result in results['workers']] == ['a', 'b', 'c']
+    assert results['merged']['sent'] == 6 and results['merged']['response_pps'] == 30.0
+
+
+def test_reports_workers_that_die(workers):
+    results = multi_loadgen.run(['a', 'exit', 'kill', 'error'], {'mode': 'open'}, cpus=[None] * 4)
+    assert results['errors'] == {
+        'exit': 'exited with code 3 before reporting a result',
+        'kill': 'killed by signal %d before reporting a result' % signal.SIGKILL,
+        'error': 'ValueError: no such interface',
+    }
+    assert [result['target'] for result in results['workers']] == ['a']
+    assert results['merged']['sent'] == 1
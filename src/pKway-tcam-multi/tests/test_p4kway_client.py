@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from p4kway_client import P4KwayClient, P4KwayResponse, P4KwayTimeout
+
+
+class FakeSwitch(object):
+    """ Stands in for P4KwayClient._request: answers each key after delay seconds. """
+    def __init__(self, delay=0.05, error=None):
+        self.delay = delay
+        self.error = error
+        self.sent = []
+        self.cancelled = []
+
+    async def request(self, k):
+        self.sent.append(k)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(k)
+            raise
+        if self.error is not None:
+            raise self.error
+        return P4KwayResponse(k, k + 1, 1, 0, 1)
+
+
+def client_of(switch):
+    client = P4KwayClient('lo')
+    client.loop = asyncio.get_running_loop()
+    client._request = switch.request
+    return client
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_coalesced_lookups_share_one_request():
+    async def scenario():
+        switch = FakeSwitch()
+        client = client_of(switch)
+        responses = await asyncio.gather(*[client.get(7) for _ in range(3)])
+        assert switch.sent == [7] and client.stats['coalesced'] == 2
+        assert [response.v for response in responses] == [8, 8, 8]
+        assert not client.in_flight and not client.waiters
+    run(scenario())
+
+
+def test_cancelling_the_sender_keeps_the_other_waiters():
+    async def scenario():
+        switch = FakeSwitch()
+        client = client_of(switch)
+        first = asyncio.ensure_future(client.get(7))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(client.get(7))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert (await second).v == 8
+        assert first.cancelled() and switch.sent == [7] and not switch.cancelled
+    run(scenario())
+
+
+def test_request_is_cancelled_once_nobody_waits():
+    async def scenario():
+        switch = FakeSwitch()
+        client = client_of(switch)
+        waiters = [asyncio.ensure_future(client.get(7)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert switch.cancelled == [7] and not client.in_flight and not client.waiters
+        # A later lookup sends a new request
+        assert (await client.get(7)).v == 8 and switch.sent == [7, 7]
+    run(scenario())
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        client = client_of(FakeSwitch(error=P4KwayTimeout('no answer')))
+        results = await asyncio.gather(client.get(7), client.get(7), return_exceptions=True)
+        assert all(isinstance(result, P4KwayTimeout) for result in results)
+        assert not client.in_flight
+    run(scenario())
+
+
+def test_cancelled_request_cancels_the_waiters():
+    async def scenario():
+        client = client_of(FakeSwitch())
+        waiter = asyncio.ensure_future(client.get(7))
+        await asyncio.sleep(0)
+        client.in_flight[7].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+    run(scenario())
@@ -0,0 +1,141 @@
+import struct
+
+import numpy as np
+import pytest
+
+from p4kway_codec import (FRAME_SIZE, HEADERS_SIZE, OP_FETCH, OP_FILL, P4KWAY_ETYPE, P4KWAY_MULTI_ETYPE, P4KWAY_VER,
+                          PADDING, RECORDS_OFFSET, SERVED_OFFSET, SWITCH_MAC, VALUE_CODES, build_frame,
+                          build_multi_frame, decode_frames, frame_format, gather_frames, get_seq, mac_to_bytes,
+                          pack_batch, pack_frame, record_format, set_key, set_seq, set_value, unpack_batch,
+                          unpack_frame, unpack_multi_frame, valid_mask)
+from trace_file import OP_GET, OP_PUT
+
+SRC_MAC = '08:00:00:00:01:01'
+VALUE_SIZES = sorted(VALUE_CODES)
+# front_type, main_type, k, v, cache, front, seq, op, served
+CASES = [('F', 'F', 0, 0, 0, 0, 0, OP_GET, 0), ('R', 'F', 300, 7, 1, 0, 1, OP_GET, 1),
+         ('F', 'R', 0xFFFFFFFF, 0xABCD, 0, 1, 0xFFFFFFFF, OP_PUT, 1), ('R', 'C', 42, 1, 1, 1, 123456789, OP_PUT, 0),
+         ('C', 'C', 0x12345, 9, 0, 0, 5, OP_FETCH, 0)]
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_matches_scapy(case):
+    scapy = pytest.importorskip('scapy.all')
+    from sender import P4kway
+
+    front_type, main_type, k, v, cache, front, seq, op, served = case
+    scapy_frame = bytes(scapy.Ether(dst=SWITCH_MAC, src=SRC_MAC, type=P4KWAY_ETYPE) /
+                        P4kway(front_type=front_type, main_type=main_type, k=k, v=v, cache=cache, front=front,
+                               seq=seq, op=op, served=served) /
+                        PADDING)
+    frame = build_frame(SRC_MAC, front_type, main_type, k, v, cache, front, seq, op=op)
+    frame[SERVED_OFFSET] = served
+    assert bytes(frame) == scapy_frame
+
+    assert unpack_frame(scapy_frame) == (mac_to_bytes(SWITCH_MAC), mac_to_bytes(SRC_MAC), ord(front_type),
+                                         ord(main_type), k, v, cache, front, seq, op, served, 0)
+    dissected = scapy.Ether(bytes(frame))[P4kway]
+    assert (dissected.k, dissected.v, dissected.cache, dissected.front, dissected.seq, dissected.op) == \
+        (k, v, cache, front, seq, op)
+
+
+@pytest.mark.parametrize('value_size', VALUE_SIZES)
+def test_frame_layout(value_size):
+    layout = frame_format(value_size)
+    v = (1 << value_size) - 1
+    frame = build_frame(SRC_MAC, 'F', 'C', 0xDEADBEEF, v, 1, 0, 9, op=OP_PUT, value_size=value_size)
+    assert len(frame) == layout.frame_size == layout.headers_size + len(PADDING)
+    assert layout.frame_dtype.itemsize == layout.headers_size
+    assert bytes(frame[14:19]) == b'P4' + bytes([P4KWAY_VER]) + b'FC'
+    assert struct.unpack_from('!I', frame, 19)[0] == 0xDEADBEEF
+    assert frame[layout.cache_offset] == 1 and frame[layout.op_offset] == OP_PUT
+    assert unpack_frame(frame, value_size=value_size)[4:] == (0xDEADBEEF, v, 1, 0, 9, OP_PUT, 0, 0)
+
+    set_key(frame, 77)
+    set_value(frame, 5, value_size=value_size)
+    set_seq(frame, 10, value_size=value_size)
+    assert get_seq(frame, value_size=value_size) == 10
+    fields = np.frombuffer(bytes(frame[:layout.headers_size]), dtype=layout.frame_dtype)[0]['p4kway']
+    assert (fields['k'], fields['v'], fields['seq'], fields['op']) == (77, 5, 10, OP_PUT)
+
+
+def test_rejects_other_frames():
+    frame = build_frame(SRC_MAC)
+    frame[16] = P4KWAY_VER - 1
+    assert unpack_frame(frame) is None
+    assert unpack_frame(build_multi_frame(SRC_MAC, [(1, OP_GET, 0)])) is None
+    with pytest.raises(ValueError):
+        frame_format(24)
+
+
+@pytest.mark.parametrize('value_size', VALUE_SIZES)
+def test_batches(value_size):
+    layout = frame_format(value_size)
+    keys = [5, 6, 1 << 20]
+    stride = 64
+    requests = bytearray(len(keys) * stride)
+    pack_batch(requests, SRC_MAC, 'F', 'R', keys, first_seq=10, stride=stride, value_size=value_size)
+    for i, k in enumerate(keys):
+        assert bytes(requests[i * stride:i * stride + layout.frame_size]) == \
+            bytes(build_frame(SRC_MAC, 'F', 'R', k, seq=10 + i, value_size=value_size))
+        assert get_seq(requests, i * stride, value_size=value_size) == 10 + i
+    assert [frame[4] for frame in unpack_batch(requests, len(keys), stride, value_size)] == keys
+
+    frames = decode_frames(requests, len(keys), stride, value_size=value_size)
+    assert valid_mask(frames).all()
+    assert frames['p4kway']['k'].tolist() == keys
+    assert frames['p4kway']['seq'].tolist() == [10, 11, 12]
+
+    gathered = gather_frames(np.frombuffer(bytes(requests), dtype=np.uint8), [2 * stride, 0], value_size)
+    assert gathered['p4kway']['k'].tolist() == [keys[2], keys[0]]
+    assert valid_mask(gathered).all()
+
+    with pytest.raises(ValueError):
+        pack_batch(bytearray(stride), SRC_MAC, 'F', 'R', keys, stride=stride, value_size=value_size)
+
+
+def test_default_batch():
+    batch = bytearray(len(CASES) * FRAME_SIZE)
+    for i, (front_type, main_type, k, v, cache, front, seq, op, _) in enumerate(CASES):
+        pack_frame(batch, i * FRAME_SIZE, SRC_MAC, front_type, main_type, k, v, cache, front, seq, op=op)
+    frames = decode_frames(batch)
+    assert frames['p4kway']['k'].tolist() == [case[2] for case in CASES]
+    assert frames['p4kway']['v'].tolist() == [case[3] for case in CASES]
+    assert frames['p4kway']['op'].tolist() == [case[7] for case in CASES]
+    assert decode_frames(batch).dtype.itemsize == HEADERS_SIZE
+    batch[12:14] = b'\x08\x00'
+    assert valid_mask(decode_frames(batch)).tolist() == [False] + [True] * (len(CASES) - 1)
+
+
+@pytest.mark.parametrize('value_size', VALUE_SIZES)
+def test_multi_frames(value_size):
+    v = (1 << value_size) - 1
+    records = [(1, OP_GET, 0), (2, OP_PUT, v), (0xFFFFFFFF, OP_GET, 0)]
+    frame = build_multi_frame(SRC_MAC, records, 'F', 'C', 77, value_size=value_size)
+    record = record_format(value_size)
+    assert record.size == 4 + value_size // 8 + 4
+    assert len(frame) == RECORDS_OFFSET + len(records) * record.size
+    assert struct.unpack_from('!H', frame, 12)[0] == P4KWAY_MULTI_ETYPE
+    assert frame[19] == len(records) and frame[20] == 0
+    assert unpack_multi_frame(frame, value_size=value_size) == (
+        mac_to_bytes(SWITCH_MAC), mac_to_bytes(SRC_MAC), ord('F'), ord('C'), 0, 77,
+        [(1, 0, 0, 0, OP_GET, 0), (2, v, 0, 0, OP_PUT, 0), (0xFFFFFFFF, 0, 0, 0, OP_GET, 0)])
+
+    # The switch answers in place: each record gets its value, outcome and served bit
+    for i in range(len(records)):
+        offset = RECORDS_OFFSET + i * record.size
+        k, _, _, _, op, _ = record.unpack_from(frame, offset)
+        record.pack_into(frame, offset, k, i, 1, 0, op, 1)
+    frame[20] = len(records)
+    answer = unpack_multi_frame(frame, value_size=value_size)
+    assert answer[4] == len(records)
+    assert [r[1:4] + r[5:] for r in answer[6]] == [(i, 1, 0, 1) for i in range(len(records))]
+
+
+def test_rejects_other_multi_frames():
+    frame = build_multi_frame(SRC_MAC, [(1, OP_GET, 0), (2, OP_FILL, 0)])
+    assert unpack_multi_frame(frame[:-1]) is None
+    assert unpack_multi_frame(frame[:RECORDS_OFFSET - 1]) is None
+    assert unpack_multi_frame(build_frame(SRC_MAC)) is None
+    frame[16] = P4KWAY_VER - 1
+    assert unpack_multi_frame(frame) is None
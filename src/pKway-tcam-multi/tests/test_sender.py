@@ -0,0 +1,35 @@
+import pytest
+
+scapy = pytest.importorskip('scapy.all')
+
+from p4kway_codec import PADDING, SWITCH_MAC, VALUE_CODES, build_frame  # noqa: E402
+from sender import P4kway, p4kway_layer, parse_request  # noqa: E402
+
+
+@pytest.mark.parametrize('line,expected', [('5', (0, 5, 0)), (' 0x10 ', (0, 16, 0)), ('put 5 7', (1, 5, 7)),
+                                          ('put 5 0xFFFF', (1, 5, 0xFFFF))])
+def test_parse_request(line, expected):
+    assert parse_request(line) == expected
+
+
+@pytest.mark.parametrize('line', ['', 'put', 'put 5', 'put 5 x', 'put 5 7 8', 'x', '5 6', 'put 5 0x10000', '-1',
+                                  str(1 << 32)])
+def test_parse_request_rejects(line):
+    with pytest.raises(ValueError):
+        parse_request(line)
+
+
+@pytest.mark.parametrize('value_size', sorted(VALUE_CODES))
+def test_value_field_follows_value_size(value_size):
+    v = (1 << value_size) - 1
+    assert parse_request('put 3 %d' % v, value_size) == (1, 3, v)
+    with pytest.raises(ValueError):
+        parse_request('put 3 %d' % (v + 1), value_size)
+    layer = p4kway_layer(value_size)
+    try:
+        frame = bytes(scapy.Ether(dst=SWITCH_MAC, src='08:00:00:00:01:01', type=0x1234) /
+                      layer(front_type='F', main_type='C', k=3, v=v, seq=2, op=1) / PADDING)
+        assert frame == bytes(build_frame('08:00:00:00:01:01', 'F', 'C', 3, v, 0, 0, 2, op=1, value_size=value_size))
+        assert scapy.Ether(frame)[layer].v == v
+    finally:
+        assert p4kway_layer() is P4kway
@@ -0,0 +1,123 @@
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from generate_file import min_aging_period, render_program, validate
+from parallel_simulator import simulate
+from simulator import (AGINGS, COUNTER_COUNT_MIN, COUNTER_CONSERVATIVE, COUNTER_DENSE, P4GET_VAL_CLOCK, POLICIES,
+                       SET_HASHES, KwayCacheSimulator)
+from program_model import element_width, get_element, hit_way, keys_row, reference_way
+from workload import generate_keys, parse_spec
+
+REQUESTS = 4000
+
+
+def random_config(rng, counter):
+    """ A random valid geometry, deamortization and aging for counter. """
+    while True:
+        config = dict(max_entries_size=rng.randint(1, 6), main_cache_size=rng.randint(1, 4),
+                      front_cache_size=rng.randint(1, 4), key_size=rng.choice([8, 10, 12, 16]),
+                      deamortization=rng.choice(['unrolled', 'compact']), deamortization_width=rng.randint(1, 3),
+                      aging=rng.choice(AGINGS), aging_decrement=rng.randint(1, 3), sketch_depth=rng.randint(1, 3),
+                      sketch_width=rng.choice([16, 64, 256]),
+                      counter=counter if counter == COUNTER_DENSE else rng.choice([COUNTER_COUNT_MIN,
+                                                                                   COUNTER_CONSERVATIVE]))
+        try:
+            shortest = min_aging_period(config['max_entries_size'], config['main_cache_size'], config['key_size'],
+                                        config['deamortization'], config['deamortization_width'],
+                                        config['counter'], config['sketch_depth'], config['sketch_width'])
+            config['aging_period'] = rng.choice([0, shortest, 2 * shortest + rng.randint(0, 50)])
+            validate(**config)
+        except ValueError:
+            continue
+        return config
+
+
+def random_keys(rng, key_size):
+    # A few hot keys over the whole key space, so sets fill up, age and evict
+    spec = rng.choice(['zipf:alpha=1.1', 'zipf:alpha=0.8+uniform@0.3', 'scan:stride=3@0.2+zipf:alpha=1.2'])
+    keys = generate_keys(parse_spec(spec, key_size), REQUESTS, seed=rng.randint(0, 1 << 30))
+    return keys % rng.choice([50, 200, (1 << key_size) - 1]) + 1
+
+
+@pytest.mark.parametrize('counter', [COUNTER_DENSE, COUNTER_COUNT_MIN])
+@pytest.mark.parametrize('set_hash', SET_HASHES)
+@pytest.mark.parametrize('front_type,main_type', list(itertools.product(POLICIES, POLICIES)))
+def test_parallel_matches_sequential(front_type, main_type, set_hash, counter):
+    rng = random.Random('%s%s%s%s' % (front_type, main_type, set_hash, counter))
+    config = random_config(rng, counter)
+    keys = random_keys(rng, config['key_size'])
+    geometry = (config.pop('max_entries_size'), config.pop('main_cache_size'), config.pop('front_cache_size'),
+                config.pop('key_size'), front_type, main_type)
+
+    reference = KwayCacheSimulator(*geometry, set_hash=set_hash, **config)
+    cache, front = reference.run(keys.tolist())
+    for processes in (1, 2):
+        parallel_cache, parallel_front = simulate(keys, *geometry, set_hash=set_hash, processes=processes,
+                                                  jobs_per_process=2, chunk_size=1000, **config)
+        assert parallel_cache.tolist() == list(cache), (geometry, config)
+        assert parallel_front.tolist() == list(front), (geometry, config)
+    # A non trivial trace: some hits and some misses
+    assert 0 < sum(cache) + sum(front) < REQUESTS
+
+
+def test_sequential_runs_resume():
+    keys = np.arange(3000) * 7 % 120 + 1
+    whole = KwayCacheSimulator(3, 2, 2, 10, 'C', 'R').run(keys.tolist())
+    chunked = KwayCacheSimulator(3, 2, 2, 10, 'C', 'R')
+    parts = [chunked.run(keys[i:i + 700].tolist()) for i in range(0, len(keys), 700)]
+    assert whole == tuple(bytearray().join(part[j] for part in parts) for j in range(2))
+
+
+def program_ways(program, simulator, h, k):
+    """ The ways the TCAM entries of program report for k against the simulated keys rows of set h. """
+    return tuple(hit_way(program, cache, keys_row(program, cache, getattr(simulator, cache + '_keys')[h]), k)
+                 for cache in ('main', 'front'))
+
+
+@pytest.mark.parametrize('ways', [2, 3, 4])
+def test_hits_update_the_way_the_program_reports(ways):
+    program = render_program(4, ways, ways, 16)
+    simulator = KwayCacheSimulator(4, ways, ways, 16)
+    keys = generate_keys(parse_spec('zipf:alpha=1.2', 16), REQUESTS, seed=ways) % 40 + 1
+    hits = 0
+    for k in keys.tolist():
+        h = k % 4
+        main_way, front_way = program_ways(program, simulator, h, k)
+        cache = 'main' if main_way is not None else 'front'
+        width = element_width(program, cache)
+        element_keys = getattr(simulator, cache + '_element_keys')[h]
+        element_counters = getattr(simulator, cache + '_element_counters')[h]
+        row = sum(((key << 32) | counter) << (width * way)
+                  for way, (key, counter) in enumerate(zip(element_keys, element_counters)))
+
+        assert simulator.request(k) == (int(main_way is not None), int(front_way is not None))
+        if main_way is not None or front_way is not None:
+            # get_element_from_*_cache_with_lfu on the way the TCAM reported
+            row, _ = get_element(program, cache, row, main_way if cache == 'main' else front_way, k)
+            assert element_counters == [(row >> (width * way)) & 0xFFFFFFFF for way in range(ways)]
+            hits += 1
+    assert 0 < hits < REQUESTS
+
+
+@pytest.mark.parametrize('ways', [2, 3, 4])
+def test_clock_references_the_way_the_program_hits(ways):
+    program = render_program(4, ways, ways, 16)
+    simulator = KwayCacheSimulator(4, ways, ways, 16, P4GET_VAL_CLOCK, P4GET_VAL_CLOCK)
+    keys = generate_keys(parse_spec('zipf:alpha=1.2', 16), REQUESTS, seed=ways) % 40 + 1
+    hits = 0
+    for k in keys.tolist():
+        h = k % 4
+        main_way, front_way = program_ways(program, simulator, h, k)
+        cache, way = ('main', main_way) if main_way is not None else ('front', front_way)
+        referenced = getattr(simulator, cache + '_referenced')[h]
+        bits = sum(bit << i for i, bit in enumerate(referenced))
+
+        assert simulator.request(k) == (int(main_way is not None), int(front_way is not None))
+        if way is not None:
+            bits = reference_way(program, cache, bits, way)
+            assert referenced == [(bits >> i) & 1 for i in range(ways)]
+            hits += 1
+    assert 0 < hits < REQUESTS
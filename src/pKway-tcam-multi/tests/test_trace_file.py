@@ -0,0 +1,34 @@
+import numpy as np
+
+from parallel_simulator import simulate
+from trace_file import TraceWriter, iter_keys, load_keys
+
+
+def write_trace(path, keys, key_size=16):
+    with TraceWriter(str(path), key_size, ops=True) as writer:
+        writer.write(keys)
+    return str(path)
+
+
+def test_load_keys_maps_binary_traces(tmp_path):
+    keys = np.arange(1, 1001) % 97
+    path = write_trace(tmp_path / 'trace.p4kt', keys)
+    loaded = load_keys(path)
+    assert isinstance(loaded.base, np.memmap)
+    assert loaded.tolist() == keys.tolist()
+    assert np.concatenate(list(iter_keys(path, chunk_size=300))).tolist() == keys.tolist()
+
+
+def test_load_keys_parses_text_traces(tmp_path):
+    path = tmp_path / 'trace.txt'
+    path.write_text('# key\n3\n0x10\n\n7\n')
+    assert load_keys(str(path)).tolist() == [3, 16, 7]
+
+
+def test_simulate_mapped_keys(tmp_path):
+    keys = (np.arange(5000) * 7919) % 300
+    mapped = load_keys(write_trace(tmp_path / 'trace.p4kt', keys))
+    for counter in ('dense', 'count-min'):
+        expected = simulate(keys.astype(np.int64), 4, 2, 2, 16, counter=counter, processes=1)
+        cache, front = simulate(mapped, 4, 2, 2, 16, counter=counter, processes=2, chunk_size=1000)
+        assert cache.tolist() == expected[0].tolist() and front.tolist() == expected[1].tolist()
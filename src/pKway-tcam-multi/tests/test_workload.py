@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from workload import Hotspot, Zipf, generate_keys, parse_spec
+
+
+@pytest.mark.parametrize('key_size,alpha', [(8, 0.99), (12, 0.5), (16, 1.2)])
+def test_zipf_matches_pmf(key_size, alpha):
+    zipf = Zipf(key_size, alpha, scramble=False)
+    n = 400000
+    ranks = generate_keys(zipf, n, seed=1) - 1
+    assert ranks.min() >= 0 and ranks.max() < zipf.keys
+    pmf = np.arange(1, zipf.keys + 1, dtype=np.float64) ** -alpha
+    pmf /= pmf.sum()
+    counts = np.bincount(ranks, minlength=zipf.keys)
+    # The head rank by rank, the tail in a few wide bins
+    head = 32
+    for rank in range(head):
+        assert abs(counts[rank] - n * pmf[rank]) < 5 * np.sqrt(n * pmf[rank]) + 2, rank
+    for bins in np.array_split(np.arange(head, zipf.keys), 8):
+        expected = n * pmf[bins].sum()
+        assert abs(counts[bins].sum() - expected) < 5 * np.sqrt(expected) + 2
+
+
+def test_zipf_odd_sample_lengths():
+    workload = parse_spec('zipf:alpha=0.9@0.7+uniform@0.3', 16)
+    keys = generate_keys(workload, 10001, seed=3, chunk_size=333)
+    assert len(keys) == 10001
+    assert keys.min() >= 1 and keys.max() < 1 << 16
+    assert keys.tolist() == generate_keys(workload, 10001, seed=3, chunk_size=333).tolist()
+
+
+def test_mixtures_keep_the_positions_of_timed_components():
+    keys = generate_keys(parse_spec('scan@0.5+uniform@0.5', 16), 20000, seed=4, chunk_size=3000)
+    # The scan's keys are its positions, whichever requests it got
+    assert abs((keys == np.arange(1, 20001) % 65535).mean() - 0.5) < 0.02
+
+
+@pytest.mark.parametrize('key_size', [16, 32])
+def test_hotspot_windows(key_size):
+    hotspot = Hotspot(key_size, hot_fraction=0.01, hot_probability=0.9, period=1000, scramble=False)
+    # Epochs whose window_start overflowed int64
+    positions = np.arange(10 ** 15, 10 ** 15 + 20000, dtype=np.int64)
+    ranks = hotspot.sample(np.random.default_rng(5), positions) - 1
+    assert ranks.min() >= 0 and ranks.max() < hotspot.keys
+    epochs = positions // hotspot.period
+    starts = np.array([hotspot.window_start(int(epoch)) for epoch in epochs], dtype=np.int64)
+    assert all(0 <= start < hotspot.keys for start in starts)
+    in_window = (ranks - starts) % hotspot.keys < hotspot.hot_keys
+    expected = 0.9 + 0.1 * hotspot.hot_keys / hotspot.keys
+    assert abs(in_window.mean() - expected) < 0.01
+    # Every epoch has its own window
+    assert len(set(starts.tolist())) == 20
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""
+Fixed width binary request traces.
+
+A trace file is a 16 byte header followed by packed little endian records:
+
+    header:  magic 'P4KT' | version u8 | key_size u8 | flags u8 | reserved u8 | records u64
+    record:  key (u16 / u32 / u64 by key_size) [| op u8] [| timestamp u64 ns]
+             [| cache u8 | front u8 | response_timestamp u64 ns]
+
+The optional columns are only present when the matching flag is set. The
+response columns hold the switch's answer to the request, cache and front
+are NO_RESPONSE when it never came back.
+Readers map the records with numpy.memmap and hand them out in chunks, so a
+trace never has to fit in memory.
+"""
+from __future__ import print_function
+
+import argparse
+import csv
+import os
+import struct
+import sys
+
+import numpy as np
+
+TRACE_MAGIC = b'P4KT'
+TRACE_VERSION = 1
+HEADER_FORMAT = '<4sBBBBQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+FLAG_OP = 0x01
+FLAG_TIMESTAMP = 0x02
+FLAG_RESPONSE = 0x04
+
+NO_RESPONSE = 0xFF
+
+OP_GET = 0
+OP_PUT = 1
+OP_NAMES = {'GET': OP_GET, 'G': OP_GET, 'PUT': OP_PUT, 'P': OP_PUT}
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def key_dtype(key_size):
+    if key_size <= 16:
+        return np.dtype('<u2')
+    if key_size <= 32:
+        return np.dtype('<u4')
+    return np.dtype('<u8')
+
+
+def record_dtype(key_size, flags):
+    fields = [('key', key_dtype(key_size))]
+    if flags & FLAG_OP:
+        fields.append(('op', 'u1'))
+    if flags & FLAG_TIMESTAMP:
+        fields.append(('timestamp', '<u8'))
+    if flags & FLAG_RESPONSE:
+        fields.extend([('cache', 'u1'), ('front', 'u1'), ('response_timestamp', '<u8')])
+    return np.dtype(fields)
+
+
+def is_trace(path):
+    with open(path, 'rb') as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+class TraceWriter(object):
+    """ Appends chunks of records to a new trace file. """
+    def __init__(self, path, key_size, ops=False, timestamps=False, responses=False):
+        self.key_size = key_size
+        self.flags = ((FLAG_OP if ops else 0) | (FLAG_TIMESTAMP if timestamps else 0) |
+                      (FLAG_RESPONSE if responses else 0))
+        self.dtype = record_dtype(key_size, self.flags)
+        self.records = 0
+        self.f = open(path, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        self.f.seek(0)
+        self.f.write(struct.pack(HEADER_FORMAT, TRACE_MAGIC, TRACE_VERSION, self.key_size,
+                                 self.flags, 0, self.records))
+
+    def write(self, keys, **columns):
+        """ Appends len(keys) records, the other columns of the trace are passed by name. """
+        keys = np.asarray(keys)
+        if len(keys) and int(keys.max()) >> self.key_size:
+            raise ValueError("key does not fit in %d bits" % self.key_size)
+
+        chunk = np.empty(len(keys), dtype=self.dtype)
+        chunk['key'] = keys
+        for name in self.dtype.names[1:]:
+            if columns.get(name) is not None:
+                chunk[name] = columns[name]
+            elif name == 'op':
+                chunk[name] = OP_GET
+            else:
+                raise ValueError("missing the %s column" % name)
+
+        self.f.seek(0, os.SEEK_END)
+        self.f.write(chunk.tobytes())
+        self.records += len(chunk)
+
+    def close(self):
+        if self.f is not None:
+            self._write_header()
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TraceReader(object):
+    """ Memory maps the records of a trace file. """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError("%s: truncated trace header" % path)
+        magic, version, self.key_size, self.flags, _, self.records = struct.unpack(HEADER_FORMAT, header)
+        if magic != TRACE_MAGIC:
+            raise ValueError("%s is not a P4kway trace" % path)
+        if version != TRACE_VERSION:
+            raise ValueError("%s: unsupported trace version %d" % (path, version))
+
+        self.path = path
+        self.dtype = record_dtype(self.key_size, self.flags)
+        available = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+        if available < self.records:
+            raise ValueError("%s: header announces %d records, file holds %d" % (path, self.records, available))
+
+        if self.records:
+            self.data = np.memmap(path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(self.records,))
+        else:
+            self.data = np.empty(0, dtype=self.dtype)
+
+    @property
+    def has_ops(self):
+        return bool(self.flags & FLAG_OP)
+
+    @property
+    def has_timestamps(self):
+        return bool(self.flags & FLAG_TIMESTAMP)
+
+    @property
+    def has_responses(self):
+        return bool(self.flags & FLAG_RESPONSE)
+
+    def __len__(self):
+        return self.records
+
+    def chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Yields consecutive record arrays (views of the mapping) of at most chunk_size records. """
+        for start in range(0, self.records, chunk_size):
+            yield self.data[start:start + chunk_size]
+
+    def key_chunks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        for chunk in self.chunks(chunk_size):
+            yield chunk['key']
+
+
+def iter_text_records(path, key_column=0, op_column=None, timestamp_column=None):
+    """
+    Yields (key, op, timestamp) from a CSV or whitespace separated text file.
+    Blank lines, '#' comments and a header row with a non numeric key are skipped.
+    """
+    with open(path) as f:
+        sample = f.readline()
+        f.seek(0)
+        delimiter = ',' if ',' in sample else None
+        rows = csv.reader(f) if delimiter else (line.split() for line in f)
+        for row in rows:
+            if not row or row[0].startswith('#'):
+                continue
+            try:
+                key = int(row[key_column], 0)
+            except ValueError:
+                continue
+            op = OP_GET
+            if op_column is not None:
+                op = OP_NAMES.get(row[op_column].strip().upper(), None)
+                if op is None:
+                    op = int(row[op_column], 0)
+            timestamp = int(row[timestamp_column], 0) if timestamp_column is not None else 0
+            yield key, op, timestamp
+
+
+def convert_text(src, dst, key_size, key_column=0, op_column=None, timestamp_column=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Converts a text/CSV trace to the binary format. Returns the number of records. """
+    with TraceWriter(dst, key_size, ops=op_column is not None, timestamps=timestamp_column is not None) as writer:
+        batch = []
+        for record in iter_text_records(src, key_column, op_column, timestamp_column):
+            batch.append(record)
+            if len(batch) == chunk_size:
+                _write_batch(writer, batch)
+                batch = []
+        if batch:
+            _write_batch(writer, batch)
+        return writer.records
+
+
+def _write_batch(writer, batch):
+    columns = np.array(batch, dtype=np.uint64).T
+    writer.write(columns[0], op=columns[1], timestamp=columns[2])
+
+
+def iter_keys(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yields key arrays from a binary trace or, failing that, a text/CSV file. """
+    if is_trace(path):
+        for keys in TraceReader(path).key_chunks(chunk_size):
+            yield keys
+        return
+
+    batch = []
+    for key, _, _ in iter_text_records(path):
+        batch.append(key)
+        if len(batch) == chunk_size:
+            yield np.array(batch, dtype=np.int64)
+            batch = []
+    if batch:
+        yield np.array(batch, dtype=np.int64)
+
+
+def load_keys(path):
+    """
+    All keys of a trace as one array. Those of a binary trace are its memory
+    mapped key column, paged in as they are used; a text trace is parsed
+    whole into memory, so convert large ones to the binary format first.
+    """
+    if is_trace(path):
+        return TraceReader(path).data['key']
+    chunks = list(iter_keys(path))
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate([np.asarray(chunk, dtype=np.int64) for chunk in chunks])
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Convert text/CSV key traces to the binary trace format')
+    parser.add_argument('src', help='Text or CSV trace', type=str)
+    parser.add_argument('dst', help='Binary trace to write', type=str)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--key-column', type=int, required=False, default=0)
+    parser.add_argument('--op-column', type=int, required=False, default=None)
+    parser.add_argument('--timestamp-column', type=int, required=False, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    records = convert_text(args.src, args.dst, args.key_size, args.key_column, args.op_column,
+                           args.timestamp_column)
+    print('Wrote {} records to {}'.format(records, args.dst), file=sys.stderr)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Synthetic key streams over the 2 ** key_size key space of a cache configuration.
+
+Every workload draws from 1 .. 2 ** key_size - 1: key 0 is what an empty slot
+holds in r_main_keys / r_front_keys, so requesting it would report spurious
+hits. Popularity ranks are spread over the key space with an affine
+permutation, otherwise the hottest keys would all be small numbers that crowd
+the first sets.
+
+Workloads sample keys for given request indexes, so time dependent ones
+(scan, hotspot) continue seamlessly across chunks and mixtures, and
+generate() is reproducible for a given seed and chunk size. On one core it
+yields about 70M keys/s of a Zipf or hotspot workload, and about 30M keys/s of
+a mixture, which groups its requests by component first.
+"""
+from __future__ import print_function
+
+import argparse
+import math
+import sys
+
+import numpy as np
+
+from trace_file import TraceWriter
+
+# Chunks small enough for the temporaries to stay in cache
+DEFAULT_CHUNK_SIZE = 1 << 14
+# Resolution of the inverse CDF tables, small enough for them to stay in L2, and
+# the largest key space they are built for
+CDF_TABLE_BITS = 16
+MAX_EXACT_RANKS = 1 << 22
+PERMUTATION_MULTIPLIER = 0x9E3779B1
+
+
+class Workload(object):
+    # Whether sample() looks at the positions, not just at how many there are
+    timed = False
+
+    def __init__(self, key_size, scramble=True):
+        self.key_size = key_size
+        self.keys = 2 ** key_size - 1
+        self.scramble = scramble
+        multiplier = PERMUTATION_MULTIPLIER % self.keys or 1
+        while math.gcd(multiplier, self.keys) != 1:
+            multiplier += 1
+        self.multiplier = multiplier
+
+    def to_keys(self, ranks):
+        """ Maps popularity ranks 0 .. keys - 1 to distinct keys 1 .. keys. """
+        if not self.scramble:
+            return np.asarray(ranks, dtype=np.int64) + 1
+        # keys is 2 ** key_size - 1, so the remainder of the product folds its
+        # high bits onto the low ones, twice to get below keys
+        dtype = np.int64 if 2 * self.key_size < 63 else np.uint64
+        keys = np.asarray(ranks, dtype=dtype) * self.multiplier
+        for _ in range(2):
+            high = keys >> self.key_size
+            keys &= self.keys
+            keys += high
+        keys += 1
+        return keys.astype(np.int64, copy=False)
+
+    def sample(self, rng, positions):
+        """ Keys for the requests at the given stream indexes. """
+        raise NotImplementedError
+
+
+class Uniform(Workload):
+    def sample(self, rng, positions):
+        return rng.integers(1, self.keys + 1, size=len(positions), dtype=np.int64)
+
+
+class Zipf(Workload):
+    """
+    P(rank r) ~ 1 / r ** alpha over every key, any alpha >= 0. Sampled by
+    inversion of uint32 draws, two per raw 64 bit draw: the top CDF_TABLE_BITS
+    pick a cell of the CDF, the remaining bits a rank uniformly inside cells
+    that span several. Key spaces larger than MAX_EXACT_RANKS use the
+    continuous bounded power law instead.
+    """
+    def __init__(self, key_size, alpha=0.99, scramble=True):
+        Workload.__init__(self, key_size, scramble)
+        self.alpha = alpha
+        self.first = None
+        self.spans = None
+        if self.keys <= MAX_EXACT_RANKS:
+            cdf = np.cumsum(np.arange(1, self.keys + 1, dtype=np.float64) ** -alpha)
+            cdf /= cdf[-1]
+            edges = np.arange((1 << CDF_TABLE_BITS) + 1, dtype=np.float64) / (1 << CDF_TABLE_BITS)
+            first = np.searchsorted(cdf, edges[:-1], side='right')
+            last = np.minimum(np.searchsorted(cdf, edges[1:], side='left'), self.keys - 1)
+            self.first = first.astype(np.int64)
+            self.spans = (last - first + 1).astype(np.int64)
+
+    def sample(self, rng, positions):
+        n = len(positions)
+        if self.first is None:
+            return self.to_keys(self._continuous(rng.random(n)))
+        fraction_bits = 32 - CDF_TABLE_BITS
+        draws = rng.bit_generator.random_raw((n + 1) // 2).view(np.uint32)[:n].astype(np.int64)
+        cells = draws >> fraction_bits
+        ranks = np.take(self.spans, cells)
+        ranks *= draws & ((1 << fraction_bits) - 1)
+        ranks >>= fraction_bits
+        ranks += np.take(self.first, cells)
+        return self.to_keys(ranks)
+
+    def _continuous(self, u):
+        if abs(self.alpha - 1.0) < 1e-9:
+            x = np.exp(u * math.log(self.keys + 1))
+        else:
+            e = 1.0 - self.alpha
+            x = ((float(self.keys + 1) ** e - 1.0) * u + 1.0) ** (1.0 / e)
+        return np.minimum(x.astype(np.int64) - 1, self.keys - 1)
+
+
+class Scan(Workload):
+    """ Sequential scan over length keys from first, stride apart, wrapping around. """
+    timed = True
+
+    def __init__(self, key_size, first=1, stride=1, length=None, scramble=False):
+        Workload.__init__(self, key_size, scramble)
+        self.first = first
+        self.stride = stride
+        self.length = length or self.keys
+
+    def sample(self, rng, positions):
+        steps = positions % self.length
+        return self.to_keys((self.first - 1 + steps * self.stride) % self.keys)
+
+
+class Hotspot(Workload):
+    """
+    hot_probability of the requests go uniformly to a window of hot_fraction
+    of the key space, the rest uniformly anywhere. The window moves to a new
+    place every period requests. Sampled by inversion of one uniform draw per
+    request over ranks counted from the window start: the window and the rest
+    of the key space are each uniform, so the inverse CDF is the larger of two
+    lines.
+    """
+    timed = True
+
+    def __init__(self, key_size, hot_fraction=0.01, hot_probability=0.9, period=1000000, scramble=True):
+        Workload.__init__(self, key_size, scramble)
+        self.hot_keys = max(1, int(self.keys * hot_fraction))
+        self.hot_probability = hot_probability
+        self.period = period
+        # Probability of a rank in the window, requested hot or not
+        window = hot_probability + (1.0 - hot_probability) * self.hot_keys / self.keys
+        self.hot_slope = self.hot_keys / window
+        self.cold_slope = 0.0
+        self.cold_offset = 0.0
+        if window < 1.0:
+            self.cold_slope = (self.keys - self.hot_keys) / (1.0 - window)
+            self.cold_offset = self.hot_keys - window * self.cold_slope
+
+    def window_start(self, epoch):
+        """ Rank the window starts at in an epoch, in Python integers so that no key size overflows. """
+        return (epoch % self.keys) * self.multiplier % self.keys * self.hot_keys % self.keys
+
+    def sample(self, rng, positions):
+        n = len(positions)
+        if not n:
+            return np.empty(0, dtype=np.int64)
+        ranks = rng.random(n)
+        cold = ranks * self.cold_slope
+        cold += self.cold_offset
+        ranks *= self.hot_slope
+        np.maximum(ranks, cold, out=ranks)
+        # Positions increase, so a chunk spans the epochs from its first position to its last
+        first = int(positions[0]) // self.period
+        last = int(positions[-1]) // self.period
+        if first == last:
+            ranks += self.window_start(first)
+        else:
+            starts = np.array([self.window_start(epoch) for epoch in range(first, last + 1)], dtype=np.float64)
+            ranks += np.take(starts, positions // self.period - first)
+        np.subtract(ranks, self.keys, out=ranks, where=ranks >= self.keys)
+        return self.to_keys(ranks.astype(np.int64))
+
+
+class Bursty(Workload):
+    """
+    Requests of an underlying workload repeated in bursts: each request starts
+    a burst with burst_probability, and a burst repeats the key a geometric
+    number of times with mean burst_length.
+    """
+    def __init__(self, base, burst_probability=0.05, burst_length=8.0):
+        Workload.__init__(self, base.key_size, base.scramble)
+        self.base = base
+        self.timed = base.timed
+        self.burst_probability = burst_probability
+        self.burst_length = burst_length
+
+    def sample(self, rng, positions):
+        n = len(positions)
+        keys = self.base.sample(rng, positions)
+        repeats = np.ones(n, dtype=np.int64)
+        bursts = rng.random(n) < self.burst_probability
+        repeats[bursts] = rng.geometric(1.0 / self.burst_length, size=int(bursts.sum()))
+        return np.repeat(keys, repeats)[:n]
+
+
+class Mixture(Workload):
+    """
+    Each request comes from one of the components, picked with the given
+    weights. The requests are grouped by component with a stable sort, each
+    component samples its group at once and a single scatter puts the keys
+    back in request order. Components that are not timed only get as many
+    positions as they draw keys for.
+    """
+    def __init__(self, components, weights=None):
+        Workload.__init__(self, components[0].key_size, components[0].scramble)
+        if len(components) > 255:
+            raise ValueError("a mixture has at most 255 components, got %d" % len(components))
+        self.components = components
+        self.timed = any(component.timed for component in components)
+        weights = np.ones(len(components)) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.weights = weights / weights.sum()
+        self.bounds = np.cumsum(self.weights)[:-1]
+
+    def sample(self, rng, positions):
+        n = len(positions)
+        u = rng.random(n)
+        # The component of a request is the number of bounds at or below its draw
+        choice = np.zeros(n, dtype=np.uint8)
+        for bound in self.bounds:
+            choice += u >= bound
+        order = np.argsort(choice, kind='stable')
+        grouped = np.empty(n, dtype=np.int64)
+        start = 0
+        for component, count in zip(self.components, np.bincount(choice, minlength=len(self.components)).tolist()):
+            if count:
+                group = positions[order[start:start + count]] if component.timed else positions[:count]
+                grouped[start:start + count] = component.sample(rng, group)
+                start += count
+        keys = np.empty(n, dtype=np.int64)
+        keys[order] = grouped
+        return keys
+
+
+WORKLOADS = {
+    'uniform': Uniform,
+    'zipf': Zipf,
+    'scan': Scan,
+    'hotspot': Hotspot,
+}
+
+
+def parse_spec(spec, key_size):
+    """
+    Builds a workload from e.g. 'zipf:alpha=0.9@0.8+scan:stride=7@0.2' or
+    'bursty:burst_probability=0.1/zipf'. Components are joined with '+' and
+    weighted with '@', parameters follow ':' and a '/' wraps a workload in bursts.
+    """
+    components = []
+    weights = []
+    for part in spec.split('+'):
+        weight = 1.0
+        if '@' in part:
+            part, weight = part.rsplit('@', 1)
+        components.append(_parse_component(part, key_size))
+        weights.append(float(weight))
+    if len(components) == 1:
+        return components[0]
+    return Mixture(components, weights)
+
+
+def _parse_component(part, key_size):
+    if '/' in part:
+        outer, inner = part.split('/', 1)
+        name, params = _parse_params(outer)
+        if name != 'bursty':
+            raise ValueError("only bursty wraps another workload, got %r" % name)
+        return Bursty(_parse_component(inner, key_size), **params)
+    name, params = _parse_params(part)
+    if name not in WORKLOADS:
+        raise ValueError("unknown workload %r, choose from %s" % (name, ', '.join(sorted(WORKLOADS))))
+    return WORKLOADS[name](key_size, **params)
+
+
+def _parse_params(part):
+    name, _, params = part.partition(':')
+    parsed = {}
+    for param in filter(None, params.split(',')):
+        key, value = param.split('=', 1)
+        if value in ('true', 'false'):
+            parsed[key] = value == 'true'
+        else:
+            parsed[key] = float(value) if '.' in value or 'e' in value else int(value)
+    return name.strip(), parsed
+
+
+def generate(workload, n, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Yields n keys of a workload as int64 chunks, the same ones for the same seed and chunk_size. """
+    rng = np.random.default_rng(seed)
+    for start in range(0, n, chunk_size):
+        yield workload.sample(rng, np.arange(start, min(start + chunk_size, n), dtype=np.int64))
+
+
+def generate_keys(workload, n, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    chunks = list(generate(workload, n, seed, chunk_size))
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+
+def write_trace(path, workload, n, seed=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    with TraceWriter(path, workload.key_size) as writer:
+        for keys in generate(workload, n, seed, chunk_size):
+            writer.write(keys)
+        return writer.records
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Generate a synthetic P4kway key trace')
+    parser.add_argument('spec', help="Workload, e.g. 'zipf:alpha=0.9', 'zipf@0.9+scan@0.1', "
+                                     "'hotspot:period=100000', 'bursty:burst_length=4.0/uniform'", type=str)
+    parser.add_argument('-n', '--requests', type=int, required=True)
+    parser.add_argument('-o', '--output', help='Binary trace to write', type=str, required=True)
+    parser.add_argument('--key-size', type=int, required=False, default=16)
+    parser.add_argument('--seed', type=int, required=False, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+    records = write_trace(args.output, parse_spec(args.spec, args.key_size), args.requests, args.seed)
+    print('Wrote {} records to {}'.format(records, args.output), file=sys.stderr)